@@ -0,0 +1,556 @@
+import os
+import io
+import re
+import sys
+import json
+import time
+import email
+import imaplib
+import random
+import shutil
+import struct
+import zlib
+import argparse
+import tempfile
+import threading
+import statistics
+import contextlib
+import multiprocessing
+import http.server
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from email.mime.image import MIMEImage
+from email.utils import format_datetime, parsedate_to_datetime
+import datetime
+
+# Le scénario offline passe par ImapSource, qui exige des identifiants : l'IMAP local les accepte tous
+os.environ.setdefault("GMAIL_USER", "")
+os.environ.setdefault("GMAIL_PASSWORD", "")
+
+import process_email as pe
+
+EMAIL_CONTENT_PREFIX = "const emailContent = "
+
+# --- BENCHMARK HORS LIGNE ---
+OFFLINE_UIDVALIDITY = b"1"
+OFFLINE_SHARED_IMAGES = 8    # logos et pictos communs à toutes les newsletters (dédupliqués dans _assets)
+OFFLINE_SHARED_LINKS = 20    # liens de pied de page communs (servis par le cache des redirections)
+OFFLINE_WORDS = ("marché économie politique élection santé recherche climat énergie culture cinéma musique "
+                 "sport football éducation université entreprise innovation numérique sécurité données réseau "
+                 "europe région ville transport logement emploi salaire budget impôt banque crédit").split()
+
+# --- CORPUS ---
+def load_corpus(folder):
+    # Le HTML nettoyé de chaque archive est dans son content.html ; les archives plus anciennes
+    # l'embarquent dans index.html sous forme de chaîne JSON
+    corpus = []
+    for name in sorted(pe.list_archive_folders() if folder == pe.OUTPUT_FOLDER else os.listdir(folder)):
+        content_path = os.path.join(folder, name, "content.html")
+        if os.path.isfile(content_path):
+            with open(content_path, 'r', encoding='utf-8') as f:
+                corpus.append((name, f.read()))
+            continue
+        path = os.path.join(folder, name, "index.html")
+        if not os.path.isfile(path): continue
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line.startswith(EMAIL_CONTENT_PREFIX):
+                    corpus.append((name, json.loads(line[len(EMAIL_CONTENT_PREFIX):].rstrip(';'))))
+                    break
+    return corpus
+
+# --- ANCIENNE IMPLÉMENTATION (un parcours complet de l'arbre par étape) ---
+def legacy_transform(soup):
+    pixels = []
+    for img in soup.find_all("img"):
+        for attr in pe.LAZY_ATTRS:
+            if img.get(attr):
+                img['src'] = img[attr]
+                del img[attr]
+                break
+        if img.get('srcset'):
+            if not img.get('src'):
+                img['src'] = img['srcset'].split(',')[0].split(' ')[0]
+            del img['srcset']
+        src = img.get("src", "")
+        rule = src and pe.detect_tracking_image(img, src)
+        if rule:
+            pixels.append((src, rule))
+            img['src'] = ""
+            img['alt'] = "[TRACKING PIXEL REMOVED]"
+            img['style'] = "display:none !important;"
+
+    for s in soup(["script", "iframe", "object", "meta"]):
+        s.extract()
+
+    for div in soup.find_all("div"):
+        if any(k in div.get_text() for k in pe.FORWARD_MARKERS) and "-----" in div.get_text():
+            new_body = soup.new_tag("body")
+            for sibling in div.next_siblings: new_body.append(sibling)
+            if soup.body:
+                soup.body.replace_with(new_body)
+            break
+
+    text = soup.get_text(separator=" ", strip=True)
+    links = soup.find_all('a', href=True)
+
+    images = []
+    for img in soup.find_all("img"):
+        src = img.get("src")
+        if not src or src.startswith("data:") or src.startswith("cid:"): continue
+        images.append(src)
+
+    styles = []
+    for tag in soup.find_all(style=True):
+        if 'url' in tag['style']:
+            urls = [u.strip() for u in pe.CSS_URL_PATTERN.findall(tag['style'])]
+            kept = []
+            for u in urls:
+                if u.startswith("data:"): continue
+                rule = pe.get_tracker_matcher().match(u)
+                if rule: pixels.append((u, rule))
+                else: kept.append(u)
+            if kept: styles.append(kept)
+
+    return {"pixels": pixels, "links": links, "images": images, "styles": styles, "text": text}
+
+def time_transform(html_content, transform, parser, repeats):
+    timings = []
+    for _ in range(repeats):
+        soup = pe.parse_html(html_content, parser)
+        start = time.perf_counter()
+        transform(soup)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+# --- SERVEUR HTTP LOCAL (images et chaînes de redirections) ---
+def make_png(width, height, seed):
+    # Pixels pseudo-aléatoires : l'image compresse mal, comme une vraie photo
+    rng = random.Random(seed)
+    raw = b"".join(b"\x00" + bytes(rng.getrandbits(8) for _ in range(width * 3)) for _ in range(height))
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(raw)) + chunk(b"IEND", b""))
+
+PIXEL_GIF = b"GIF89a\x01\x00\x01\x00\x80\x00\x00\x00\x00\x00\xff\xff\xff!\xf9\x04\x01\x00\x00\x00\x00,\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02\x02D\x01\x00;"
+
+class AssetRequestHandler(http.server.BaseHTTPRequestHandler):
+    # /img/<n>.png : image déterministe ; /px/<n>.gif : pixel 1x1 ; /r/<sauts>/<clé> : redirections vers /l/<clé>
+    protocol_version = "HTTP/1.1"
+    images = {}
+    images_lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def get_image(self, n):
+        with self.images_lock:
+            if n not in self.images:
+                rng = random.Random(n)
+                self.images[n] = make_png(rng.randint(40, 160), rng.randint(30, 100), n)
+            return self.images[n]
+
+    def reply(self, status, body=b"", headers=None, send_body=True):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if send_body and body: self.wfile.write(body)
+
+    def route(self, send_body):
+        if self.server.latency: time.sleep(self.server.latency)
+        path = self.path.split("?", 1)[0]
+        match = re.match(r"^/(img|px)/(\d+)\.\w+$", path)
+        if match:
+            kind, n = match.group(1), int(match.group(2))
+            etag = f'"{kind}{n}"'
+            if self.headers.get("If-None-Match") == etag:
+                return self.reply(304, headers={"ETag": etag})
+            body = self.get_image(n) if kind == "img" else PIXEL_GIF
+            content_type = "image/png" if kind == "img" else "image/gif"
+            return self.reply(200, body, {"Content-Type": content_type, "ETag": etag}, send_body)
+        match = re.match(r"^/r/(\d+)/([\w-]+)$", path)
+        if match:
+            hops, key = int(match.group(1)), match.group(2)
+            location = f"/r/{hops - 1}/{key}" if hops > 1 else f"/l/{key}"
+            return self.reply(302, headers={"Location": location})
+        return self.reply(200, b"ok", {"Content-Type": "text/plain"}, send_body)
+
+    def do_HEAD(self):
+        self.route(False)
+
+    def do_GET(self):
+        self.route(True)
+
+def start_asset_server(latency):
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), AssetRequestHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+# --- CORPUS SYNTHÉTIQUE ---
+def make_paragraph(rng, words):
+    return " ".join(rng.choice(OFFLINE_WORDS) for _ in range(words)).capitalize() + "."
+
+def make_newsletter(index, base_url, links, images, seed):
+    # Mise en page à base de tableaux imbriqués, comme les newsletters réelles : en-tête, articles, pied de page
+    rng = random.Random(seed * 100003 + index)
+    cid_images = {}
+    blocks = []
+    article_count = max(1, images - 2)
+    links_per_article = max(1, (links - OFFLINE_SHARED_LINKS) // article_count)
+    for article in range(article_count):
+        if index % 3 == 0 and article < 2:
+            # Quelques images jointes au message (cid:)
+            content_id = f"img{index}-{article}@bench"
+            cid_images[content_id] = make_png(rng.randint(40, 120), rng.randint(30, 80), index * 1000 + article)
+            src = f"cid:{content_id}"
+        else:
+            src = f"{base_url}/img/{OFFLINE_SHARED_IMAGES + index * 1000 + article}.png"
+        article_links = "".join(
+            f'<a href="{base_url}/r/{rng.randint(0, 3)}/m{index}-a{article}-{k}?utm_source=newsletter&amp;utm_medium=email" '
+            f'style="color:#0070f3">{rng.choice(OFFLINE_WORDS)}</a> '
+            for k in range(links_per_article))
+        blocks.append(f"""
+        <tr><td style="padding:12px 24px">
+          <table role="presentation" width="100%" cellpadding="0" cellspacing="0" border="0"><tr>
+            <td width="160" valign="top"><img src="{src}" width="150" alt="{rng.choice(OFFLINE_WORDS)}" style="display:block;border:0"></td>
+            <td valign="top" style="font-family:Arial,sans-serif;font-size:14px;line-height:20px;color:#333">
+              <h2 style="margin:0 0 8px;font-size:18px">{make_paragraph(rng, 6)}</h2>
+              <p style="margin:0 0 8px">{make_paragraph(rng, rng.randint(40, 120))}</p>
+              <p style="margin:0">{article_links}</p>
+            </td>
+          </tr></table>
+        </td></tr>""")
+    shared_links = "".join(f'<a href="{base_url}/r/2/footer-{k}">lien {k}</a> | ' for k in range(OFFLINE_SHARED_LINKS))
+    shared_images = "".join(f'<img src="{base_url}/img/{k}.png" width="24" height="24" alt="">' for k in range(OFFLINE_SHARED_IMAGES))
+    body = f"""<!DOCTYPE html><html><head><meta charset="utf-8"><style>@media (max-width:600px){{.col{{width:100%!important}}}}</style></head>
+<body style="margin:0;background:#f4f4f4">
+<div style="display:none;max-height:0;overflow:hidden">{make_paragraph(rng, 20)}</div>
+<table role="presentation" width="100%" cellpadding="0" cellspacing="0" border="0" bgcolor="#f4f4f4"><tr><td align="center">
+  <table role="presentation" class="col" width="600" cellpadding="0" cellspacing="0" border="0" bgcolor="#ffffff">
+    <tr><td style="background:url({base_url}/img/{OFFLINE_SHARED_IMAGES + index * 1000 + 999}.png) center/cover;padding:24px">
+      <img src="{base_url}/img/0.png" width="120" alt="Logo"><h1 style="font-family:Georgia,serif">{make_paragraph(rng, 5)}</h1>
+    </td></tr>{"".join(blocks)}
+    <tr><td style="padding:24px;font-size:11px;color:#999">{shared_images}<br>{shared_links}
+      <a href="{base_url}/r/1/unsubscribe-{index}">Se désinscrire</a></td></tr>
+  </table>
+</td></tr></table>
+<img src="{base_url}/px/{index}.gif" alt=""><img src="https://www.google-analytics.com/collect?v=1&amp;tid={index}" width="1" height="1">
+</body></html>"""
+
+    html_part = MIMEText(body, "html", "utf-8")
+    if cid_images:
+        message = MIMEMultipart("related")
+        message.attach(html_part)
+        for content_id, content in cid_images.items():
+            image = MIMEImage(content, "png")
+            image["Content-ID"] = f"<{content_id}>"
+            message.attach(image)
+    else:
+        message = html_part
+    sent = datetime.datetime(2024, 1, 1, 8, tzinfo=datetime.timezone.utc) + datetime.timedelta(days=index * 3)
+    message["Subject"] = f"Newsletter n°{index} : {make_paragraph(rng, 4)}"
+    message["From"] = f"Rédaction {index % 7} <news{index % 7}@example.com>"
+    message["Date"] = format_datetime(sent)
+    message["Message-ID"] = f"<bench-{seed}-{index}@example.com>"
+    return message.as_bytes()
+
+def write_corpus(folder, count, base_url, links, images, seed):
+    os.makedirs(folder, exist_ok=True)
+    for index in range(count):
+        with open(os.path.join(folder, f"{index:05d}.eml"), "wb") as f:
+            f.write(make_newsletter(index, base_url, links, images, seed))
+
+# --- BOÎTE IMAP LOCALE (fichiers .eml) ---
+def quote_imap(value):
+    return "NIL" if value is None else '"' + str(value).replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+def build_bodystructure(part):
+    if part.is_multipart():
+        children = "".join(build_bodystructure(child) for child in part.get_payload())
+        return f'({children} {quote_imap(part.get_content_subtype().upper())} ("BOUNDARY" {quote_imap(part.get_boundary())}))'
+    params = part.get_params()[1:] if part.get_params() else []
+    param_list = "(" + " ".join(f"{quote_imap(k.upper())} {quote_imap(v)}" for k, v in params) + ")" if params else "NIL"
+    payload = part.get_payload(decode=False)
+    fields = [quote_imap(part.get_content_maintype().upper()), quote_imap(part.get_content_subtype().upper()), param_list,
+              quote_imap(part.get("Content-ID")), "NIL", quote_imap((part.get("Content-Transfer-Encoding") or "7BIT").upper()),
+              str(len(payload) if isinstance(payload, str) else 0)]
+    if part.get_content_maintype() == "text":
+        fields.append(str(payload.count("\n") if isinstance(payload, str) else 0))
+    return "(" + " ".join(fields) + ")"
+
+class LocalIMAP:
+    # Ce que process_email attend de imaplib.IMAP4_SSL : SELECT, UID SEARCH et UID FETCH (en-têtes, BODYSTRUCTURE, parties)
+    paths = []
+
+    def __init__(self, host=None, *args, **kwargs):
+        self.messages = {uid: path for uid, path in enumerate(self.paths, 1)}
+        self.responses = {}
+
+    def login(self, user, password):
+        return "OK", [b"LOGIN completed"]
+
+    def select(self, mailbox):
+        self.responses["UIDVALIDITY"] = [OFFLINE_UIDVALIDITY]
+        return "OK", [str(len(self.messages)).encode()]
+
+    def response(self, code):
+        return code, self.responses.pop(code, [None])
+
+    def read(self, uid):
+        with open(self.messages[uid], "rb") as f:
+            return f.read()
+
+    def fetch_items(self, uid, raw, spec):
+        msg = email.message_from_bytes(raw)
+        header = raw.replace(b"\r\n", b"\n").split(b"\n\n", 1)[0].replace(b"\n", b"\r\n") + b"\r\n\r\n"
+        items = []
+        prefix = f"{uid} (UID {uid} RFC822.SIZE {len(raw)}"
+        if "INTERNALDATE" in spec:
+            prefix += " INTERNALDATE " + imaplib.Time2Internaldate(parsedate_to_datetime(msg["Date"]))
+        for item in re.findall(r"BODYSTRUCTURE|BODY\.PEEK\[[^\]]*\]|RFC822(?![.\w])", spec):
+            if item == "BODYSTRUCTURE":
+                prefix += " BODYSTRUCTURE " + build_bodystructure(msg)
+                continue
+            if item == "RFC822":
+                name, data = "RFC822", raw
+            else:
+                section = item[len("BODY.PEEK["):item.index("]")]
+                name = f"BODY[{section}]"
+                if section == "HEADER":
+                    data = header
+                elif section.startswith("HEADER.FIELDS"):
+                    fields = section[section.index("(") + 1:section.index(")")].split()
+                    data = b"".join(f"{field}: {msg[field]}\r\n".encode() for field in fields if msg[field]) + b"\r\n"
+                else:
+                    part = msg
+                    for n in section.split("."):
+                        part = part.get_payload()[int(n) - 1] if part.is_multipart() else part
+                    data = part.get_payload(decode=False).encode("latin-1")
+            items.append((f"{prefix} {name} {{{len(data)}}}".encode(), data))
+            prefix = ""
+        if prefix: items.append(prefix.encode())
+        items.append(b")")
+        return items
+
+    def uid(self, command, *args):
+        command = command.upper()
+        if command == "SEARCH":
+            return "OK", [b" ".join(str(uid).encode() for uid in self.messages)]
+        if command == "FETCH":
+            uid_set, spec = args[0].decode() if isinstance(args[0], bytes) else str(args[0]), args[1]
+            wanted = []
+            for chunk in uid_set.split(","):
+                first, _, last = chunk.partition(":")
+                wanted.extend(uid for uid in self.messages if int(first) <= uid <= int(last or first))
+            data = []
+            for uid in wanted:
+                data.extend(self.fetch_items(uid, self.read(uid), spec))
+            return "OK", data
+        return "NO", [b"unsupported"]
+
+    def close(self):
+        return "OK", [b""]
+
+    def logout(self):
+        return "BYE", [b""]
+
+def run_offline_scenario(output_folder, paths, report_path, force, workers, verbose):
+    # Exécuté dans un processus neuf : caches en mémoire vides et pic de RSS propre à chaque scénario
+    # Cache brut à côté de docs/ : le ménage d'un run supprimerait sinon le vrai cache du dépôt
+    saved = pe.OUTPUT_FOLDER, pe.RUN_REPORT_FILE, pe.RAW_CACHE_FOLDER
+    pe.OUTPUT_FOLDER = output_folder
+    pe.RUN_REPORT_FILE = report_path
+    pe.RAW_CACHE_FOLDER = os.path.join(os.path.dirname(output_folder), "raw")
+    pe.imaplib.IMAP4_SSL = LocalIMAP
+    LocalIMAP.paths = paths
+    try:
+        with contextlib.redirect_stdout(sys.stdout if verbose else io.StringIO()):
+            pe.process_emails(force=force, workers=workers)
+    finally:
+        pe.OUTPUT_FOLDER, pe.RUN_REPORT_FILE, pe.RAW_CACHE_FOLDER = saved
+
+# --- BENCHMARKS ---
+def bench_dom(args):
+    corpus = load_corpus(args.corpus)
+    if not corpus:
+        print(f"Aucune archive trouvée dans {args.corpus}.")
+        return
+
+    rows = []
+    total_legacy = total_pipeline = 0.0
+    for name, html_content in corpus:
+        # Vérifie que le pipeline produit exactement le même document que l'ancienne implémentation
+        legacy_soup = pe.parse_html(html_content, args.parser)
+        legacy = legacy_transform(legacy_soup)
+        pipeline_soup = pe.parse_html(html_content, args.parser)
+        pipeline = pe.transform_email(pipeline_soup)
+        identical = (str(legacy_soup) == str(pipeline_soup) and legacy["text"] == pipeline["text"]
+                     and len(legacy["links"]) == len(pipeline["links"]) and sorted(legacy["pixels"]) == sorted(pipeline["pixels"]))
+
+        legacy_time = time_transform(html_content, legacy_transform, args.parser, args.repeats)
+        pipeline_time = time_transform(html_content, pe.transform_email, args.parser, args.repeats)
+        total_legacy += legacy_time
+        total_pipeline += pipeline_time
+        rows.append([name, f"{len(html_content) // 1024}", f"{legacy_time * 1000:.1f}", f"{pipeline_time * 1000:.1f}",
+                     f"{legacy_time / pipeline_time:.1f}x", "oui" if identical else "NON"])
+
+    rows.append(["TOTAL", "", f"{total_legacy * 1000:.1f}", f"{total_pipeline * 1000:.1f}", f"{total_legacy / total_pipeline:.1f}x", ""])
+    print(f"Transformation DOM ({len(corpus)} archives, médiane de {args.repeats} essais, parser {args.parser}) :")
+    pe.print_table(["archive", "Ko", "ancien (ms)", "pipeline (ms)", "gain", "identique"], rows)
+
+def bench_parsers(args):
+    corpus = load_corpus(args.corpus)
+    if not corpus:
+        print(f"Aucune archive trouvée dans {args.corpus}.")
+        return
+
+    parsers = [p for p in ("html.parser", "lxml") if p == "html.parser" or pe.DEFAULT_HTML_PARSER == "lxml"]
+    totals = {p: 0.0 for p in parsers}
+    rows = []
+    for name, html_content in corpus:
+        row = [name, f"{len(html_content) // 1024}"]
+        outputs = set()
+        for parser in parsers:
+            timings = []
+            for _ in range(args.repeats):
+                start = time.perf_counter()
+                soup = pe.parse_html(html_content, parser)
+                pe.transform_email(soup)
+                timings.append(time.perf_counter() - start)
+            outputs.add(str(soup))
+            totals[parser] += statistics.median(timings)
+            row.append(f"{statistics.median(timings) * 1000:.1f}")
+        row.append("oui" if len(outputs) == 1 else "NON")
+        rows.append(row)
+
+    rows.append(["TOTAL", ""] + [f"{totals[p] * 1000:.1f}" for p in parsers] + [""])
+    print(f"Parsing + transformation ({len(corpus)} archives, médiane de {args.repeats} essais) :")
+    pe.print_table(["archive", "Ko"] + [f"{p} (ms)" for p in parsers] + ["identique"], rows)
+    if len(parsers) > 1:
+        print(f"Gain lxml : {totals['html.parser'] / totals['lxml']:.1f}x")
+
+def run_scenario_process(name, output_folder, paths, force, workers, verbose):
+    report_path = os.path.join(os.path.dirname(output_folder), f"report-{name}.json")
+    context = multiprocessing.get_context("spawn")
+    process = context.Process(target=run_offline_scenario, args=(output_folder, paths, report_path, force, workers, verbose))
+    process.start()
+    process.join()
+    if process.exitcode != 0 or not os.path.exists(report_path):
+        raise RuntimeError(f"scénario {name} interrompu (code {process.exitcode})")
+    with open(report_path, encoding="utf-8") as f:
+        return json.load(f)
+
+def summarize_scenario(name, report):
+    done = [record for record in report["messages"] if record["status"] == "done"]
+    errors = [record for record in report["messages"] if record["status"] == "error"]
+    latencies = [record["elapsed"] for record in done]
+    totals = report["totals"]
+    pipeline_seconds = report["stages"].get("pipeline", {}).get("seconds", 0.0)
+    return {
+        "scenario": name,
+        "messages": len(done),
+        "errors": len(errors),
+        "duration": report["duration"],
+        "throughput": len(done) / pipeline_seconds if done and pipeline_seconds else None,
+        "p50_ms": statistics.median(latencies) * 1000 if latencies else None,
+        "p95_ms": pe.percentile(latencies, 0.95) * 1000 if latencies else None,
+        "peak_rss_mb": report.get("memory_peak_mb"),
+        "http_requests": totals.get("http_requests", 0),
+        "redirect_hits": totals.get("redirect_hits", 0),
+        "assets_not_modified": totals.get("assets_not_modified", 0),
+        "stages": {stage: summary["seconds"] for stage, summary in report["stages"].items()}
+    }
+
+def bench_offline(args):
+    workdir = args.workdir or tempfile.mkdtemp(prefix="newsletter-bench-")
+    server = start_asset_server(args.latency / 1000)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        # Le corpus pointe vers le port du serveur de ce run : il est régénéré à chaque fois (quelques secondes)
+        corpus_folder = os.path.join(workdir, "corpus")
+        output_folder = os.path.join(workdir, "docs")
+        shutil.rmtree(corpus_folder, ignore_errors=True)
+        shutil.rmtree(output_folder, ignore_errors=True)
+        shutil.rmtree(os.path.join(workdir, "raw"), ignore_errors=True)
+        start = time.perf_counter()
+        write_corpus(corpus_folder, args.messages + args.incremental, base_url, args.links, args.images, args.seed)
+        paths = sorted(os.path.join(corpus_folder, name) for name in os.listdir(corpus_folder))
+        corpus_size = sum(os.path.getsize(path) for path in paths)
+        print(f"Corpus : {len(paths)} emails, {corpus_size / (1024 * 1024):.1f} Mo, généré en {time.perf_counter() - start:.1f} s "
+              f"({args.links} liens et {args.images} images par email, latence HTTP {args.latency:g} ms).")
+
+        # Même dossier de sortie d'un scénario à l'autre : chacun part de l'état laissé par le précédent
+        workers = args.workers or None
+        scenarios = [
+            ("cold", paths[:args.messages], False),          # docs/ et caches vides
+            ("warm", paths[:args.messages], True),           # tout régénérer, caches de redirections et d'images remplis
+            ("incremental", paths, False),                   # seuls les nouveaux emails sont traités
+            ("noop", paths, False),                          # run cron sans nouveauté
+        ]
+        results = []
+        for name, scenario_paths, force in scenarios:
+            report = run_scenario_process(name, output_folder, scenario_paths, force, workers if force else None, args.verbose)
+            results.append(summarize_scenario(name, report))
+
+        rows = []
+        for result in results:
+            rows.append([result["scenario"], result["messages"], f"{result['duration']:.2f}",
+                         f"{result['throughput']:.1f}" if result["throughput"] else "",
+                         f"{result['p50_ms']:.0f}" if result["p50_ms"] is not None else "",
+                         f"{result['p95_ms']:.0f}" if result["p95_ms"] is not None else "",
+                         f"{result['peak_rss_mb']:.0f}" if result["peak_rss_mb"] else "",
+                         result["http_requests"], result["redirect_hits"], result["errors"]])
+        print(f"Benchmark hors ligne{f' ({workers} processus pour warm)' if workers else ''} :")
+        pe.print_table(["scénario", "emails", "durée (s)", "emails/s", "p50 (ms)", "p95 (ms)", "pic RSS (Mo)",
+                        "requêtes HTTP", "hits redirections", "erreurs"], rows)
+
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump({"messages": args.messages, "incremental": args.incremental, "links": args.links,
+                           "images": args.images, "latency_ms": args.latency, "seed": args.seed,
+                           "workers": workers, "scenarios": results}, f, ensure_ascii=False, indent=2)
+            print(f"Résultats écrits dans {args.output}.")
+    finally:
+        server.shutdown()
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="benchmark.py", description="Benchmarks hors ligne du traitement des newsletters.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    dom_parser = subparsers.add_parser("dom", help="ancien traitement multi-parcours vs pipeline DOM en un parcours")
+    dom_parser.add_argument("--corpus", default=pe.OUTPUT_FOLDER, help="dossier des archives (défaut : docs)")
+    dom_parser.add_argument("--repeats", type=int, default=5)
+    dom_parser.add_argument("--parser", default=pe.HTML_PARSER)
+    dom_parser.set_defaults(func=bench_dom)
+
+    parsers_parser = subparsers.add_parser("parsers", help="html.parser vs lxml sur le corpus archivé")
+    parsers_parser.add_argument("--corpus", default=pe.OUTPUT_FOLDER, help="dossier des archives (défaut : docs)")
+    parsers_parser.add_argument("--repeats", type=int, default=5)
+    parsers_parser.set_defaults(func=bench_parsers)
+
+    offline_parser = subparsers.add_parser("offline", help="runs complets hors ligne : corpus .eml synthétique, HTTP et IMAP locaux")
+    offline_parser.add_argument("--messages", type=int, default=50, help="emails du run initial (défaut : 50)")
+    offline_parser.add_argument("--incremental", type=int, default=5, help="emails ajoutés pour le run incrémental (défaut : 5)")
+    offline_parser.add_argument("--links", type=int, default=150, help="liens par email (défaut : 150)")
+    offline_parser.add_argument("--images", type=int, default=20, help="images par email (défaut : 20)")
+    offline_parser.add_argument("--latency", type=float, default=5.0, help="latence ajoutée à chaque requête HTTP, en ms (défaut : 5)")
+    offline_parser.add_argument("--workers", type=int, default=0, help="processus pour le scénario warm (--rebuild) ; 0 = pipeline en threads")
+    offline_parser.add_argument("--seed", type=int, default=1)
+    offline_parser.add_argument("--workdir", help="dossier de travail conservé après le run (défaut : temporaire)")
+    offline_parser.add_argument("--output", help="écrit les résultats en JSON, pour comparer deux versions")
+    offline_parser.add_argument("--verbose", action="store_true", help="affiche la sortie de process_email")
+    offline_parser.set_defaults(func=bench_offline)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
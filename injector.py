@@ -2,10 +2,12 @@ import streamlit as st
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-from bs4 import BeautifulSoup
 from urllib.parse import urljoin
 import re
 
+# Même parser et même normalisation de l'arbre que l'archiveur (lxml si installé)
+from process_email import parse_html
+
 # Configuration de la page
 st.set_page_config(page_title="Newsletter Injector", page_icon="💉")
 
@@ -43,7 +45,7 @@ if submitted:
         try:
             with st.spinner("Traitement du HTML (Nettoyage avancé)..."):
                 
-                soup = BeautifulSoup(html_content, "html.parser")
+                soup = parse_html(html_content)
                 
                 # --- ÉTAPE 1 : GESTION AVANCÉE DU LAZY LOADING ---
                 # On liste les attributs potentiels utilisés par les sites comme La Redoute
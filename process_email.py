@@ -1,46 +1,221 @@
 import imaplib
 import email
 from email.header import decode_header
+from email.mime.multipart import MIMEMultipart
+from email.mime.nonmultipart import MIMENonMultipart
+from email import encoders
 from email.utils import parsedate_to_datetime, parseaddr
-from bs4 import BeautifulSoup
 import os
 import re
 import mimetypes
-import requests
-from urllib.parse import urljoin
+from urllib.parse import urljoin, urlparse, unquote
 import datetime
 import hashlib
+import gzip
 import shutil
 import json
 import html
+import base64
+import binascii
+import quopri
+import struct
+import itertools
+import unicodedata
 import time
+import argparse
+import sys
+import signal
+import select
+import ssl
+import threading
+import queue
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import multiprocessing
+import mailbox
+import contextlib
+import io
+import cProfile
+import pstats
+import tracemalloc
+from collections import OrderedDict
 
 # --- CONFIGURATION ---
-GMAIL_USER = os.environ["GMAIL_USER"]
-GMAIL_PASSWORD = os.environ["GMAIL_PASSWORD"]
+# Identifiants Gmail (GMAIL_USER, GMAIL_PASSWORD) lus à la connexion seulement : index, reprocess et import s'en passent.
+# bs4 et requests ne sont importés qu'au premier email à traiter, pour que ces commandes démarrent vite.
 TARGET_LABEL = "Github/archive-newsletters"
 OUTPUT_FOLDER = "docs"
 BATCH_SIZE = 9999
 
+# --- SYNCHRO INCRÉMENTALE ---
+# Manifeste persistant (dans docs/, donc commité avec les archives) : un enregistrement par dossier
+MANIFEST_FILE = "manifest.json"
+# À incrémenter dès que le rendu change, pour forcer la régénération des archives existantes
+PROCESSING_VERSION = 7
+
+# --- STOCKAGE DES IMAGES ---
+# Chaque image est stockée une seule fois sous son empreinte SHA-256 : docs/_assets/ab/abcdef....png
+ASSETS_FOLDER = "_assets"
+LEGACY_ASSET_PATTERN = re.compile(r'^(?:img|bg)_\d+\.\w+$')
+ASSET_REF_PATTERN = re.compile(ASSETS_FOLDER + r'/[0-9a-f]{2}/[0-9a-f]{64}\.\w+')
+# CSS/JS partagés des pages, nommés d'après leur empreinte
+STATIC_FOLDER = "_static"
+STATIC_REF_PATTERN = re.compile(STATIC_FOLDER + r'/[\w-]+\.[0-9a-f]{12}\.\w+')
+
+# --- SOMMAIRE ---
+# Seule la première page est rendue dans index.html ; le reste est listé dans index.json et des fichiers par mois
+HUB_PAGE_SIZE = 10
+LISTING_FILE = "index.json"
+LISTING_FOLDER = "_index"
+LISTING_FIELDS = ["folder", "title", "sender", "preheader", "date_rec", "date_arch"]
+
+# --- RECHERCHE PLEIN TEXTE ---
+# Index inversé terme -> [[dossier, occurrences], ...], réparti dans _search/<2 premières lettres>.json.
+# Le pliage (minuscules, sans accents ni ligatures) doit rester identique à foldText() côté navigateur.
+SEARCH_FOLDER = "_search"
+SEARCH_DOCS_FILE = "docs.json"
+SEARCH_PREFIX_LENGTH = 2
+SEARCH_MIN_TERM_LENGTH = 2
+SEARCH_TERM_PATTERN = re.compile(r'[a-z0-9]+')
+SEARCH_LIGATURES = str.maketrans({"œ": "oe", "æ": "ae"})
+
+# --- PARSER HTML ---
+# lxml (C) est bien plus rapide que html.parser sur les gros emails ; repli automatique s'il est absent.
+# Forçable via la variable d'environnement HTML_PARSER ("lxml" ou "html.parser").
+try:
+    import lxml  # noqa: F401
+    DEFAULT_HTML_PARSER = "lxml"
+except ImportError:
+    DEFAULT_HTML_PARSER = "html.parser"
+HTML_PARSER = os.environ.get("HTML_PARSER", DEFAULT_HTML_PARSER)
+
+# Mesure mémoire par message (pic de RSS) ; module absent sous Windows
+try:
+    import resource
+except ImportError:
+    resource = None
+HEAD_TAGS = ("title", "style", "meta", "link", "base")
+
+# --- LECTURE RAPIDE DES MÉTADONNÉES (archives absentes du manifeste) ---
+PAGE_HEAD_CHARS = 16 * 1024
+META_TAG_PATTERN = re.compile(r'<meta\s+name="([\w-]+)"\s+content="([^"]*)"', re.IGNORECASE)
+TITLE_PATTERN = re.compile(r'<title>(.*?)</title>', re.IGNORECASE | re.DOTALL)
+
+# --- RÉCUPÉRATION DES EN-TÊTES ---
+HEADER_FETCH_CHUNK = 500
+HEADER_FIELDS = "SUBJECT FROM DATE MESSAGE-ID"
+# Réponses IMAP : parenthèses, chaînes entre guillemets, littéraux {n} et atomes
+IMAP_TOKEN_PATTERN = re.compile(rb'\(|\)|"((?:\\.|[^"\\])*)"|\{(\d+)\}$|[^\s()"]+')
+CID_REF_PATTERN = re.compile(rb'cid:([^\s"\'<>()]+)', re.IGNORECASE)
+
 HEADERS = {
     'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
 }
 
-# --- LISTE DES MOTIFS DE TRACKING ---
-TRACKING_PATTERNS = [
-    "api.getinside.media",
-    "google-analytics.com",
-    "doubleclick.net",
-    "facebook.com/tr",
-    "criteo.com",
-    "matomo",
-    "pixel.gif",
-    "analytics",
-    "tracking",
-    "open.aspx",
-    "shim.gif",
-    "ad.doubleclick"
-]
+# --- RÉSOLUTION DES REDIRECTIONS ---
+RESOLVE_WORKERS = 16
+PER_HOST_LIMIT = 4        # requêtes simultanées max vers un même domaine (liens et images)
+RESOLVE_TIMEOUT = 2.0     # par requête HEAD
+RESOLVE_DEADLINE = 30.0   # pour l'ensemble des liens d'un email
+
+_http_session = None
+_host_slots = {}
+_executors = {}           # pools de threads partagés par tous les emails en cours d'enrichissement
+_http_lock = threading.Lock()
+
+# --- CACHE DES REDIRECTIONS ---
+# Dossier caché dans OUTPUT_FOLDER : ignoré par generate_index() et par la synchro, non commité
+CACHE_FOLDER = ".cache"
+REDIRECT_CACHE_FILE = "redirects.jsonl"
+REDIRECT_CACHE_TTL = 30 * 24 * 3600          # succès : 30 jours
+REDIRECT_CACHE_NEGATIVE_TTL = 24 * 3600      # échecs / timeouts : 1 jour
+REDIRECT_CACHE_MAX_ENTRIES = 50000
+
+_redirect_cache = None
+
+# --- TÉLÉCHARGEMENT DES IMAGES ---
+DOWNLOAD_WORKERS = 8
+DOWNLOAD_TIMEOUT = 10
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+MAX_ASSET_BYTES = int(os.environ.get("MAX_ASSET_BYTES", 15 * 1024 * 1024))   # au-delà, l'image reste distante
+# URL -> fichier de _assets + ETag/Last-Modified, pour des requêtes conditionnelles aux runs suivants
+ASSET_INDEX_FILE = "assets.jsonl"
+ASSET_INDEX_MAX_ENTRIES = 50000
+
+_asset_index = None
+
+# --- CACHE DES MESSAGES BRUTS ---
+# Chaque message lu est gardé une fois, compressé, hors de docs/ (jamais publié) : .archive_cache/raw/ab/abcdef....eml.gz.
+# --reprocess régénère les archives depuis ce cache, sans IMAP, quand le rendu change.
+RAW_CACHE_FOLDER = os.environ.get("RAW_CACHE_FOLDER", os.path.join(".archive_cache", "raw"))
+RAW_CACHE_LEVEL = 6
+# Chemin (relatif) de l'OUTPUT_FOLDER servi par le cache : le ménage ne touche pas au cache d'un autre dossier de sortie
+RAW_CACHE_OWNER_FILE = "owner"
+# En-têtes remplacés par ceux de la partie HTML quand le message est reconstitué depuis BODYSTRUCTURE
+RAW_CACHE_DROPPED_HEADERS = ("content-", "mime-version")
+
+# --- FILE DE TRAVAIL ---
+# Emails à traiter du plus récent au plus ancien (INTERNALDATE). Avec --budget, plus aucun n'est lancé passé le délai :
+# le reste, et les emails en erreur, sont gardés dans CACHE_FOLDER pour le run suivant.
+QUEUE_FILE = "queue.json"
+CHECKPOINT_INTERVAL = 120   # secondes entre deux sauvegardes du manifeste, de la recherche et du sommaire en cours de run
+# Un seul run à la fois sur OUTPUT_FOLDER (cron qui se chevauchent, daemon)
+LOCK_FILE = "run.lock"
+LOCK_GRACE_PERIOD = 10      # verrou encore vide : son propriétaire est en train d'y écrire son PID
+
+# --- PIPELINE DE TRAITEMENT ---
+PIPELINE_QUEUE_SIZE = 8   # messages en attente max entre deux étapes
+PARSE_WORKERS = 2
+ENRICH_WORKERS = 4        # liens et images : surtout de l'attente réseau
+RENDER_WORKERS = 2
+
+PIPELINE_DONE = object()
+# Copies volumineuses d'un message, libérées dès que l'étape suivante n'en a plus besoin
+JOB_PAYLOAD_KEYS = ("raw", "parts", "inline", "soup", "dom")
+
+# --- LIMITES DE TAILLE ---
+# Un email au HTML démesuré coûterait des centaines de Mo une fois parsé : il est ignoré
+MAX_HTML_BYTES = int(os.environ.get("MAX_HTML_BYTES", 5 * 1024 * 1024))
+# Repli RFC822 : message complet, pièces jointes comprises
+MAX_MESSAGE_BYTES = int(os.environ.get("MAX_MESSAGE_BYTES", 50 * 1024 * 1024))
+
+# --- RAPPORT D'EXÉCUTION ---
+# Durées par étape, octets, requêtes et erreurs par message ; hors de docs/, donc jamais commité
+RUN_REPORT_FILE = os.environ.get("RUN_REPORT_FILE", "run-report.json")
+# --profile : profil cProfile (.prof, lisible avec pstats ou snakeviz) et résumé texte avec les allocations
+PROFILE_FILE = os.environ.get("PROFILE_FILE", "run-profile")
+PROFILE_TOP = 30
+PROFILE_TRACE_DEPTH = 5
+# Ordre d'affichage du tableau récapitulatif (étapes du run, puis étapes par message)
+RUN_STAGES = ["open", "list", "sync", "pipeline", "checkpoint", "search_index", "cleanup", "generate_index"]
+MESSAGE_STAGES = ["fetch", "decode", "parse", "sanitize", "terms", "links", "assets", "render", "write"]
+STATUS_LABELS = {"done": "archivés", "unchanged": "inchangés", "skipped": "sans HTML", "too_large": "trop volumineux", "error": "en erreur"}
+
+_stats_lock = threading.Lock()
+_profilers = None   # profils des threads du pipeline, tenus seulement avec --profile
+
+# --- RECONSTRUCTION MULTI-CŒURS (--rebuild) ---
+REBUILD_WORKERS = os.cpu_count() or 1
+
+# --- MODE DAEMON (--daemon) ---
+# Une seule connexion IMAP gardée ouverte : IDLE (ou NOOP à intervalle régulier) sur TARGET_LABEL,
+# puis traitement des seuls UID arrivés depuis le dernier cycle
+DAEMON_IDLE_TIMEOUT = 25 * 60          # les serveurs coupent un IDLE au bout de 30 min (RFC 2177)
+DAEMON_POLL_INTERVAL = 60              # repli NOOP si le serveur n'annonce pas IDLE
+DAEMON_FULL_SYNC_INTERVAL = 6 * 3600   # synchro complète : suppressions, messages restés en erreur
+DAEMON_BACKOFF_MIN = 5
+DAEMON_BACKOFF_MAX = 300
+IDLE_EVENT_PATTERN = re.compile(rb'^\* \d+ (EXISTS|EXPUNGE)\b', re.IGNORECASE)
+
+# --- DÉTECTION DES TRACEURS ---
+# Règles (domaines, domaine/chemin, /fichier) lues dans trackers.txt et compilées une fois par processus
+TRACKERS_FILE = os.environ.get("TRACKERS_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "trackers.txt"))
+# Heuristiques, limitées aux images qui ne sont pas déclarées plus grandes que 1x1
+TRACKER_MAX_PIXEL_BYTES = 128   # au-delà, une image téléchargée n'est pas un pixel (un GIF 1x1 pèse ~43 octets)
+PIXEL_SIZE_PATTERN = re.compile(r'^\s*(\d+)(?:px)?\s*$')
+STYLE_SIZE_PATTERN = re.compile(r'(?<![\w-])(width|height)\s*:\s*([^;!]*)', re.IGNORECASE)
+HIDDEN_STYLE_PATTERN = re.compile(r'display\s*:\s*none|visibility\s*:\s*hidden', re.IGNORECASE)
+
+_tracker_matcher = None
 
 # --- ICONS SVG ---
 ICON_MOON = '<svg viewBox="0 0 24 24" width="18" height="18" stroke="currentColor" stroke-width="2" fill="none" stroke-linecap="round" stroke-linejoin="round"><path d="M21 12.79A9 9 0 1 1 11.21 3 7 7 0 0 0 21 12.79z"></path></svg>'
@@ -85,7 +260,9 @@ TRANSLATIONS = {
         "legal_hosting": "Hosting",
         "legal_text": "This site is a personal archive.",
         "tooltip_sent": "Received Date",
-        "tooltip_archived": "Archived Date"
+        "tooltip_archived": "Archived Date",
+        "pixel_rule_title": "Matched rule",
+        "link_tracker_title": "Click tracking"
     },
     "fr": {
         "page_title": "Archives Newsletters",
@@ -109,10 +286,74 @@ TRANSLATIONS = {
         "legal_hosting": "Hébergement",
         "legal_text": "Ce site est une archive personnelle.",
         "tooltip_sent": "Date de réception",
-        "tooltip_archived": "Date d'archivage"
+        "tooltip_archived": "Date d'archivage",
+        "pixel_rule_title": "Règle correspondante",
+        "link_tracker_title": "Suivi des clics"
     }
 }
 
+# Styles injectés dans content.html (document de l'iframe) : lisibilité, mode sombre, surlignage des liens
+FRAME_STYLE = """
+html { -ms-overflow-style: none; scrollbar-width: none; }
+html::-webkit-scrollbar { display: none; }
+body::-webkit-scrollbar { display: none; width: 0; }
+body { margin: 0; padding: 0; font-family: Roboto, Helvetica, Arial, sans-serif; color: #222; line-height: 1.5; overflow-wrap: break-word; }
+table { border-spacing: 0; border-collapse: collapse; }
+img { height: auto !important; vertical-align: middle; border: 0; }
+img[style*="display: block"], img[style*="display:block"] { margin-left: auto !important; margin-right: auto !important; }
+a, .link-text { color: #1a0dab; }
+html.dark-mode-internal { filter: invert(1) hue-rotate(180deg); }
+html.dark-mode-internal img, html.dark-mode-internal video, html.dark-mode-internal [style*="background-image"] { filter: invert(1) hue-rotate(180deg); }
+
+/* --- MODIF: BETTER HIGHLIGHT (SHADOW INSTEAD OF BORDER) --- */
+body.highlight-links a { 
+    position: relative; 
+    box-shadow: 0 0 0 3px red, 0 0 10px yellow !important; 
+    background-color: rgba(255, 255, 0, 0.2); 
+    z-index: 9999;
+    display: inline-block;
+}
+/* Filter for images inside links to follow shape */
+body.highlight-links a img { 
+    filter: drop-shadow(0 0 3px red); 
+}
+
+/* --- OVERLAY BADGE STYLE --- */
+.link-badge-overlay {
+    position: absolute;
+    z-index: 2147483647;
+    background: black;
+    color: white;
+    border: 1px solid white;
+    border-radius: 50%;
+    width: 20px;
+    height: 20px;
+    font-size: 10px;
+    font-weight: bold;
+    display: flex;
+    justify-content: center;
+    align-items: center;
+    box-shadow: 0 2px 4px rgba(0,0,0,0.3);
+    pointer-events: none;
+}
+
+@keyframes target-pulse { 
+    0% { transform: scale(1); box-shadow: 0 0 0 0 rgba(255, 0, 0, 0.7); }
+    50% { transform: scale(1.05); box-shadow: 0 0 20px 10px rgba(255, 0, 0, 0); }
+    100% { transform: scale(1); box-shadow: 0 0 0 0 rgba(255, 0, 0, 0); }
+}
+a.flash-target {
+    position: relative;
+    z-index: 99999;
+    outline: 10px solid #ff0000 !important;
+    background-color: rgba(255, 255, 0, 0.5) !important;
+    animation: target-pulse 0.5s ease-in-out 4; /* 4 pulses */
+    box-shadow: 0 0 50px rgba(255,0,0,1); /* Big glow */
+}
+
+@media screen and (max-width: 600px) { table, tbody, tr, td { width: 100% !important; min-width: 0 !important; box-sizing: border-box !important; height: auto !important; } div[style*="width"] { width: 100% !important; max-width: 100% !important; } img { width: auto !important; max-width: 100% !important; } }
+"""
+
 JS_TRANSLATION_LOGIC = f"""
 const TRANSLATIONS = {json.dumps(TRANSLATIONS)};
 let currentLang = localStorage.getItem('lang') || 'en';
@@ -157,17 +398,660 @@ function toggleLanguage() {{
 updateLanguage(currentLang);
 """
 
-def resolve_redirect_chain(start_url, max_redirects=5):
-    if not start_url: return start_url, []
-    if start_url.startswith("mailto:") or start_url.startswith("tel:"): return start_url, []
+# --- RESSOURCES STATIQUES PARTAGÉES ---
+# CSS/JS communs à toutes les pages, publiés une fois dans docs/_static/ sous un nom contenant leur empreinte :
+# le navigateur les garde en cache d'une archive à l'autre, et un changement de style ne réécrit que ces fichiers.
+INDEX_CSS = """
+:root {
+    --bg-body: #f6f9fc; --bg-card: #ffffff; --text-main: #333333; --text-muted: #666666; --text-light: #888888;
+    --border-color: #eaeaea; --accent-color: #0070f3; --hover-bg: #f8f9fa; --input-bg: #fcfcfc; --shadow: rgba(0,0,0,0.05);
+}
+[data-theme="dark"] {
+    --bg-body: #121212; --bg-card: #1e1e1e; --text-main: #e0e0e0; --text-muted: #a0a0a0; --text-light: #666666;
+    --border-color: #333333; --accent-color: #4da3ff; --hover-bg: #252525; --input-bg: #252525; --shadow: rgba(0,0,0,0.3);
+}
+body { font-family: -apple-system, BlinkMacSystemFont, "Segoe UI", Roboto, Helvetica, Arial, sans-serif; background-color: var(--bg-body); color: var(--text-main); margin: 0; padding: 20px; display: flex; flex-direction: column; min-height: 100vh; box-sizing: border-box; transition: background-color 0.3s, color 0.3s; }
+.container { max-width: 800px; width: 100%; margin: 0 auto; background: var(--bg-card); padding: 40px; border-radius: 12px; box-shadow: 0 4px 12px var(--shadow); flex: 1; position: relative; }
+.header-row { display: flex; justify-content: space-between; align-items: center; margin-bottom: 30px; border-bottom: 2px solid var(--border-color); padding-bottom: 20px; }
+h1 { text-align: center; color: var(--text-main); margin: 0; font-size: 1.8rem; flex-grow: 1; }
+.controls { display: flex; gap: 10px; }
+
+#theme-toggle, #lang-toggle { background: none; border: 1px solid var(--border-color); border-radius: 6px; padding: 0 10px; height: 40px; cursor: pointer; font-size: 0.9rem; display: flex; align-items: center; justify-content: center; transition: all 0.2s; color: var(--text-main); }
+#theme-toggle:hover, #lang-toggle:hover { background-color: var(--hover-bg); border-color: var(--accent-color); }
+
+.icon-moon { display: block; }
+.icon-sun { display: none; }
+[data-theme="dark"] .icon-moon { display: none; }
+[data-theme="dark"] .icon-sun { display: block; }
+
+#searchInput { width: 100%; padding: 12px 20px; margin-bottom: 25px; box-sizing: border-box; border: 2px solid var(--border-color); border-radius: 8px; font-size: 16px; background-color: var(--input-bg); color: var(--text-main); transition: border-color 0.3s; }
+#searchInput:focus { border-color: var(--accent-color); outline: none; }
+
+ul { list-style: none; padding: 0; margin: 0; overflow: visible; }
+
+li.news-item { 
+    border: 1px solid var(--border-color); margin-bottom: 12px; border-radius: 8px; background: var(--bg-card);
+    transition: transform 0.2s, box-shadow 0.2s;
+}
+li.news-item:hover { transform: translateY(-2px); box-shadow: 0 4px 12px var(--shadow); border-color: var(--accent-color); z-index: 10; position: relative; }
+
+a.item-link { display: flex; justify-content: space-between; align-items: center; padding: 16px 20px; text-decoration: none; color: var(--text-main); }
+
+.info-col { display: flex; flex-direction: column; flex: 1; min-width: 0; margin-right: 15px; }
+.sender { font-size: 0.8rem; text-transform: lowercase; color: var(--text-muted); margin-bottom: 6px; }
+.title { font-weight: 600; font-size: 1.05rem; color: var(--text-main); margin-bottom: 6px; }
+.preheader-preview { font-size: 0.85rem; color: var(--text-light); white-space: nowrap; overflow: hidden; text-overflow: ellipsis; display: block; }
+
+.date-col { display: flex; flex-direction: column; align-items: flex-end; flex-shrink: 0; margin-left: 10px; }
+.date { font-size: 0.8rem; color: var(--text-main); font-weight: 500; white-space: nowrap; font-variant-numeric: tabular-nums; }
+.date-arch { font-size: 0.7rem; color: var(--text-light); white-space: nowrap; font-variant-numeric: tabular-nums; margin-top: 4px; }
+
+.pagination { display: flex; justify-content: center; gap: 8px; margin-top: 25px; flex-wrap: wrap; }
+.page-btn { background: var(--bg-card); border: 1px solid var(--border-color); color: var(--text-main); padding: 8px 12px; border-radius: 6px; cursor: pointer; font-size: 0.9rem; transition: all 0.2s; }
+.page-btn:hover { background: var(--hover-bg); border-color: var(--accent-color); }
+.page-btn.active { background: var(--accent-color); color: white; border-color: var(--accent-color); }
+.page-btn:disabled { opacity: 0.5; cursor: not-allowed; }
+
+footer { margin-top: 40px; padding-top: 20px; border-top: 1px solid var(--border-color); text-align: center; color: var(--text-muted); font-size: 0.85rem; }
+.copyright a { color: inherit; text-decoration: none; border-bottom: 1px dotted var(--text-muted); transition: color 0.2s; }
+.copyright a:hover { color: var(--accent-color); border-bottom-color: var(--accent-color); }
+details { margin-top: 15px; cursor: pointer; }
+details p { background: var(--hover-bg); padding: 10px; border-radius: 4px; text-align: left; }
+"""
+
+INDEX_JS = """
+const toggleBtn = document.getElementById('theme-toggle');
+const root = document.documentElement;
+const savedTheme = localStorage.getItem('theme');
+const systemDark = window.matchMedia('(prefers-color-scheme: dark)').matches;
+
+if (savedTheme === 'dark' || (!savedTheme && systemDark)) { root.setAttribute('data-theme', 'dark'); }
+
+toggleBtn.addEventListener('click', () => {
+    const currentTheme = root.getAttribute('data-theme');
+    const newTheme = currentTheme === 'dark' ? 'light' : 'dark';
+    root.setAttribute('data-theme', newTheme);
+    localStorage.setItem('theme', newTheme);
+});
+
+const list = document.getElementById("newsList");
+const itemsPerPage = parseInt(list.dataset.pageSize, 10) || 10;
+const totalItems = parseInt(list.dataset.total, 10) || 0;
+const firstPageHtml = list.innerHTML;
+const paginationContainer = document.getElementById('pagination');
+const SEARCH_DEBOUNCE_MS = 200;
+let currentPage = 1;
+let searchResults = null;
+let searchToken = 0;
+let searchTimer = null;
+let listing = null;
+let docMonths = null;
+const shards = {};
+const searchShards = {};
+
+function fetchJson(url, options) {
+    return fetch(url, options).then(response => {
+        if (!response.ok) throw new Error(url + ' : ' + response.status);
+        return response.json();
+    });
+}
+
+function loadListing(reload) {
+    if (!listing || reload) listing = fetchJson('index.json', reload ? { cache: 'reload' } : undefined);
+    return listing;
+}
+
+function loadShard(month) {
+    if (!shards[month.file]) {
+        shards[month.file] = fetchJson(month.file).catch(err => { delete shards[month.file]; throw err; });
+    }
+    return shards[month.file];
+}
+
+async function loadEntries(start, end) {
+    // Only the months covering [start, end) are fetched. A stale index.json (month rewritten since) is reloaded once.
+    for (let attempt = 0; ; attempt++) {
+        const data = await loadListing(attempt > 0);
+        const wanted = [];
+        let offset = 0;
+        data.months.forEach(month => {
+            if (offset < end && offset + month.count > start) wanted.push({ month, offset });
+            offset += month.count;
+        });
+        try {
+            const loaded = await Promise.all(wanted.map(w => loadShard(w.month)));
+            const entries = [];
+            loaded.forEach((rows, i) => rows.forEach((row, j) => {
+                const index = wanted[i].offset + j;
+                if (index >= start && index < end) entries.push(toEntry(data.fields, row));
+            }));
+            return entries;
+        } catch (err) {
+            if (attempt > 0) throw err;
+        }
+    }
+}
+
+function toEntry(fields, row) {
+    const entry = {};
+    fields.forEach((field, k) => { entry[field] = row[k]; });
+    return entry;
+}
+
+function loadDocMonths() {
+    if (!docMonths) docMonths = fetchJson('_search/docs.json').catch(err => { docMonths = null; throw err; });
+    return docMonths;
+}
+
+async function loadEntriesByFolder(folders) {
+    // Only the months holding the requested newsletters are fetched
+    const [data, months] = await Promise.all([loadListing(), loadDocMonths()]);
+    const files = {};
+    data.months.forEach(month => { files[month.month] = month; });
+    const wanted = [...new Set(folders.map(folder => months[folder]).filter(month => files[month]))];
+    const loaded = await Promise.all(wanted.map(month => loadShard(files[month])));
+    const byFolder = {};
+    loaded.forEach(rows => rows.forEach(row => {
+        const entry = toEntry(data.fields, row);
+        byFolder[entry.folder] = entry;
+    }));
+    return folders.map(folder => byFolder[folder]).filter(Boolean);
+}
+
+// Same folding as fold_text() in process_email.py: lowercase, no accents, no ligatures
+function foldText(text) {
+    return text.toLowerCase().replace(/œ/g, 'oe').replace(/æ/g, 'ae').normalize('NFKD').replace(/\\p{M}/gu, '');
+}
+
+function loadSearchShard(prefix) {
+    if (!searchShards[prefix]) {
+        // A missing shard simply means no indexed term starts with this prefix
+        searchShards[prefix] = fetch('_search/' + prefix + '.json').then(response => response.ok ? response.json() : {});
+    }
+    return searchShards[prefix];
+}
+
+async function searchIndex(query) {
+    const terms = (foldText(query).match(/[a-z0-9]+/g) || []).filter(term => term.length >= 2);
+    if (!terms.length) return null;
+    const [indexShards, months] = await Promise.all([Promise.all(terms.map(term => loadSearchShard(term.slice(0, 2)))), loadDocMonths()]);
+
+    // Every term must match; the last one is a prefix, so results show up while typing
+    let scores = null;
+    terms.forEach((term, i) => {
+        const isLast = i === terms.length - 1;
+        const found = {};
+        Object.keys(indexShards[i]).forEach(indexed => {
+            if (indexed !== term && !(isLast && indexed.startsWith(term))) return;
+            indexShards[i][indexed].forEach(([folder, count]) => { found[folder] = (found[folder] || 0) + count; });
+        });
+        if (scores === null) {
+            scores = found;
+        } else {
+            const next = {};
+            Object.keys(found).forEach(folder => { if (folder in scores) next[folder] = scores[folder] + found[folder]; });
+            scores = next;
+        }
+    });
+    return Object.keys(scores).filter(folder => folder in months).sort((a, b) => scores[b] - scores[a]);
+}
+
+function createItem(entry) {
+    const item = document.createElement('li');
+    item.className = 'news-item';
+    const link = document.createElement('a');
+    link.href = entry.folder + '/index.html';
+    link.className = 'item-link';
+    const info = document.createElement('div');
+    info.className = 'info-col';
+    [['sender', entry.sender], ['title', entry.title], ['preheader-preview', entry.preheader]].forEach(([className, text]) => {
+        const span = document.createElement('span');
+        span.className = className;
+        span.textContent = text;
+        info.appendChild(span);
+    });
+    const dates = document.createElement('div');
+    dates.className = 'date-col';
+    [['date', 'Received Date', 'tooltip_sent', '📩 ' + entry.date_rec], ['date-arch', 'Archived Date', 'tooltip_archived', '🗄️ ' + entry.date_arch]].forEach(([className, title, key, text]) => {
+        const span = document.createElement('span');
+        span.className = className;
+        span.title = title;
+        span.setAttribute('data-i18n-title', key);
+        span.textContent = text;
+        dates.appendChild(span);
+    });
+    link.appendChild(info);
+    link.appendChild(dates);
+    item.appendChild(link);
+    return item;
+}
+
+function renderEntries(entries) {
+    list.innerHTML = '';
+    entries.forEach(entry => list.appendChild(createItem(entry)));
+    updateLanguage(currentLang);
+}
+
+function getItemCount() {
+    return searchResults ? searchResults.length : totalItems;
+}
+
+function showPage(page) {
+    currentPage = page;
+    const start = (page - 1) * itemsPerPage;
+    const end = start + itemsPerPage;
+
+    renderPaginationControls();
+    window.scrollTo(0, 0);
+    if (searchResults) {
+        const results = searchResults;
+        loadEntriesByFolder(results.slice(start, end)).then(entries => {
+            if (currentPage === page && searchResults === results) renderEntries(entries);
+        }).catch(err => console.error('Failed to load results: ', err));
+    } else if (page === 1) {
+        list.innerHTML = firstPageHtml;
+    } else {
+        loadEntries(start, end).then(entries => {
+            if (currentPage === page && !searchResults) renderEntries(entries);
+        }).catch(err => console.error('Failed to load page: ', err));
+    }
+}
+
+function renderPaginationControls() {
+    const totalPages = Math.ceil(getItemCount() / itemsPerPage);
+    paginationContainer.innerHTML = '';
+
+    if (totalPages <= 1) return;
+
+    const prevBtn = document.createElement('button');
+    prevBtn.className = 'page-btn';
+    prevBtn.innerHTML = '&laquo;';
+    prevBtn.disabled = currentPage === 1;
+    prevBtn.onclick = () => showPage(currentPage - 1);
+    paginationContainer.appendChild(prevBtn);
+
+    let startPage = Math.max(1, currentPage - 2);
+    let endPage = Math.min(totalPages, currentPage + 2);
+
+    if (startPage > 1) {
+        const firstPage = document.createElement('button');
+        firstPage.className = 'page-btn';
+        firstPage.innerText = '1';
+        firstPage.onclick = () => showPage(1);
+        paginationContainer.appendChild(firstPage);
+        if (startPage > 2) paginationContainer.appendChild(document.createTextNode('...'));
+    }
+
+    for (let i = startPage; i <= endPage; i++) {
+        const btn = document.createElement('button');
+        btn.className = `page-btn ${i === currentPage ? 'active' : ''}`;
+        btn.innerText = i;
+        btn.onclick = () => showPage(i);
+        paginationContainer.appendChild(btn);
+    }
+
+    if (endPage < totalPages) {
+        if (endPage < totalPages - 1) paginationContainer.appendChild(document.createTextNode('...'));
+        const lastPage = document.createElement('button');
+        lastPage.className = 'page-btn';
+        lastPage.innerText = totalPages;
+        lastPage.onclick = () => showPage(totalPages);
+        paginationContainer.appendChild(lastPage);
+    }
 
+    const nextBtn = document.createElement('button');
+    nextBtn.className = 'page-btn';
+    nextBtn.innerHTML = '&raquo;';
+    nextBtn.disabled = currentPage === totalPages;
+    nextBtn.onclick = () => showPage(currentPage + 1);
+    paginationContainer.appendChild(nextBtn);
+}
+
+function filterList() {
+    clearTimeout(searchTimer);
+    searchTimer = setTimeout(runSearch, SEARCH_DEBOUNCE_MS);
+}
+
+function runSearch() {
+    const input = document.getElementById('searchInput');
+    const token = ++searchToken;
+    searchIndex(input.value).then(results => {
+        if (token !== searchToken) return;
+        searchResults = results;
+        showPage(1);
+    }).catch(err => console.error('Failed to search archive: ', err));
+}
+
+showPage(1);
+"""
+
+VIEWER_CSS = """
+body { margin: 0; padding: 0; background: #eef2f5; font-family: Roboto, Helvetica, Arial, sans-serif; overflow: hidden; }
+.header { position: fixed; top: 0; left: 0; right: 0; height: 60px; background: white; border-bottom: 1px solid #ddd; display: flex; align-items: center; justify-content: space-between; padding: 0 20px; z-index: 100; box-shadow: 0 2px 5px rgba(0,0,0,0.02); }
+.title { font-size: 16px; font-weight: 600; color: #333; white-space: nowrap; overflow: hidden; text-overflow: ellipsis; margin-right: 20px; }
+.controls { display: flex; gap: 10px; flex-shrink: 0; }
+.btn { padding: 6px 12px; border: 1px solid #ccc; background: #f9f9f9; border-radius: 6px; cursor: pointer; font-size: 13px; display: flex; align-items: center; gap: 6px; transition: all 0.2s; color: #333; }
+.btn:hover { background: #eee; }
+.btn.active { background: #0070f3; color: white; border-color: #0070f3; }
+.btn svg { display: block; }
+.main-view { margin-top: 60px; height: calc(100vh - 60px); display: flex; justify-content: center; align-items: flex-start; background: #eef2f5; overflow: hidden; padding-top: 20px; }
+.iframe-wrapper { width: 1000px; max-width: 95%; height: 90%; transition: width 0.3s ease; background: white; box-shadow: 0 2px 10px rgba(0,0,0,0.05); border-radius: 4px; }
+iframe { width: 100%; height: 100%; border: none; display: block; border-radius: inherit; }
+body.mobile-mode .iframe-wrapper { width: 375px; height: 812px; max-height: 85vh; border: none; box-shadow: 0 10px 40px rgba(0,0,0,0.15); }
+
+/* --- SIDEBAR --- */
+.sidebar { position: fixed; top: 60px; right: -420px; width: 420px; height: calc(100vh - 60px); background: white; border-left: 1px solid #ddd; transition: right 0.3s; overflow-y: auto; z-index: 90; padding: 20px; box-sizing: border-box; display: flex; flex-direction: column; gap: 20px; }
+.sidebar.open { right: 0; }
+
+.sidebar h3 { margin-top: 0; font-size: 16px; color: #333; border-bottom: 1px solid #eee; padding-bottom: 10px; margin-bottom: 10px; display: flex; align-items: center; gap: 8px; }
+.meta-item { margin-bottom: 12px; font-size: 13px; color: #555; }
+.meta-label { font-weight: 600; display: block; margin-bottom: 3px; color: #333; }
+.meta-val { word-break: break-word; line-height: 1.4; }
+.preheader-box { background: #f8f9fa; padding: 10px; border-radius: 6px; border: 1px solid #eee; font-style: italic; color: #666; font-size: 12px; }
+
+.status-badge { display: inline-flex; align-items: center; gap: 5px; font-weight: 500; }
+.status-badge.ok { color: green; }
+.status-badge.warn { color: orange; }
+
+/* Pixel List Style */
+.pixel-list { list-style: none; padding: 0; margin: 0; background: #f0fff4; border: 1px solid #c3e6cb; border-radius: 4px; }
+.pixel-li { padding: 8px; border-bottom: 1px solid #c3e6cb; }
+.pixel-li:last-child { border-bottom: none; }
+.pixel-row { display: flex; align-items: center; gap: 6px; color: #155724; font-size: 11px; }
+.pixel-url { word-break: break-all; font-family: monospace; }
+.pixel-rule { margin-left: auto; padding: 1px 6px; border-radius: 10px; background: #c3e6cb; font-family: monospace; white-space: nowrap; }
+
+/* --- LINK CARD DESIGN --- */
+.sidebar ul { list-style: none; padding: 0; margin: 0; }
+.link-card {
+    border: 1px solid #eee; border-radius: 8px; background: #fff; margin-bottom: 12px;
+    box-shadow: 0 1px 3px rgba(0,0,0,0.05); overflow: hidden;
+}
+.link-card-header {
+    padding: 8px 12px; background: #fcfcfc; border-bottom: 1px solid #f0f0f0;
+    font-weight: 600; color: #333; font-size: 12px; text-overflow: ellipsis; overflow: hidden; white-space: nowrap;
+    display: flex; align-items: center; gap: 8px;
+}
+.link-number {
+    background: #eee; color: #555; padding: 1px 5px; border-radius: 4px; font-size: 10px; font-family: monospace;
+}
+.link-tracker {
+    margin-left: auto; background: #fff3cd; color: #856404; padding: 1px 6px; border-radius: 10px; font-size: 10px; font-family: monospace; font-weight: normal;
+}
+.link-card-body { padding: 10px 12px; }
+.link-line { display: flex; align-items: center; gap: 8px; margin-bottom: 4px; }
+.link-line:last-child { margin-bottom: 0; }
+.link-icon-box { width: 16px; text-align: center; display: flex; justify-content: center; }
+.link-url-text { font-family: monospace; font-size: 11px; word-break: break-all; line-height: 1.3; }
+.link-url-text.orig { color: #888; }
+.link-url-text.dest { color: #0070f3; font-weight: 600; }
+.link-arrow-sep { padding-left: 20px; color: #ccc; font-size: 10px; margin: 2px 0; }
+
+.link-card-footer {
+    padding: 6px 12px; background: #fafafa; border-top: 1px solid #f0f0f0; display: flex; gap: 10px; justify-content: flex-end;
+}
+.btn-action {
+    border: none; background: transparent; padding: 4px 8px; cursor: pointer; color: #666;
+    display: flex; align-items: center; gap: 4px; font-size: 11px; border-radius: 4px;
+}
+.btn-action:hover { background: #eaeaea; color: #0070f3; }
+
+/* Global Tooltip Fixed */
+.global-tooltip {
+    position: fixed; background: #333; color: white; padding: 10px; border-radius: 6px;
+    z-index: 10000; max-width: 300px; font-size: 11px; pointer-events: none; display: none;
+    box-shadow: 0 4px 10px rgba(0,0,0,0.2); white-space: pre-wrap; word-break: break-all; line-height: 1.4;
+}
+.global-tooltip.visible { display: block; }
+
+body.dark-mode .main-view { background: #121212; }
+body.dark-mode .header { background: #1e1e1e; border-bottom-color: #333; }
+body.dark-mode .title { color: #e0e0e0; }
+body.dark-mode .btn { background: #2c2c2c; border-color: #444; color: #ccc; }
+body.dark-mode .btn.active { background: #0070f3; color: white; }
+body.dark-mode .iframe-wrapper { box-shadow: 0 0 25px rgba(255, 255, 255, 0.15); border: 1px solid #333; }
+body.dark-mode .sidebar { background: #1e1e1e; border-left-color: #333; }
+body.dark-mode .sidebar h3 { color: #fff; border-bottom-color: #333; }
+body.dark-mode .meta-label { color: #ccc; }
+body.dark-mode .meta-item { color: #aaa; }
+body.dark-mode .preheader-box { background: #252525; border-color: #333; color: #aaa; }
+
+body.dark-mode .pixel-list { background: #1e2e1e; border-color: #2b4c2b; }
+body.dark-mode .pixel-li { border-bottom-color: #2b4c2b; }
+body.dark-mode .pixel-row { color: #90cea1; }
+body.dark-mode .pixel-rule { background: #2b4c2b; }
+
+body.dark-mode .link-card { background: #252525; border-color: #333; }
+body.dark-mode .link-card-header { background: #2c2c2c; border-bottom-color: #333; color: #ddd; }
+body.dark-mode .link-number { background: #333; color: #ccc; }
+body.dark-mode .link-tracker { background: #4d3d0a; color: #ffd75e; }
+body.dark-mode .link-card-footer { background: #2c2c2c; border-top-color: #333; }
+body.dark-mode .link-url-text.dest { color: #4da3ff; }
+body.dark-mode .btn-action { color: #aaa; }
+body.dark-mode .btn-action:hover { background: #333; color: #fff; }
+"""
+
+VIEWER_JS = """
+const frame = document.getElementById('emailFrame');
+// Le contenu est un document à part (même origine) : le mode sombre doit être réappliqué à son chargement
+frame.addEventListener('load', () => { if(document.body.classList.contains('dark-mode')) { frame.contentDocument.documentElement.classList.add('dark-mode-internal'); } });
+
+function toggleMobile() { document.body.classList.toggle('mobile-mode'); document.getElementById('btn-mobile').classList.toggle('active'); }
+function toggleDark() { document.body.classList.toggle('dark-mode'); document.getElementById('btn-dark').classList.toggle('active'); if(frame.contentDocument.documentElement) { frame.contentDocument.documentElement.classList.toggle('dark-mode-internal'); } }
+function toggleLinks() { document.getElementById('sidebar').classList.toggle('open'); document.getElementById('btn-links').classList.toggle('active'); }
+
+function toggleHighlight() { 
+    const btn = document.getElementById('btn-highlight');
+    const doc = frame.contentDocument;
+    const body = doc.body;
+
+    body.classList.toggle('highlight-links');
+    btn.classList.toggle('active');
+
+    const isActive = body.classList.contains('highlight-links');
+
+    if (isActive) {
+        // GENERATE OVERLAY BADGES
+        const links = doc.querySelectorAll('a[data-index]');
+        links.forEach(link => {
+            const rect = link.getBoundingClientRect();
+            // Ignore hidden links
+            if(rect.width === 0 || rect.height === 0) return;
+
+            const badge = doc.createElement('div');
+            badge.className = 'link-badge-overlay';
+            badge.textContent = link.getAttribute('data-index');
+            // Absolute positioning relative to body (scrolled)
+            badge.style.top = (rect.top + doc.documentElement.scrollTop - 10) + 'px';
+            badge.style.left = (rect.left + doc.documentElement.scrollLeft - 10) + 'px';
+            body.appendChild(badge);
+        });
+    } else {
+        // REMOVE BADGES
+        const badges = doc.querySelectorAll('.link-badge-overlay');
+        badges.forEach(b => b.remove());
+    }
+}
+
+function copyToClipboard(text) { navigator.clipboard.writeText(text).then(() => { }).catch(err => { console.error('Failed to copy: ', err); }); }
+function scrollToLink(id) { const el = frame.contentDocument.getElementById(id); if(el) { el.scrollIntoView({behavior: 'smooth', block: 'center'}); el.classList.add('flash-target'); setTimeout(() => el.classList.remove('flash-target'), 2000); } else { console.warn('Link not found in iframe:', id); } }
+
+// TOOLTIP LOGIC SMART POSITION
+const tooltip = document.getElementById('global-tooltip');
+document.querySelectorAll('[data-tooltip]').forEach(btn => {
+    btn.addEventListener('mouseenter', e => {
+        const text = btn.getAttribute('data-tooltip');
+        if(text) {
+            tooltip.textContent = text;
+            tooltip.classList.add('visible');
+
+            const rect = btn.getBoundingClientRect();
+            const viewportHeight = window.innerHeight;
+
+            tooltip.style.right = (window.innerWidth - rect.left + 10) + 'px';
+            tooltip.style.left = 'auto';
+
+            if (rect.top > viewportHeight / 2) {
+                tooltip.style.top = 'auto';
+                tooltip.style.bottom = (viewportHeight - rect.bottom) + 'px';
+            } else {
+                tooltip.style.top = rect.top + 'px';
+                tooltip.style.bottom = 'auto';
+            }
+        }
+    });
+    btn.addEventListener('mouseleave', () => {
+        tooltip.classList.remove('visible');
+    });
+});
+"""
+
+STATIC_SOURCES = {
+    "i18n.js": JS_TRANSLATION_LOGIC,
+    "index.css": INDEX_CSS,
+    "index.js": INDEX_JS,
+    "viewer.css": VIEWER_CSS,
+    "viewer.js": VIEWER_JS
+}
+
+def get_static_filename(name, content):
+    base, ext = name.rsplit(".", 1)
+    return f"{STATIC_FOLDER}/{base}.{hashlib.sha256(content.encode('utf-8')).hexdigest()[:12]}.{ext}"
+
+STATIC_FILES = {name: get_static_filename(name, content) for name, content in STATIC_SOURCES.items()}
+
+def get_http_session():
+    # Session unique partagée entre threads : connexions keep-alive réutilisées d'un lien à l'autre
+    global _http_session
+    with _http_lock:
+        if _http_session is None:
+            import requests
+            import requests.adapters
+            session = requests.Session()
+            # Autant de connexions par hôte que de threads réseau possibles : liens et images en même temps
+            adapter = requests.adapters.HTTPAdapter(pool_connections=32, pool_maxsize=RESOLVE_WORKERS + DOWNLOAD_WORKERS)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            session.headers.update(HEADERS)
+            _http_session = session
+    return _http_session
+
+def get_executor(name, max_workers):
+    # Un seul pool par usage pour tout le process : ENRICH_WORKERS emails en parallèle ne multiplient pas les threads
+    with _http_lock:
+        executor = _executors.get(name)
+        if executor is None:
+            executor = _executors[name] = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+    return executor
+
+def get_host_slot(url):
+    host = urlparse(url).netloc.lower()
+    with _http_lock:
+        slot = _host_slots.get(host)
+        if slot is None:
+            slot = _host_slots[host] = threading.BoundedSemaphore(PER_HOST_LIMIT)
+    return slot
+
+def read_jsonl(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+    except OSError:
+        return
+
+def write_jsonl(path, records):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    os.replace(tmp_path, path)
+
+class RedirectCache:
+    # Cache URL d'origine -> (URL finale, chaîne), persisté en JSON-lines.
+    # L'ordre des lignes est l'ordre LRU : les moins récemment utilisées sont évincées en premier.
+    def __init__(self, path, ttl=REDIRECT_CACHE_TTL, negative_ttl=REDIRECT_CACHE_NEGATIVE_TTL, max_entries=REDIRECT_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.dirty = False
+        self.updates = None   # liste des nouvelles entrées, tenue seulement dans les processus de reconstruction
+        self.lock = threading.Lock()
+
+    def load(self):
+        now = time.time()
+        for record in read_jsonl(self.path):
+            if record.get("expires", 0) > now:
+                self.entries[record["url"]] = record
+        return self
+
+    def get(self, url):
+        with self.lock:
+            record = self.entries.get(url)
+            if record is None or record["expires"] <= time.time():
+                self.misses += 1
+                return None
+            self.entries.move_to_end(url)
+            self.hits += 1
+            self.dirty = True
+            return record["final"], record["chain"]
+
+    def put(self, url, final_url, chain, ok):
+        ttl = self.ttl if ok else self.negative_ttl
+        self.merge([{"url": url, "final": final_url, "chain": chain, "ok": ok, "expires": time.time() + ttl}])
+
+    def merge(self, records):
+        with self.lock:
+            for record in records:
+                self.entries[record["url"]] = record
+                self.entries.move_to_end(record["url"])
+                if self.updates is not None: self.updates.append(record)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            self.dirty = True
+
+    def take_updates(self):
+        with self.lock:
+            updates, self.updates = self.updates, []
+        return updates
+
+    def save(self):
+        if not self.dirty: return
+        with self.lock:
+            write_jsonl(self.path, list(self.entries.values()))
+            self.dirty = False
+
+def get_redirect_cache():
+    global _redirect_cache
+    # Appelé par les threads d'enrichissement : sans verrou, deux threads chargeraient chacun leur cache
+    with _http_lock:
+        if _redirect_cache is None:
+            _redirect_cache = RedirectCache(os.path.join(OUTPUT_FOLDER, CACHE_FOLDER, REDIRECT_CACHE_FILE)).load()
+    return _redirect_cache
+
+def follow_redirects(start_url, max_redirects=5, deadline=None, stats=None):
+    # Renvoie (url finale, chaîne, ok) ; ok vaut None si la deadline globale a interrompu la résolution
     chain = [start_url]
     current_url = start_url
-    session = requests.Session()
-    
+    session = get_http_session()
+
     for _ in range(max_redirects):
+        timeout = RESOLVE_TIMEOUT
+        if deadline is not None:
+            timeout = min(timeout, deadline - time.monotonic())
+            if timeout <= 0: return current_url, chain, None
         try:
-            resp = session.head(current_url, allow_redirects=False, headers=HEADERS, timeout=2.0)
+            count(stats, "http_requests")
+            with get_host_slot(current_url):
+                resp = session.head(current_url, allow_redirects=False, timeout=timeout)
             if 300 <= resp.status_code < 400:
                 location = resp.headers.get('Location') or resp.headers.get('location')
                 if location:
@@ -178,10 +1062,136 @@ def resolve_redirect_chain(start_url, max_redirects=5):
                     current_url = location
                 else: break
             else: break
-        except: break
-            
+        except Exception:
+            return current_url, chain, False
+
+    return current_url, chain, True
+
+def resolve_redirect_chain(start_url, max_redirects=5, deadline=None, stats=None):
+    if not start_url: return start_url, []
+    if start_url.startswith("mailto:") or start_url.startswith("tel:"): return start_url, []
+
+    cache = get_redirect_cache()
+    cached = cache.get(start_url)
+    if cached:
+        count(stats, "redirect_hits")
+        return cached
+    count(stats, "redirect_misses")
+
+    current_url, chain, ok = follow_redirects(start_url, max_redirects, deadline, stats)
+    if ok is not None:
+        cache.put(start_url, current_url, chain, ok)
     return current_url, chain
 
+def resolve_redirect_chains(urls, stats=None):
+    # Résout tous les liens d'un email en parallèle ; les résultats gardent l'ordre d'entrée (data-index)
+    deadline = time.monotonic() + RESOLVE_DEADLINE
+    unique_urls = list(dict.fromkeys(urls))
+    resolved = {}
+    executor = get_executor("resolve", RESOLVE_WORKERS)
+    futures = {executor.submit(resolve_redirect_chain, url, deadline=deadline, stats=stats): url for url in unique_urls}
+    for future, url in futures.items():
+        try:
+            resolved[url] = future.result()
+        except Exception:
+            resolved[url] = (url, [url])
+    return [resolved[url] for url in urls]
+
+class AssetIndex:
+    # URL d'image -> {path, etag, last_modified}, persisté en JSON-lines (ordre LRU comme RedirectCache)
+    def __init__(self, path, max_entries=ASSET_INDEX_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.not_modified = 0
+        self.downloaded = 0
+        self.dirty = False
+        self.updates = None
+        self.lock = threading.Lock()
+
+    def load(self):
+        for record in read_jsonl(self.path):
+            if record.get("url") and record.get("path"):
+                self.entries[record["url"]] = record
+        return self
+
+    def get(self, url):
+        with self.lock:
+            return self.entries.get(url)
+
+    def put(self, url, rel_path, etag, last_modified):
+        self.merge([{"url": url, "path": rel_path, "etag": etag, "last_modified": last_modified}])
+
+    def merge(self, records):
+        with self.lock:
+            for record in records:
+                self.entries[record["url"]] = record
+                self.entries.move_to_end(record["url"])
+                if self.updates is not None: self.updates.append(record)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            self.dirty = True
+
+    def take_updates(self):
+        with self.lock:
+            updates, self.updates = self.updates, []
+        return updates
+
+    def save(self):
+        if not self.dirty: return
+        with self.lock:
+            write_jsonl(self.path, list(self.entries.values()))
+            self.dirty = False
+
+def get_asset_index():
+    global _asset_index
+    with _http_lock:
+        if _asset_index is None:
+            _asset_index = AssetIndex(os.path.join(OUTPUT_FOLDER, CACHE_FOLDER, ASSET_INDEX_FILE)).load()
+    return _asset_index
+
+def download_asset(url, stats=None):
+    index = get_asset_index()
+    known = index.get(url)
+    conditional_headers = {}
+    if known and os.path.exists(os.path.join(OUTPUT_FOLDER, known["path"])):
+        if known.get("etag"): conditional_headers["If-None-Match"] = known["etag"]
+        if known.get("last_modified"): conditional_headers["If-Modified-Since"] = known["last_modified"]
+
+    session = get_http_session()
+    count(stats, "http_requests")
+    with get_host_slot(url):
+        with session.get(url, headers=conditional_headers, timeout=DOWNLOAD_TIMEOUT, stream=True) as r:
+            if r.status_code == 304 and conditional_headers:
+                index.not_modified += 1
+                count(stats, "assets_not_modified")
+                return known["path"]
+            if r.status_code != 200: return None
+            content_length = r.headers.get('content-length', '')
+            if content_length.isdigit() and int(content_length) > MAX_ASSET_BYTES: return None
+
+            chunks = count_bytes(r.iter_content(DOWNLOAD_CHUNK_SIZE), stats, "http_bytes")
+            rel_path = store_asset_stream(chunks, guess_asset_extension(r.headers.get('content-type', '')))
+            if rel_path:
+                index.downloaded += 1
+                count(stats, "assets_downloaded")
+                index.put(url, rel_path, r.headers.get('ETag'), r.headers.get('Last-Modified'))
+            return rel_path
+
+def download_assets(urls, stats=None):
+    # Chaque URL n'est téléchargée qu'une fois par email, en parallèle ; renvoie {url: chemin dans _assets}
+    unique_urls = list(dict.fromkeys(urls))
+    stored = {}
+    executor = get_executor("download", DOWNLOAD_WORKERS)
+    futures = {executor.submit(download_asset, url, stats): url for url in unique_urls}
+    for future, url in futures.items():
+        try:
+            rel_path = future.result()
+        except Exception:
+            rel_path = None
+        if rel_path: stored[url] = rel_path
+    return stored
+
 def clean_subject_prefixes(subject):
     if not subject: return "Untitled"
     pattern = r'^\s*\[?(?:Fwd|Fw|Tr|Re|Aw|Wg)\s*:\s*\]?\s*'
@@ -195,6 +1205,340 @@ def get_deterministic_id(subject):
     hash_object = hashlib.sha256(subject.encode('utf-8', errors='ignore'))
     return hash_object.hexdigest()[:12]
 
+def get_manifest_path():
+    return os.path.join(OUTPUT_FOLDER, MANIFEST_FILE)
+
+def load_manifest():
+    try:
+        with open(get_manifest_path(), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if isinstance(manifest, dict) and isinstance(manifest.get("entries"), dict):
+            return manifest
+    except (OSError, ValueError):
+        pass
+    return {"uidvalidity": None, "entries": {}}
+
+def save_manifest(manifest):
+    # Écriture atomique : un run interrompu ne doit jamais laisser un manifeste tronqué
+    path = get_manifest_path()
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+def is_up_to_date(entry, uid, message_id, uid_reliable):
+    if not entry: return False
+    if entry.get("processing_version") != PROCESSING_VERSION: return False
+    # Le Message-ID identifie l'email de façon fiable ; l'UID seulement si UIDVALIDITY n'a pas changé
+    if message_id:
+        if entry.get("message_id") != message_id: return False
+    elif not uid_reliable or entry.get("uid") != uid:
+        return False
+    return True
+
+def list_archive_folders():
+    # Dossiers d'archives uniquement : les dossiers techniques commencent par "." ou "_"
+    return [f.name for f in os.scandir(OUTPUT_FOLDER) if f.is_dir() and not f.name.startswith(('.', '_'))]
+
+def guess_asset_extension(content_type):
+    ext = mimetypes.guess_extension(content_type.split(';')[0].strip())
+    if not ext or ext == ".jpe": ext = ".jpg"
+    return ext
+
+def store_asset_stream(chunks, ext, max_bytes=MAX_ASSET_BYTES):
+    # Écrit le flux dans un fichier temporaire en calculant son empreinte, puis le range sous _assets/
+    assets_root = os.path.join(OUTPUT_FOLDER, ASSETS_FOLDER)
+    os.makedirs(assets_root, exist_ok=True)
+    tmp_path = os.path.join(assets_root, f".download.{os.getpid()}.{threading.get_ident()}.tmp")
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(tmp_path, "wb") as f:
+            for chunk in chunks:
+                if not chunk: continue
+                size += len(chunk)
+                if size > max_bytes: return None
+                digest.update(chunk)
+                f.write(chunk)
+        if size == 0: return None
+
+        hex_digest = digest.hexdigest()
+        rel_path = f"{ASSETS_FOLDER}/{hex_digest[:2]}/{hex_digest}{ext}"
+        abs_path = os.path.join(OUTPUT_FOLDER, rel_path)
+        if not os.path.exists(abs_path):
+            os.makedirs(os.path.dirname(abs_path), exist_ok=True)
+            os.replace(tmp_path, abs_path)
+        return rel_path
+    finally:
+        if os.path.exists(tmp_path): os.remove(tmp_path)
+
+def store_asset(content, ext):
+    return store_asset_stream([content], ext)
+
+def remove_legacy_local_assets(newsletter_path):
+    # Anciennes copies img_N / bg_N propres à chaque newsletter, remplacées par _assets/
+    if not os.path.isdir(newsletter_path): return
+    for name in os.listdir(newsletter_path):
+        if LEGACY_ASSET_PATTERN.match(name):
+            os.remove(os.path.join(newsletter_path, name))
+
+def find_page_references(f_id, pattern):
+    found = set()
+    for name in ("index.html", "content.html"):
+        try:
+            with open(os.path.join(OUTPUT_FOLDER, f_id, name), 'r', encoding='utf-8') as f:
+                found.update(pattern.findall(f.read()))
+        except OSError:
+            pass
+    return found
+
+def publish_static_files():
+    # Écrit les CSS/JS partagés absents de _static/ (un nom par version du contenu, jamais réécrit)
+    for name, rel_path in STATIC_FILES.items():
+        path = os.path.join(OUTPUT_FOLDER, rel_path)
+        if os.path.exists(path): continue
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding='utf-8') as f:
+            f.write(STATIC_SOURCES[name])
+        os.replace(tmp_path, path)
+
+def collect_unused_static(entries):
+    # Les anciennes versions restent tant qu'une archive pas encore régénérée y fait référence
+    static_root = os.path.join(OUTPUT_FOLDER, STATIC_FOLDER)
+    if not os.path.isdir(static_root): return
+
+    referenced = set(STATIC_FILES.values())
+    for f_id in list_archive_folders():
+        entry = entries.get(f_id)
+        if entry is not None and "static" in entry:
+            referenced.update(entry["static"])
+        else:
+            referenced.update(find_page_references(f_id, STATIC_REF_PATTERN))
+
+    for static_file in os.scandir(static_root):
+        if f"{STATIC_FOLDER}/{static_file.name}" not in referenced:
+            os.remove(static_file.path)
+            print(f"Supprimé (Ancienne ressource statique): {static_file.name}")
+
+def collect_unused_assets(entries):
+    assets_root = os.path.join(OUTPUT_FOLDER, ASSETS_FOLDER)
+    if not os.path.isdir(assets_root): return
+
+    referenced = set()
+    for f_id in list_archive_folders():
+        entry = entries.get(f_id)
+        if entry is not None and "assets" in entry:
+            referenced.update(entry["assets"])
+            continue
+        # Dossier absent du manifeste : on relit ses pages pour ne rien supprimer à tort
+        referenced.update(find_page_references(f_id, ASSET_REF_PATTERN))
+
+    removed = 0
+    for prefix in os.scandir(assets_root):
+        if not prefix.is_dir(): continue
+        for asset in os.scandir(prefix.path):
+            if f"{ASSETS_FOLDER}/{prefix.name}/{asset.name}" not in referenced:
+                os.remove(asset.path)
+                removed += 1
+        if not os.listdir(prefix.path):
+            os.rmdir(prefix.path)
+    if removed:
+        print(f"Supprimé (Images orphelines): {removed}")
+
+def get_raw_cache_path(message_id, source_name, uidvalidity, uid):
+    # Clé : le Message-ID, sinon l'UID dans sa source (et son UIDVALIDITY pour IMAP)
+    identity = message_id or f"{source_name}:{uidvalidity}:{uid}"
+    digest = hashlib.sha256(identity.encode("utf-8", "surrogateescape")).hexdigest()
+    return os.path.join(RAW_CACHE_FOLDER, digest[:2], digest + ".eml.gz")
+
+def get_entry_raw_path(entry, uidvalidity):
+    source_name = entry.get("source", ImapSource.name)
+    return get_raw_cache_path(entry.get("message_id"), source_name,
+                              uidvalidity if source_name == ImapSource.name else None, entry.get("uid"))
+
+def filter_header_lines(header, dropped):
+    # Retire des en-têtes bruts les champs listés, lignes de continuation comprises
+    kept = []
+    keep = True
+    for line in header.splitlines(keepends=True):
+        if not line.strip(): continue
+        if line[:1] not in (b" ", b"\t"):
+            name = line.split(b":", 1)[0].strip().lower().decode("ascii", "replace")
+            keep = not name.startswith(dropped)
+        if keep: kept.append(line)
+    return b"".join(kept)
+
+def build_raw_message(message):
+    # Chemin BODYSTRUCTURE : seules les parties utiles ont été lues. On en refait un message MIME (en-têtes
+    # d'origine, HTML, images inline) que parse_message relit exactement comme un RFC822 complet.
+    # Sans partie HTML, un text/plain vide : relu, l'email est ignoré comme au premier passage
+    html_part = MIMENonMultipart("text", "html" if message["html"] is not None else "plain")
+    html_part.set_payload(message["html"] or b"")
+    encoders.encode_base64(html_part)
+    if message["charset"]: html_part.set_param("charset", message["charset"])
+    if message["inline"]:
+        body = MIMEMultipart("related")
+        body.attach(html_part)
+        for content_id, (content_type, content) in message["inline"].items():
+            maintype, _, subtype = content_type.partition("/")
+            image = MIMENonMultipart(maintype, subtype or "octet-stream")
+            image.set_payload(content)
+            encoders.encode_base64(image)
+            image["Content-ID"] = f"<{content_id}>"
+            body.attach(image)
+    else:
+        body = html_part
+    return filter_header_lines(message["header"], RAW_CACHE_DROPPED_HEADERS) + body.as_bytes()
+
+def store_raw_message(path, job):
+    # Écrit une seule fois ; réécrit seulement si le contenu a changé depuis le dernier rendu
+    entry = job["entry"]
+    if os.path.exists(path) and (not entry or entry.get("content_hash") == job["content_hash"]):
+        return False
+    data = job["raw"] if job.get("raw") is not None else build_raw_message(job["parts"])
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with gzip.open(tmp_path, "wb", compresslevel=RAW_CACHE_LEVEL) as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    return True
+
+def get_raw_cache_owner():
+    return os.path.relpath(os.path.abspath(OUTPUT_FOLDER), os.path.abspath(RAW_CACHE_FOLDER))
+
+def claim_raw_cache():
+    # Premier ménage : le cache est attribué à l'OUTPUT_FOLDER courant ; ensuite, seul celui-ci peut le nettoyer
+    path = os.path.join(RAW_CACHE_FOLDER, RAW_CACHE_OWNER_FILE)
+    owner = get_raw_cache_owner()
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return f.read().strip() == owner
+    except FileNotFoundError:
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(owner + "\n")
+        return True
+
+def collect_unused_raw_messages(entries, uidvalidity):
+    if not os.path.isdir(RAW_CACHE_FOLDER): return
+    if not claim_raw_cache():
+        print(f"Cache brut {RAW_CACHE_FOLDER} non nettoyé : il appartient à un autre dossier de sortie "
+              f"(voir {RAW_CACHE_OWNER_FILE}).")
+        return
+    referenced = {os.path.normpath(get_entry_raw_path(entry, uidvalidity)) for entry in entries.values()}
+    removed = 0
+    for prefix in os.scandir(RAW_CACHE_FOLDER):
+        if not prefix.is_dir(): continue
+        for cached in os.scandir(prefix.path):
+            if os.path.normpath(cached.path) not in referenced:
+                os.remove(cached.path)
+                removed += 1
+        if not os.listdir(prefix.path):
+            os.rmdir(prefix.path)
+    if removed:
+        print(f"Supprimé (Messages bruts orphelins): {removed}")
+
+def get_message_timestamp(ref, msg):
+    # Date de réception côté serveur (INTERNALDATE) ; à défaut, l'en-tête Date (imports, cache brut)
+    if ref.get("date"): return ref["date"]
+    try:
+        return parsedate_to_datetime(msg["Date"]).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return 0
+
+def get_queue_path():
+    return os.path.join(OUTPUT_FOLDER, CACHE_FOLDER, QUEUE_FILE)
+
+def load_queue():
+    # {dossier: {"force": bool, "attempts": n}} : reste à faire des runs précédents
+    try:
+        with open(get_queue_path(), 'r', encoding='utf-8') as f:
+            return json.load(f)["items"]
+    except (OSError, ValueError, KeyError):
+        return {}
+
+def save_queue(items):
+    path = get_queue_path()
+    if not items:
+        if os.path.exists(path): os.remove(path)
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({"updated": datetime.datetime.now().isoformat(timespec="seconds"), "items": items}, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+def is_process_alive(pid):
+    # os.kill(pid, 0) terminerait le processus sous Windows : le verrou y est toujours considéré actif
+    if os.name == "nt": return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def get_lock_owner(path):
+    # PID du run qui tient le verrou, None si celui-ci est abandonné
+    try:
+        with open(path, 'r') as f:
+            content = f.read().strip()
+        age = time.time() - os.path.getmtime(path)
+    except OSError:
+        return None
+    if not content.isdigit():
+        return -1 if age < LOCK_GRACE_PERIOD else None
+    return int(content) if is_process_alive(int(content)) else None
+
+def take_over_lock(path):
+    # Reprise d'un verrou abandonné sous un second verrou exclusif : deux runs qui l'ont vu abandonné en même temps
+    # ne peuvent pas le reprendre tous les deux. Le PID arrive d'un bloc (os.replace), jamais un fichier vide.
+    guard = path + ".takeover"
+    try:
+        guard_fd = os.open(guard, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        # Reprise en cours ailleurs ; celle d'un run mort pendant la reprise expire
+        with contextlib.suppress(OSError):
+            if time.time() - os.path.getmtime(guard) > LOCK_GRACE_PERIOD: os.remove(guard)
+        time.sleep(0.1)
+        return False
+    try:
+        if get_lock_owner(path) is not None: return False   # repris entre-temps
+        print(f"Verrou abandonné repris : {path}")
+        temp_path = f"{path}.{os.getpid()}"
+        with open(temp_path, "w") as f:
+            f.write(str(os.getpid()))
+        os.replace(temp_path, path)
+        return True
+    finally:
+        os.close(guard_fd)
+        os.remove(guard)
+
+@contextlib.contextmanager
+def run_lock():
+    # Renvoie False si un autre run tient déjà le verrou ; celui d'un processus mort est repris
+    path = os.path.join(OUTPUT_FOLDER, CACHE_FOLDER, LOCK_FILE)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    while True:
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            with os.fdopen(fd, "w") as f:
+                f.write(str(os.getpid()))
+            break
+        except FileExistsError:
+            owner = get_lock_owner(path)
+            if owner is not None:
+                print(f"Un autre run est en cours sur {OUTPUT_FOLDER} (PID {owner if owner > 0 else '?'}, verrou {path}) : abandon.")
+                yield False
+                return
+            if take_over_lock(path): break
+    try:
+        yield True
+    finally:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(path)
+
 def get_email_date(msg):
     try:
         date_header = msg["Date"]
@@ -234,6 +1578,8 @@ def get_decoded_email_subject(msg):
     return full_subject.strip()
 
 def get_page_metadata(filepath):
+    # Lecture rapide des seules premières Ko de la page : les <meta> et le <title> sont en tête de fichier,
+    # avant le gros bloc de style et le contenu de l'email
     title = "Untitled"
     date_str = None
     archiving_date_str = None
@@ -242,30 +1588,19 @@ def get_page_metadata(filepath):
     reading_time = "1 min"
     
     try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            soup = BeautifulSoup(f, 'html.parser')
-            if soup.title and soup.title.string:
-                title = soup.title.string.strip()
-            
-            meta_date = soup.find("meta", attrs={"name": "creation_date"})
-            if meta_date and meta_date.get("content"):
-                date_str = meta_date["content"]
-            
-            meta_arch = soup.find("meta", attrs={"name": "archiving_date"})
-            if meta_arch and meta_arch.get("content"):
-                archiving_date_str = meta_arch["content"]
-                
-            meta_sender = soup.find("meta", attrs={"name": "sender"})
-            if meta_sender and meta_sender.get("content"):
-                sender = meta_sender["content"]
-
-            meta_preheader = soup.find("meta", attrs={"name": "preheader"})
-            if meta_preheader and meta_preheader.get("content"):
-                preheader = meta_preheader["content"]
-            
-            meta_rt = soup.find("meta", attrs={"name": "reading_time"})
-            if meta_rt and meta_rt.get("content"):
-                reading_time = meta_rt["content"]
+        with open(filepath, 'r', encoding='utf-8', errors='ignore') as f:
+            head = f.read(PAGE_HEAD_CHARS)
+        metas = {name.lower(): html.unescape(content) for name, content in META_TAG_PATTERN.findall(head)}
+
+        title_match = TITLE_PATTERN.search(head)
+        if title_match and title_match.group(1).strip():
+            title = html.unescape(title_match.group(1)).strip()
+
+        date_str = metas.get("creation_date") or None
+        archiving_date_str = metas.get("archiving_date") or None
+        sender = metas.get("sender") or sender
+        preheader = metas.get("preheader") or preheader
+        reading_time = metas.get("reading_time") or reading_time
 
     except Exception:
         pass
@@ -293,43 +1628,172 @@ def format_date_fr(date_iso):
     except:
         return date_iso
 
-def generate_index():
+def fold_text(text):
+    text = unicodedata.normalize("NFKD", text.lower().translate(SEARCH_LIGATURES))
+    return "".join(c for c in text if not unicodedata.category(c).startswith("M"))
+
+def extract_search_terms(*texts):
+    counts = {}
+    for text in texts:
+        for term in SEARCH_TERM_PATTERN.findall(fold_text(text or "")):
+            if len(term) >= SEARCH_MIN_TERM_LENGTH:
+                counts[term] = counts.get(term, 0) + 1
+    return counts
+
+def get_search_prefixes(terms):
+    return sorted({term[:SEARCH_PREFIX_LENGTH] for term in terms})
+
+def backfill_search_terms(entries):
+    # Archives rendues avant l'index de recherche : texte relu depuis content.html, sans repasser par l'IMAP
+    changes = {}
+    for f_id in list_archive_folders():
+        entry = entries.get(f_id)
+        if entry is None or "search" in entry or "meta" not in entry: continue
+        try:
+            with open(os.path.join(OUTPUT_FOLDER, f_id, "content.html"), 'r', encoding='utf-8') as f:
+                soup = parse_html(f.read())
+        except OSError:
+            continue
+        for tag in soup.find_all(["style", "script"]):
+            tag.decompose()
+        meta = entry["meta"]
+        terms = extract_search_terms(meta["title"], meta["sender"], soup.get_text(" ", strip=True), format_date_fr(meta["date_rec"]))
+        soup.decompose()
+        changes[f_id] = ([], terms)
+        entry["search"] = get_search_prefixes(terms)
+    return changes
+
+def update_search_index(changes):
+    # changes : {dossier: (préfixes où il figure déjà, nouveaux termes ou None s'il disparaît)}
+    # Seuls les fichiers de ces préfixes sont relus et réécrits.
+    if not changes: return
+    search_root = os.path.join(OUTPUT_FOLDER, SEARCH_FOLDER)
+    os.makedirs(search_root, exist_ok=True)
+
+    additions = {}
+    for f_id, (old_prefixes, terms) in changes.items():
+        for prefix in old_prefixes:
+            additions.setdefault(prefix, {})
+        for term, occurrences in (terms or {}).items():
+            additions.setdefault(term[:SEARCH_PREFIX_LENGTH], {}).setdefault(term, []).append([f_id, occurrences])
+
+    for prefix, prefix_additions in sorted(additions.items()):
+        path = os.path.join(search_root, f"{prefix}.json")
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                shard = json.load(f)
+        except (OSError, ValueError):
+            shard = {}
+        for term in list(shard):
+            postings = [posting for posting in shard[term] if posting[0] not in changes]
+            if postings: shard[term] = postings
+            else: del shard[term]
+        for term, postings in prefix_additions.items():
+            shard[term] = sorted(shard.get(term, []) + postings)
+
+        if shard:
+            with open(path + ".tmp", "w", encoding='utf-8') as f:
+                json.dump(shard, f, ensure_ascii=False, separators=(",", ":"), sort_keys=True)
+            os.replace(path + ".tmp", path)
+        elif os.path.exists(path):
+            os.remove(path)
+    print(f"Index de recherche : {len(changes)} archives, {len(additions)} fichiers mis à jour.")
+
+def write_listing(pages_data):
+    # index.json : taille de page, total et un fichier par mois (du plus récent au plus ancien).
+    # Les fichiers mensuels sont nommés d'après leur contenu : seul le mois modifié change de nom.
+    listing_root = os.path.join(OUTPUT_FOLDER, LISTING_FOLDER)
+    os.makedirs(listing_root, exist_ok=True)
+    months = []
+    for month, pages in itertools.groupby(pages_data, key=lambda page: page["sort_key"][:7]):
+        rows = [[page[field] for field in LISTING_FIELDS] for page in pages]
+        content = json.dumps(rows, ensure_ascii=False, separators=(",", ":"))
+        rel_path = f"{LISTING_FOLDER}/{month}.{hashlib.sha256(content.encode('utf-8')).hexdigest()[:12]}.json"
+        path = os.path.join(OUTPUT_FOLDER, rel_path)
+        if not os.path.exists(path):
+            with open(path + ".tmp", "w", encoding='utf-8') as f:
+                f.write(content)
+            os.replace(path + ".tmp", path)
+        months.append({"month": month, "count": len(rows), "file": rel_path})
+
+    listing = {"page_size": HUB_PAGE_SIZE, "total": len(pages_data), "fields": LISTING_FIELDS, "months": months}
+    listing_path = os.path.join(OUTPUT_FOLDER, LISTING_FILE)
+    with open(listing_path + ".tmp", "w", encoding='utf-8') as f:
+        json.dump(listing, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(listing_path + ".tmp", listing_path)
+
+    # Dossier -> mois, pour que la recherche ne charge que les mois des résultats affichés
+    search_root = os.path.join(OUTPUT_FOLDER, SEARCH_FOLDER)
+    os.makedirs(search_root, exist_ok=True)
+    docs_path = os.path.join(search_root, SEARCH_DOCS_FILE)
+    with open(docs_path + ".tmp", "w", encoding='utf-8') as f:
+        json.dump({page["folder"]: page["sort_key"][:7] for page in pages_data}, f, separators=(",", ":"), sort_keys=True)
+    os.replace(docs_path + ".tmp", docs_path)
+
+    current = {os.path.basename(month["file"]) for month in months}
+    for name in os.listdir(listing_root):
+        if name not in current:
+            os.remove(os.path.join(listing_root, name))
+
+def generate_index(skip_ids=()):
     print("Génération du sommaire...")
     if not os.path.exists(OUTPUT_FOLDER):
         return
         
-    subfolders = [f.path for f in os.scandir(OUTPUT_FOLDER) if f.is_dir() and not f.name.startswith('.')]
+    # Les métadonnées viennent du manifeste ; seules les archives qui n'y figurent pas sont relues
+    manifest = load_manifest()
+    entries = manifest["entries"]
+    manifest_updated = False
     pages_data = []
     
-    for folder in subfolders:
-        folder_name = os.path.basename(folder)
-        index_file_path = os.path.join(folder, "index.html")
+    for folder_name in list_archive_folders():
+        # Archives en cours d'écriture lors d'un point d'étape : elles figureront au suivant
+        if folder_name in skip_ids: continue
+        index_file_path = os.path.join(OUTPUT_FOLDER, folder_name, "index.html")
         if not os.path.exists(index_file_path): continue
 
-        full_title, date_rec_str, sender, date_arch_str, preheader, reading_time = get_page_metadata(index_file_path)
+        meta = entries.get(folder_name, {}).get("meta")
+        if meta is None:
+            full_title, date_rec_str, sender, date_arch_str, preheader, reading_time = get_page_metadata(index_file_path)
+            meta = {
+                "title": full_title,
+                "sender": sender,
+                "date_rec": date_rec_str,
+                "date_arch": date_arch_str,
+                "preheader": preheader,
+                "reading_time": reading_time
+            }
+            entries.setdefault(folder_name, {})["meta"] = meta
+            manifest_updated = True
         
         pages_data.append({
             "folder": folder_name,
-            "title": full_title,
-            "sender": sender,
-            "preheader": preheader,
-            "reading_time": reading_time,
-            "date_rec": format_date_fr(date_rec_str),
-            "date_arch": format_date_fr(date_arch_str),
-            "sort_key": date_rec_str
+            "title": meta["title"],
+            "sender": meta["sender"],
+            "preheader": meta["preheader"],
+            "reading_time": meta["reading_time"],
+            "date_rec": format_date_fr(meta["date_rec"]),
+            "date_arch": format_date_fr(meta["date_arch"]),
+            "sort_key": meta["date_rec"]
         })
 
+    if manifest_updated:
+        save_manifest(manifest)
+    publish_static_files()
+
     pages_data.sort(key=lambda x: x["sort_key"], reverse=True)
+    write_listing(pages_data)
 
+    # Première page seulement : les suivantes sont rendues par le navigateur depuis les fichiers mensuels
     links_html = ""
-    for page in pages_data:
+    for page in pages_data[:HUB_PAGE_SIZE]:
         links_html += f'''
         <li class="news-item">
             <a href="{page['folder']}/index.html" class="item-link">
                 <div class="info-col">
-                    <span class="sender">{page['sender']}</span>
-                    <span class="title">{page['title']}</span>
-                    <span class="preheader-preview">{page['preheader']}</span>
+                    <span class="sender">{html.escape(page['sender'])}</span>
+                    <span class="title">{html.escape(page['title'])}</span>
+                    <span class="preheader-preview">{html.escape(page['preheader'])}</span>
                 </div>
                 <div class="date-col">
                     <span class="date" title="Received Date" data-i18n-title="tooltip_sent">📩 {page['date_rec']}</span>
@@ -349,63 +1813,7 @@ def generate_index():
         <meta name="viewport" content="width=device-width, initial-scale=1.0">
         <title>Newsletter Archive</title>
         <meta name="robots" content="noindex, nofollow">
-        <style>
-            :root {{
-                --bg-body: #f6f9fc; --bg-card: #ffffff; --text-main: #333333; --text-muted: #666666; --text-light: #888888;
-                --border-color: #eaeaea; --accent-color: #0070f3; --hover-bg: #f8f9fa; --input-bg: #fcfcfc; --shadow: rgba(0,0,0,0.05);
-            }}
-            [data-theme="dark"] {{
-                --bg-body: #121212; --bg-card: #1e1e1e; --text-main: #e0e0e0; --text-muted: #a0a0a0; --text-light: #666666;
-                --border-color: #333333; --accent-color: #4da3ff; --hover-bg: #252525; --input-bg: #252525; --shadow: rgba(0,0,0,0.3);
-            }}
-            body {{ font-family: -apple-system, BlinkMacSystemFont, "Segoe UI", Roboto, Helvetica, Arial, sans-serif; background-color: var(--bg-body); color: var(--text-main); margin: 0; padding: 20px; display: flex; flex-direction: column; min-height: 100vh; box-sizing: border-box; transition: background-color 0.3s, color 0.3s; }}
-            .container {{ max-width: 800px; width: 100%; margin: 0 auto; background: var(--bg-card); padding: 40px; border-radius: 12px; box-shadow: 0 4px 12px var(--shadow); flex: 1; position: relative; }}
-            .header-row {{ display: flex; justify-content: space-between; align-items: center; margin-bottom: 30px; border-bottom: 2px solid var(--border-color); padding-bottom: 20px; }}
-            h1 {{ text-align: center; color: var(--text-main); margin: 0; font-size: 1.8rem; flex-grow: 1; }}
-            .controls {{ display: flex; gap: 10px; }}
-
-            #theme-toggle, #lang-toggle {{ background: none; border: 1px solid var(--border-color); border-radius: 6px; padding: 0 10px; height: 40px; cursor: pointer; font-size: 0.9rem; display: flex; align-items: center; justify-content: center; transition: all 0.2s; color: var(--text-main); }}
-            #theme-toggle:hover, #lang-toggle:hover {{ background-color: var(--hover-bg); border-color: var(--accent-color); }}
-            
-            .icon-moon {{ display: block; }}
-            .icon-sun {{ display: none; }}
-            [data-theme="dark"] .icon-moon {{ display: none; }}
-            [data-theme="dark"] .icon-sun {{ display: block; }}
-            
-            #searchInput {{ width: 100%; padding: 12px 20px; margin-bottom: 25px; box-sizing: border-box; border: 2px solid var(--border-color); border-radius: 8px; font-size: 16px; background-color: var(--input-bg); color: var(--text-main); transition: border-color 0.3s; }}
-            #searchInput:focus {{ border-color: var(--accent-color); outline: none; }}
-            
-            ul {{ list-style: none; padding: 0; margin: 0; overflow: visible; }}
-            
-            li.news-item {{ 
-                border: 1px solid var(--border-color); margin-bottom: 12px; border-radius: 8px; background: var(--bg-card);
-                transition: transform 0.2s, box-shadow 0.2s;
-            }}
-            li.news-item:hover {{ transform: translateY(-2px); box-shadow: 0 4px 12px var(--shadow); border-color: var(--accent-color); z-index: 10; position: relative; }}
-            
-            a.item-link {{ display: flex; justify-content: space-between; align-items: center; padding: 16px 20px; text-decoration: none; color: var(--text-main); }}
-            
-            .info-col {{ display: flex; flex-direction: column; flex: 1; min-width: 0; margin-right: 15px; }}
-            .sender {{ font-size: 0.8rem; text-transform: lowercase; color: var(--text-muted); margin-bottom: 6px; }}
-            .title {{ font-weight: 600; font-size: 1.05rem; color: var(--text-main); margin-bottom: 6px; }}
-            .preheader-preview {{ font-size: 0.85rem; color: var(--text-light); white-space: nowrap; overflow: hidden; text-overflow: ellipsis; display: block; }}
-            
-            .date-col {{ display: flex; flex-direction: column; align-items: flex-end; flex-shrink: 0; margin-left: 10px; }}
-            .date {{ font-size: 0.8rem; color: var(--text-main); font-weight: 500; white-space: nowrap; font-variant-numeric: tabular-nums; }}
-            .date-arch {{ font-size: 0.7rem; color: var(--text-light); white-space: nowrap; font-variant-numeric: tabular-nums; margin-top: 4px; }}
-            
-            .pagination {{ display: flex; justify-content: center; gap: 8px; margin-top: 25px; flex-wrap: wrap; }}
-            .page-btn {{ background: var(--bg-card); border: 1px solid var(--border-color); color: var(--text-main); padding: 8px 12px; border-radius: 6px; cursor: pointer; font-size: 0.9rem; transition: all 0.2s; }}
-            .page-btn:hover {{ background: var(--hover-bg); border-color: var(--accent-color); }}
-            .page-btn.active {{ background: var(--accent-color); color: white; border-color: var(--accent-color); }}
-            .page-btn:disabled {{ opacity: 0.5; cursor: not-allowed; }}
-            
-            footer {{ margin-top: 40px; padding-top: 20px; border-top: 1px solid var(--border-color); text-align: center; color: var(--text-muted); font-size: 0.85rem; }}
-            .copyright a {{ color: inherit; text-decoration: none; border-bottom: 1px dotted var(--text-muted); transition: color 0.2s; }}
-            .copyright a:hover {{ color: var(--accent-color); border-bottom-color: var(--accent-color); }}
-            details {{ margin-top: 15px; cursor: pointer; }}
-            details p {{ background: var(--hover-bg); padding: 10px; border-radius: 4px; text-align: left; }}
-        </style>
+        <link rel="stylesheet" href="{STATIC_FILES['index.css']}">
     </head>
     <body>
         <div class="container">
@@ -423,7 +1831,7 @@ def generate_index():
                 </div>
             </div>
             <input type="text" id="searchInput" onkeyup="filterList()" placeholder="Search by title, sender or date...">
-            <ul id="newsList">
+            <ul id="newsList" data-total="{len(pages_data)}" data-page-size="{HUB_PAGE_SIZE}">
                 {links_html}
             </ul>
             <div id="pagination" class="pagination"></div>
@@ -439,738 +1847,1878 @@ def generate_index():
                 </details>
             </footer>
         </div>
-        <script>
-        {JS_TRANSLATION_LOGIC}
+        <script src="{STATIC_FILES['i18n.js']}"></script>
+        <script src="{STATIC_FILES['index.js']}"></script>
+    </body>
+    </html>
+    """
+    with open(f"{OUTPUT_FOLDER}/index.html", "w", encoding='utf-8') as f:
+        f.write(index_content)
 
-        const toggleBtn = document.getElementById('theme-toggle');
-        const root = document.documentElement;
-        const savedTheme = localStorage.getItem('theme');
-        const systemDark = window.matchMedia('(prefers-color-scheme: dark)').matches;
-        
-        if (savedTheme === 'dark' || (!savedTheme && systemDark)) {{ root.setAttribute('data-theme', 'dark'); }}
-        
-        toggleBtn.addEventListener('click', () => {{
-            const currentTheme = root.getAttribute('data-theme');
-            const newTheme = currentTheme === 'dark' ? 'light' : 'dark';
-            root.setAttribute('data-theme', newTheme);
-            localStorage.setItem('theme', newTheme);
-        }});
-
-        const itemsPerPage = 10;
-        let currentPage = 1;
-        const list = document.getElementById("newsList");
-        const allItems = Array.from(list.getElementsByClassName('news-item'));
-        const paginationContainer = document.getElementById('pagination');
-
-        function showPage(page) {{
-            currentPage = page;
-            const start = (page - 1) * itemsPerPage;
-            const end = start + itemsPerPage;
-            
-            allItems.forEach((item, index) => {{
-                if (index >= start && index < end) {{
-                    item.style.display = "";
-                }} else {{
-                    item.style.display = "none";
-                }}
-            }});
-            renderPaginationControls();
-            window.scrollTo(0, 0);
-        }}
+def regenerate_index():
+    # Commande index : sommaire seul, depuis le manifeste et les pages déjà écrites (ni réseau ni identifiants)
+    if not os.path.isdir(OUTPUT_FOLDER):
+        print(f"ERREUR: Dossier introuvable : {OUTPUT_FOLDER}")
+        return
+    publish_static_files()
+    generate_index()
+
+def normalize_document(soup):
+    from bs4 import Tag, NavigableString, Doctype, Comment
+    # Ramène l'arbre à la même forme quel que soit le parser, pour que les diffs de docs/ restent propres :
+    # pas de blancs hors de <html>, et tout le contenu dans <html> (lxml le fait déjà, html.parser non).
+    # Comme lxml, les blancs entre les éléments sont gardés une fois rattachés au <head> ou au <body>.
+    def is_blank(node):
+        return type(node) is NavigableString and not node.strip()
+
+    root = soup.find("html", recursive=False)
+    if root is None:
+        root = soup.new_tag("html")
+        head = soup.new_tag("head")
+        body = soup.new_tag("body")
+        leading = True
+        for node in list(soup.contents):
+            if isinstance(node, (Doctype, Comment)) and leading: continue
+            node.extract()
+            if leading and is_blank(node):
+                # Avant le contenu : perdu, sauf à la suite d'un élément du <head>
+                if head.contents: head.append(node)
+            elif leading and isinstance(node, Tag) and node.name in HEAD_TAGS:
+                head.append(node)
+            else:
+                leading = False
+                body.append(node)
+        if head.contents: root.append(head)
+        root.append(body)
+        soup.append(root)
+    else:
+        for node in list(root.previous_siblings):
+            if is_blank(node): node.extract()
+        # Contenu placé après </html> (accepté tel quel par html.parser) : rattaché au <body>
+        trailing = [node for node in root.next_siblings if not isinstance(node, Comment)]
+        while trailing and is_blank(trailing[0]):
+            trailing.pop(0).extract()
+        if trailing:
+            body = root.find("body", recursive=False)
+            if body is None:
+                body = soup.new_tag("body")
+                root.append(body)
+            for node in trailing:
+                body.append(node.extract())
+                # lxml ouvre parfois un second <html> pour ce contenu : on n'en garde que les enfants
+                if isinstance(node, Tag) and node.name == "html":
+                    for inner_body in node.find_all("body", recursive=False): inner_body.unwrap()
+                    node.unwrap()
+    return soup
+
+def parse_html(markup, parser=None):
+    # Fins de ligne normalisées en amont comme le prévoit HTML5 (lxml le fait, html.parser non)
+    if isinstance(markup, str):
+        markup = markup.replace("\r\n", "\n").replace("\r", "\n")
+    from bs4 import BeautifulSoup
+    return normalize_document(BeautifulSoup(markup, parser or HTML_PARSER))
+
+# --- DÉTECTION DES TRACEURS ---
+def parse_tracker_rule(line):
+    # Renvoie la règle normalisée ("domaine.tld", "domaine.tld/chemin" ou "/fichier"), None pour le reste
+    line = line.split("#", 1)[0].strip().lower()
+    if not line: return None
+    if line.startswith("||"):
+        # Adblock : seules les règles de domaine simples sont reprises
+        line = line[2:].split("$", 1)[0].rstrip("^|")
+        if "*" in line or "^" in line: return None
+    elif " " in line or "\t" in line:
+        # Fichier hosts : "0.0.0.0 domaine.tld"
+        fields = line.split()
+        if fields[0] not in ("0.0.0.0", "127.0.0.1") or len(fields) < 2: return None
+        line = fields[1]
+    if line.startswith("/"): return line if len(line) > 1 else None
+    host = line.split("/", 1)[0]
+    if "." not in host or not all(label for label in host.split(".")): return None
+    return line
+
+class TrackerMatcher:
+    # Domaines rangés dans un trie de labels inversés (net -> doubleclick -> ...) : une recherche coûte
+    # autant d'étapes que l'hôte a de labels, quelle que soit la taille de la liste.
+    # Les noms de fichiers sont réunis dans une seule expression régulière.
+    def __init__(self, rules=()):
+        self.trie = {}
+        filenames = []
+        for rule in rules:
+            if rule.startswith("/"):
+                filenames.append(rule[1:])
+                continue
+            host, _, path = rule.partition("/")
+            node = self.trie
+            for label in reversed(host.split(".")):
+                node = node.setdefault(label, {})
+            node.setdefault(None, []).append(("/" + path if path else "", rule))
+        self.filename_pattern = None
+        if filenames:
+            alternatives = "|".join(re.escape(name) for name in sorted(set(filenames), key=len, reverse=True))
+            self.filename_pattern = re.compile(r'/(' + alternatives + r')$')
+
+    @classmethod
+    def load(cls, path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                rules = [rule for rule in map(parse_tracker_rule, f) if rule]
+        except OSError:
+            print(f"Liste des traceurs introuvable : {path}")
+            rules = []
+        return cls(rules)
+
+    def match(self, url):
+        # Renvoie la règle correspondant à l'URL (la plus précise), ou None
+        url = (url or "").strip()
+        if not url or url.startswith(("data:", "cid:", "mailto:", "tel:")): return None
+        if url.startswith("//"): url = "https:" + url
+        try:
+            parsed = urlparse(url)
+            host = parsed.hostname or ""
+        except ValueError:
+            return None
+        path = parsed.path.lower()
+
+        found = None
+        node = self.trie
+        for label in reversed(host.rstrip(".").split(".")) if host else ():
+            node = node.get(label)
+            if node is None: break
+            for path_prefix, rule in node.get(None, ()):
+                if path.startswith(path_prefix): found = rule
+        if found: return found
+
+        if self.filename_pattern:
+            match = self.filename_pattern.search(path)
+            if match: return "/" + match.group(1)
+        return None
+
+    def match_chain(self, urls):
+        # Lien de suivi : n'importe quelle étape de la chaîne de redirections peut être un traceur
+        for url in urls:
+            rule = self.match(url)
+            if rule: return rule
+        return None
+
+def get_tracker_matcher():
+    global _tracker_matcher
+    with _http_lock:
+        if _tracker_matcher is None:
+            _tracker_matcher = TrackerMatcher.load(TRACKERS_FILE)
+    return _tracker_matcher
+
+def get_declared_size(tag):
+    # Dimensions déclarées (attributs width/height, le style l'emporte) ; None si absentes.
+    # Une valeur autre qu'un nombre de pixels (100%, auto, 2em) n'est pas un pixel : elle compte comme infinie.
+    sizes = {}
+    declared = [(name, tag.get(name)) for name in ("width", "height") if tag.get(name) is not None]
+    declared += STYLE_SIZE_PATTERN.findall(tag.get("style") or "")
+    for name, value in declared:
+        match = PIXEL_SIZE_PATTERN.match(value)
+        sizes[name.lower()] = int(match.group(1)) if match else float("inf")
+    return sizes.get("width"), sizes.get("height")
+
+def is_pixel_sized(tag):
+    # Aucune dimension déclarée au-delà de 1px
+    return all(size is None or size <= 1 for size in get_declared_size(tag))
+
+def is_tiny_image(path):
+    # Poids minuscule et dimensions réelles de 1x1 au plus, lues dans l'en-tête (PNG et GIF seulement)
+    if os.path.getsize(path) > TRACKER_MAX_PIXEL_BYTES: return False
+    with open(path, 'rb') as f:
+        head = f.read(24)
+    if head.startswith(b'\x89PNG') and len(head) == 24:
+        width, height = struct.unpack('>II', head[16:24])
+    elif head.startswith((b'GIF87a', b'GIF89a')) and len(head) >= 10:
+        width, height = struct.unpack('<HH', head[6:10])
+    else:
+        # Format dont on ne lit pas les dimensions : on garde l'image plutôt que de risquer un faux positif
+        return False
+    return width <= 1 and height <= 1
+
+def detect_tracking_image(img, src):
+    rule = get_tracker_matcher().match(src)
+    if rule: return rule
+    if src.startswith(("data:", "cid:")) or not is_pixel_sized(img): return None
+    if all(size is not None for size in get_declared_size(img)): return "1x1"
+    if HIDDEN_STYLE_PATTERN.search(img.get("style") or ""): return "display:none"
+    return None
+
+def strip_tracking_image(img, src, rule, ctx):
+    ctx["pixels"].append((src, rule))
+    img['src'] = ""
+    img['alt'] = "[TRACKING PIXEL REMOVED]"
+    img['style'] = "display:none !important;"
+
+# --- PIPELINE DOM ---
+# Un seul parcours de l'arbre : chaque passe est enregistrée pour un nom de balise (None = toutes)
+# et reçoit le nœud et le contexte commun. Les suppressions sont appliquées après le parcours.
+REMOVED_TAGS = ("script", "iframe", "object", "meta")
+FORWARD_MARKERS = ["Forwarded message", "Message transféré"]
+LAZY_ATTRS = ['data-src', 'data-original', 'data-lazy', 'data-url']
+CSS_URL_PATTERN = re.compile(r'url\s*\((?:["\']?)(.*?)(?:["\']?)\)', re.IGNORECASE)
+
+def pass_fix_lazy_image(img, ctx):
+    for attr in LAZY_ATTRS:
+        if img.get(attr):
+            img['src'] = img[attr]
+            del img[attr]
+            break
+
+    if img.get('srcset'):
+        if not img.get('src'):
+            try:
+                first_url = img['srcset'].split(',')[0].split(' ')[0]
+                img['src'] = first_url
+            except: pass
+        del img['srcset']
+
+def pass_strip_tracking_pixel(img, ctx):
+    # Après pass_fix_lazy_image, pour voir aussi les pixels chargés en différé
+    src = img.get("src")
+    if not src: return
+    rule = detect_tracking_image(img, src)
+    if rule:
+        strip_tracking_image(img, src, rule, ctx)
+
+def pass_collect_image(img, ctx):
+    src = img.get("src")
+    if src and src.startswith("cid:"):
+        ctx["inline_images"].append((img, unquote(src[4:]).strip("<>")))
+        return
+    if not src or src.startswith("data:"): return
+    if src.startswith("//"): src = "https:" + src
+    ctx["images"].append((img, src))
+
+def pass_index_link(a, ctx):
+    if a.has_attr('href'):
+        ctx["links"].append(a)
+
+def pass_collect_style_urls(tag, ctx):
+    style = tag.get('style')
+    if not style or 'url' not in style: return
+    urls = []
+    for url in CSS_URL_PATTERN.findall(style):
+        original_url = url.strip()
+        if original_url.startswith("data:"): continue
+        rule = get_tracker_matcher().match(original_url)
+        if rule:
+            # Laissé distant comme avant, mais signalé avec les pixels
+            ctx["pixels"].append((original_url, rule))
+            continue
+        target_url = original_url
+        if target_url.startswith("//"): target_url = "https:" + target_url
+        urls.append((original_url, target_url))
+    if urls: ctx["styles"].append((tag, urls))
+
+DOM_PASSES = [
+    ("img", pass_fix_lazy_image),
+    ("img", pass_strip_tracking_pixel),
+    ("img", pass_collect_image),
+    ("a", pass_index_link),
+    (None, pass_collect_style_urls),
+]
 
-        function renderPaginationControls() {{
-            const totalPages = Math.ceil(allItems.length / itemsPerPage);
-            paginationContainer.innerHTML = '';
-            
-            if (totalPages <= 1) return;
+def walk_dom(root, passes, ctx):
+    from bs4 import Tag
+    tag_passes = {}
+    for name, func in passes:
+        tag_passes.setdefault(name, []).append(func)
+    generic_passes = tag_passes.pop(None, [])
+    text_types = root.interesting_string_types
+
+    # Parcours préfixe itératif ; le booléen indique si un <div> englobe déjà le nœud
+    stack = [(child, False) for child in reversed(root.contents)]
+    while stack:
+        node, in_div = stack.pop()
+        if isinstance(node, Tag):
+            if node.name in REMOVED_TAGS:
+                ctx["removed"].append(node)
+                continue
+            if node.name == "div" and not in_div:
+                ctx["top_divs"].append(node)
+            for func in tag_passes.get(node.name, ()):
+                func(node, ctx)
+            for func in generic_passes:
+                func(node, ctx)
+            child_in_div = in_div or node.name == "div"
+            stack.extend((child, child_in_div) for child in reversed(node.contents))
+        elif type(node) in text_types:
+            ctx["strings"].append(node)
+
+def is_attached(node, root):
+    while node is not None:
+        if node is root: return True
+        node = node.parent
+    return False
+
+def trim_forwarded_header(soup, top_divs):
+    # Le premier <div> (ordre du document) contenant le bandeau de transfert est forcément un <div>
+    # de premier niveau : on ne calcule donc get_text() que sur ceux-là, en temps linéaire.
+    for div in top_divs:
+        text = div.get_text()
+        if any(k in text for k in FORWARD_MARKERS) and "-----" in text:
+            new_body = soup.new_tag("body")
+            for sibling in div.next_siblings: new_body.append(sibling)
+            if soup.body:
+                soup.body.replace_with(new_body)
+            return True
+    return False
+
+def transform_email(soup):
+    ctx = {"pixels": [], "images": [], "inline_images": [], "links": [], "styles": [], "strings": [], "removed": [], "top_divs": []}
+    walk_dom(soup, DOM_PASSES, ctx)
+
+    # Nettoyage léger
+    for tag in ctx["removed"]:
+        tag.extract()
+
+    # Gestion des blocs de transfert Gmail : on écarte ce qui a été détaché de l'arbre
+    if trim_forwarded_header(soup, ctx["top_divs"]):
+        for key in ("images", "inline_images", "styles"):
+            ctx[key] = [item for item in ctx[key] if is_attached(item[0], soup)]
+        ctx["links"] = [a for a in ctx["links"] if is_attached(a, soup)]
+        ctx["strings"] = [string for string in ctx["strings"] if is_attached(string, soup)]
+
+    stripped = (string.strip() for string in ctx["strings"])
+    ctx["text"] = " ".join(string for string in stripped if string)
+    return ctx
+
+def parse_header_fetch_response(data):
+    # Réponse imaplib : (b'1 (UID 42 RFC822.SIZE 1234 BODY[HEADER.FIELDS (...)] {n}', b'<en-têtes>'), puis b')'
+    # Selon le serveur, UID et RFC822.SIZE peuvent aussi arriver après le littéral, dans l'élément suivant
+    results = []
+    for i, item in enumerate(data or []):
+        if not isinstance(item, tuple): continue
+        meta = item[0]
+        if i + 1 < len(data) and isinstance(data[i + 1], bytes):
+            meta += data[i + 1]
+        uid_match = re.search(rb'UID (\d+)', meta)
+        if not uid_match: continue
+        size_match = re.search(rb'RFC822\.SIZE (\d+)', meta)
+        internal_date = imaplib.Internaldate2tuple(meta)
+        results.append({
+            "uid": uid_match.group(1).decode(),
+            "size": int(size_match.group(1)) if size_match else None,
+            "date": time.mktime(internal_date) if internal_date else None,
+            "header": item[1]
+        })
+    return results
+
+def tokenize_imap_response(data):
+    # Aplatit la réponse imaplib en jetons ; le contenu d'un littéral {n} reste en bytes
+    tokens = []
+    for item in data or []:
+        chunks = [item[0], item[1]] if isinstance(item, tuple) else [item]
+        for match in IMAP_TOKEN_PATTERN.finditer(chunks[0]):
+            if match.group(2) is not None: continue
+            token = match.group(0)
+            if token in (b"(", b")"):
+                tokens.append(token.decode())
+            elif match.group(1) is not None:
+                tokens.append(("str", re.sub(rb'\\(.)', rb'\1', match.group(1)).decode('utf-8', errors='replace')))
+            else:
+                atom = token.decode('utf-8', errors='replace')
+                tokens.append(("str", None if atom.upper() == "NIL" else atom))
+        if len(chunks) > 1:
+            tokens.append(("literal", chunks[1]))
+    return tokens
+
+def parse_fetch_items(data):
+    # "1 (UID 42 BODYSTRUCTURE (...) BODY[2] {n}...)" -> {"UID": "42", "BODYSTRUCTURE": [...], "BODY[2]": b"..."}
+    stack = [[]]
+    for token in tokenize_imap_response(data):
+        if token == "(":
+            stack.append([])
+        elif token == ")":
+            if len(stack) > 1:
+                closed = stack.pop()
+                stack[-1].append(closed)
+        else:
+            stack[-1].append(token[1])
+    items = next((value for value in stack[0] if isinstance(value, list)), [])
+    return {str(items[i]).upper(): items[i + 1] for i in range(0, len(items) - 1, 2)}
+
+def walk_bodystructure(body, section=()):
+    # (section, partie) de chaque partie simple, dans l'ordre de msg.walk()
+    if isinstance(body[0], list):
+        for i, child in enumerate(itertools.takewhile(lambda p: isinstance(p, list), body), 1):
+            yield from walk_body_part(child, section + (i,))
+    else:
+        # Le corps d'un message non multipart est sa section 1
+        yield from walk_body_part(body, section + (1,))
+
+def walk_body_part(part, section):
+    if isinstance(part[0], list):
+        for i, child in enumerate(itertools.takewhile(lambda p: isinstance(p, list), part), 1):
+            yield from walk_body_part(child, section + (i,))
+        return
+    yield ".".join(str(n) for n in section), part
+    # message/rfc822 : type, sous-type, params, id, desc, encodage, taille, enveloppe, corps, lignes
+    if str(part[0]).lower() == "message" and str(part[1]).lower() == "rfc822" and len(part) > 8 and isinstance(part[8], list):
+        yield from walk_bodystructure(part[8], section)
+
+def get_body_param(part, name):
+    params = part[2] if isinstance(part[2], list) else []
+    for i in range(0, len(params) - 1, 2):
+        if str(params[i]).lower() == name:
+            return params[i + 1]
+    return None
+
+def get_decoded_part_size(part):
+    # Taille annoncée par BODYSTRUCTURE (encodée) ramenée à la taille décodée
+    try:
+        size = int(part[6])
+    except (TypeError, ValueError, IndexError):
+        return 0
+    return size * 3 // 4 if str(part[5]).lower() == "base64" else size
+
+def decode_transfer_encoding(data, encoding):
+    encoding = (encoding or "").lower()
+    if encoding == "base64":
+        try:
+            return binascii.a2b_base64(data)
+        except binascii.Error:
+            # Même tolérance que email : padding manquant
+            return base64.b64decode(data + b"===", validate=False)
+    if encoding == "quoted-printable":
+        return quopri.decodestring(data)
+    return data
+
+def fetch_message_parts(mail, uid):
+    # BODYSTRUCTURE + en-têtes, puis uniquement la partie text/html et les images inline qu'elle référence
+    status, data = mail.uid('FETCH', uid, '(BODYSTRUCTURE BODY.PEEK[HEADER])')
+    if status != 'OK': return None
+    items = parse_fetch_items(data)
+    structure = items.get("BODYSTRUCTURE")
+    header = items.get("BODY[HEADER]")
+    if not isinstance(structure, list) or not structure or not isinstance(header, bytes): return None
+
+    parts = list(walk_bodystructure(structure))
+    html_part = next(((section, part) for section, part in parts
+                      if str(part[0]).lower() == "text" and str(part[1]).lower() == "html"), None)
+    message = {"header": header, "html": None, "charset": None, "inline": {}, "oversize": None}
+    if not html_part: return message
+
+    section, part = html_part
+    html_size = get_decoded_part_size(part)
+    if html_size > MAX_HTML_BYTES:
+        message["oversize"] = html_size
+        return message
+    status, data = mail.uid('FETCH', uid, f'(BODY.PEEK[{section}])')
+    if status != 'OK': return None
+    payload = parse_fetch_items(data).get(f"BODY[{section}]")
+    if not isinstance(payload, bytes): return None
+    message["html"] = decode_transfer_encoding(payload, part[5])
+    message["charset"] = get_body_param(part, "charset")
+
+    # Images cid: réellement utilisées par le HTML, toutes en une seule requête
+    referenced = {unquote(ref.decode('ascii', errors='ignore')) for ref in CID_REF_PATTERN.findall(message["html"])}
+    inline_parts = {}
+    for inline_section, inline_part in parts:
+        content_id = str(inline_part[3] or "").strip("<>")
+        if (content_id and content_id in referenced and str(inline_part[0]).lower() == "image"
+                and get_decoded_part_size(inline_part) <= MAX_ASSET_BYTES):
+            inline_parts[inline_section] = (content_id, inline_part)
+    if inline_parts:
+        fetch_items = " ".join(f"BODY.PEEK[{inline_section}]" for inline_section in inline_parts)
+        status, data = mail.uid('FETCH', uid, f'({fetch_items})')
+        if status == 'OK':
+            items = parse_fetch_items(data)
+            for inline_section, (content_id, inline_part) in inline_parts.items():
+                content = items.get(f"BODY[{inline_section}]")
+                if isinstance(content, bytes):
+                    content_type = f"{inline_part[0]}/{inline_part[1]}".lower()
+                    message["inline"][content_id] = (content_type, decode_transfer_encoding(content, inline_part[5]))
+    return message
+
+def fetch_all_headers(mail, since_uid=None):
+    # Un UID FETCH par bloc de HEADER_FETCH_CHUNK messages au lieu d'un aller-retour par message
+    criteria = f'UID {since_uid + 1}:*' if since_uid else 'ALL'
+    status, data = mail.uid('SEARCH', None, criteria)
+    # Une liste incomplète ferait passer les messages manquants pour supprimés : on abandonne plutôt le cycle
+    if status != 'OK': raise imaplib.IMAP4.error(f"UID SEARCH a échoué : {status}")
+    if not data or not data[0]: return []
+    # "n:*" renvoie toujours le dernier message, même si son UID est inférieur à n
+    uids = sorted((uid for uid in data[0].split() if not since_uid or int(uid) > since_uid), key=int)
+    if not uids: return []
+
+    headers = []
+    for i in range(0, len(uids), HEADER_FETCH_CHUNK):
+        chunk = uids[i:i + HEADER_FETCH_CHUNK]
+        uid_range = f"{chunk[0].decode()}:{chunk[-1].decode()}"
+        status, data = mail.uid('FETCH', uid_range, f'(UID RFC822.SIZE INTERNALDATE BODY.PEEK[HEADER.FIELDS ({HEADER_FIELDS})])')
+        if status != 'OK': raise imaplib.IMAP4.error(f"UID FETCH {uid_range} a échoué : {status}")
+        headers.extend(parse_header_fetch_response(data))
+    headers.sort(key=lambda h: int(h["uid"]))
+    return headers
+
+# --- PIPELINE DE TRAITEMENT ---
+# IMAP -> parsing/nettoyage -> enrichissement réseau -> rendu/écriture, chaque étape avec ses propres workers
+def extract_html_part(msg):
+    if msg.is_multipart():
+        for part in msg.walk():
+            if part.get_content_type() == "text/html":
+                return part.get_payload(decode=True), part.get_content_charset()
+    elif msg.get_content_type() == "text/html":
+        return msg.get_payload(decode=True), msg.get_content_charset()
+    return None, None
+
+def decode_html_payload(payload, charset):
+    decoding_options = [charset, 'utf-8', 'windows-1252', 'iso-8859-1']
+    for encoding in decoding_options:
+        if not encoding: continue
+        try:
+            return payload.decode(encoding)
+        except (UnicodeDecodeError, LookupError):
+            continue
+    return payload.decode('utf-8', errors='ignore')
+
+def extract_inline_images(msg):
+    # Parties image avec un Content-ID, pour les <img src="cid:..."> (chemin RFC822 complet)
+    inline = {}
+    for part in msg.walk():
+        content_id = (part.get("Content-ID") or "").strip().strip("<>")
+        if content_id and part.get_content_maintype() == "image":
+            content = part.get_payload(decode=True)
+            if content: inline[content_id] = (part.get_content_type(), content)
+    return inline
+
+def hash_message_parts(message):
+    digest = hashlib.sha256(message["header"])
+    digest.update(message["html"] or b"")
+    for content_id in sorted(message["inline"]):
+        digest.update(content_id.encode())
+        digest.update(message["inline"][content_id][1])
+    return digest.hexdigest()
+
+def fetch_message(source, job, force):
+    # Seule étape qui lit la source : un seul worker, ni la connexion IMAP ni un mbox ne se partagent entre threads
+    stats = job["stats"]
+    with timed(stats, "fetch"):
+        source.fetch(job)
+        if job.get("status"): return
+        if job.get("parts") is not None:
+            message = job["parts"]
+            if not job.get("content_hash"): job["content_hash"] = hash_message_parts(message)
+            count(stats, "source_bytes", len(message["header"]) + len(message["html"] or b"")
+                  + sum(len(content) for _, content in message["inline"].values()))
+        else:
+            if len(job["raw"]) > MAX_MESSAGE_BYTES:
+                job["oversize"] = len(job["raw"])
+                job["status"] = "too_large"
+                return
+            if not job.get("content_hash"): job["content_hash"] = hashlib.sha256(job["raw"]).hexdigest()
+            count(stats, "source_bytes", len(job["raw"]))
+        if source.caches_raw:
+            path = get_raw_cache_path(job["message_id"], source.name, source.uidvalidity, job["uid"])
+            if store_raw_message(path, job): count(stats, "raw_cached")
+    entry = job["entry"]
+
+    # Même contenu déjà rendu avec la même version : on ne met à jour que les identifiants
+    if (not force and entry and entry.get("content_hash") == job["content_hash"]
+            and entry.get("processing_version") == PROCESSING_VERSION
+            and os.path.exists(os.path.join(OUTPUT_FOLDER, job["id"], "index.html"))):
+        job["raw"] = None
+        job["parts"] = None
+        job["status"] = "unchanged"
+
+# --- SOURCES DE MESSAGES ---
+class SourceUnavailable(Exception):
+    # open() a échoué (identifiants absents, libellé introuvable...) : rien n'a été lu
+    pass
+
+# Même interface pour toutes : open() -> bool, list_headers() -> [{"uid", "size", "header"}], fetch(job), close().
+# Une source peut ajouter "source" (origine à garder au manifeste) et "key" (repris tel quel dans job["key"]).
+# list_headers() ne lit que les en-têtes ; le corps n'est lu qu'au passage du message dans le pipeline.
+class ImapSource:
+    # Libellé Gmail : il fait foi, les archives qui n'y sont plus sont supprimées. Sauf en écoute (--daemon)
+    # avec since_uid : seuls les nouveaux UID sont listés, rien ne peut donc être supprimé.
+    name = "imap"
+    caches_raw = True
+
+    def __init__(self, host="imap.gmail.com", label=TARGET_LABEL):
+        self.host = host
+        self.label = label
+        self.mail = None
+        self.uidvalidity = None
+        self.keep_open = False
+        self.since_uid = None
+        self.last_uid = None
+
+    @property
+    def authoritative(self):
+        return self.since_uid is None
+
+    def open(self):
+        if self.mail is not None: return True   # connexion gardée entre deux cycles du daemon
+        user, password = os.environ.get("GMAIL_USER"), os.environ.get("GMAIL_PASSWORD")
+        if user is None or password is None:
+            print("ERREUR: Variables d'environnement GMAIL_USER et GMAIL_PASSWORD requises pour lire Gmail.")
+            return False
+        print("Connexion au serveur Gmail...")
+        self.mail = imaplib.IMAP4_SSL(self.host)
+        try:
+            self.mail.login(user, password)
+            rv, data = self.mail.select(f'"{self.label}"')
+        except (imaplib.IMAP4.error, OSError):
+            self.disconnect()
+            raise
+        if rv != 'OK':
+            print(f"ERREUR: Impossible de trouver le libellé '{self.label}'.")
+            self.disconnect()
+            return False
+        typ, uidvalidity_data = self.mail.response('UIDVALIDITY')
+        self.uidvalidity = uidvalidity_data[0].decode() if uidvalidity_data and uidvalidity_data[0] else None
+        return True
+
+    def list_headers(self):
+        headers = fetch_all_headers(self.mail, self.since_uid)
+        if headers: self.last_uid = max(int(ref["uid"]) for ref in headers)
+        return headers
+
+    def fetch(self, job):
+        try:
+            message = fetch_message_parts(self.mail, job["uid"])
+        except imaplib.IMAP4.abort:
+            raise   # connexion perdue : inutile de retenter sur le même socket
+        except (imaplib.IMAP4.error, ValueError, IndexError, KeyError, TypeError):
+            message = None   # BODYSTRUCTURE refusé ou illisible : repli sur le message complet
+        if message is not None:
+            job["parts"] = message
+        elif job.get("size") and job["size"] > MAX_MESSAGE_BYTES:
+            job["oversize"] = job["size"]
+            job["status"] = "too_large"
+        else:
+            # Serveur sans BODYSTRUCTURE exploitable : message complet
+            status, msg_data = self.mail.uid('FETCH', job["uid"], '(RFC822)')
+            if status != 'OK' or not msg_data or not isinstance(msg_data[0], tuple):
+                raise imaplib.IMAP4.error(f"UID FETCH (RFC822) a échoué : {status}")
+            job["raw"] = msg_data[0][1]
+
+    def close(self):
+        if not self.keep_open: self.disconnect()
+
+    def disconnect(self):
+        if self.mail is None: return
+        # CLOSE échoue hors libellé sélectionné ; LOGOUT ferme le socket dans tous les cas
+        for command in (self.mail.close, self.mail.logout):
+            try:
+                command()
+            except (imaplib.IMAP4.error, OSError):
+                pass   # connexion déjà perdue
+        self.mail = None
+
+def read_message_header(f):
+    # En-têtes seuls, jusqu'à la première ligne vide
+    lines = []
+    for line in f:
+        if line in (b"\r\n", b"\n"): break
+        lines.append(line)
+    return b"".join(lines) + b"\n"
+
+class FileSource:
+    # Import en masse depuis un mbox, un Maildir ou un dossier de .eml. Ces fichiers ne sont pas la boîte de
+    # référence : rien n'est supprimé, et les archives importées sont marquées pour que la synchro IMAP les garde.
+    authoritative = False
+    uidvalidity = None
+    caches_raw = True
+
+    def __init__(self, path, kind=None):
+        self.path = path
+        self.name = kind or self.detect_kind(path)
+        self.mailbox = None
+
+    @staticmethod
+    def detect_kind(path):
+        if os.path.isfile(path): return "mbox"
+        if all(os.path.isdir(os.path.join(path, sub)) for sub in ("cur", "new", "tmp")): return "maildir"
+        return "eml"
+
+    def open(self):
+        print(f"Lecture de {self.path} ({self.name})...")
+        if self.name == "mbox":
+            self.mailbox = mailbox.mbox(self.path, create=False)
+        elif self.name == "maildir":
+            self.mailbox = mailbox.Maildir(self.path, factory=None, create=False)
+        elif not os.path.isdir(self.path):
+            print(f"ERREUR: Dossier introuvable : {self.path}")
+            return False
+        return True
+
+    def keys(self):
+        if self.mailbox is not None:
+            # mbox : ordre du fichier ; Maildir : les clés commencent par l'horodatage de réception
+            return sorted(self.mailbox.keys())
+        paths = []
+        for root, dirs, files in os.walk(self.path):
+            dirs.sort()
+            paths.extend(os.path.relpath(os.path.join(root, name), self.path) for name in sorted(files) if name.lower().endswith(".eml"))
+        return paths
+
+    def list_headers(self):
+        headers = []
+        for key in self.keys():
+            if self.mailbox is not None:
+                with contextlib.closing(self.mailbox.get_file(key)) as f:
+                    header = read_message_header(f)
+                size = None
+            else:
+                path = os.path.join(self.path, key)
+                with open(path, "rb") as f:
+                    header = read_message_header(f)
+                size = os.path.getsize(path)
+            headers.append({"uid": str(key), "size": size, "header": header})
+        return headers
+
+    def fetch(self, job):
+        if job.get("size") and job["size"] > MAX_MESSAGE_BYTES:
+            job["oversize"] = job["size"]
+            job["status"] = "too_large"
+            return
+        key = job["uid"]
+        if self.name == "mbox":
+            job["raw"] = self.mailbox.get_bytes(int(key))
+        elif self.mailbox is not None:
+            job["raw"] = self.mailbox.get_bytes(key)
+        else:
+            with open(os.path.join(self.path, key), "rb") as f:
+                job["raw"] = f.read()
+
+    def close(self):
+        if self.mailbox is not None: self.mailbox.close()
+
+class RawCacheSource:
+    # --reprocess : relit les messages du cache brut, sans IMAP. Rien n'est supprimé et chaque archive
+    # garde sa source d'origine (et son empreinte de contenu) dans le manifeste.
+    name = "cache"
+    authoritative = False
+    uidvalidity = None
+    caches_raw = False
+
+    def __init__(self, ids=None):
+        self.ids = ids
+        self.refs = {}
+
+    def open(self):
+        manifest = load_manifest()
+        entries = manifest["entries"]
+        missing = 0
+        for f_id in (self.ids or sorted(entries)):
+            entry = entries.get(f_id)
+            if entry is None:
+                print(f"Archive inconnue : {f_id}")
+                continue
+            path = get_entry_raw_path(entry, manifest.get("uidvalidity"))
+            if not os.path.exists(path):
+                missing += 1
+                print(f"Absent du cache brut : {f_id} (lu avant la mise en place du cache ? rebuild le relira depuis Gmail)")
+                continue
+            self.refs[f_id] = (entry, path)
+        print(f"Retraitement de {len(self.refs)} archives depuis {RAW_CACHE_FOLDER}"
+              + (f" ({missing} absentes du cache)" if missing else "") + "...")
+        return True
+
+    def list_headers(self):
+        headers = []
+        for key, (entry, path) in self.refs.items():
+            with gzip.open(path, "rb") as f:
+                header = read_message_header(f)
+            # "key" suit le message jusqu'à fetch() : l'identifiant recalculé peut différer de celui du manifeste
+            headers.append({"uid": entry.get("uid"), "size": None, "header": header,
+                            "source": entry.get("source", ImapSource.name), "key": key})
+        return headers
+
+    def fetch(self, job):
+        entry, path = self.refs[job["key"]]
+        with gzip.open(path, "rb") as f:
+            job["raw"] = f.read()
+        job["content_hash"] = entry.get("content_hash")
+
+    def close(self):
+        pass
 
-            const prevBtn = document.createElement('button');
-            prevBtn.className = 'page-btn';
-            prevBtn.innerHTML = '&laquo;';
-            prevBtn.disabled = currentPage === 1;
-            prevBtn.onclick = () => showPage(currentPage - 1);
-            paginationContainer.appendChild(prevBtn);
+def parse_message(job):
+    stats = job["stats"]
+    raw = job.pop("raw", None)
+    message = job.pop("parts", None)
+    with timed(stats, "decode"):
+        msg = email.message_from_bytes(raw if raw is not None else message["header"])
+
+        raw_subject = get_decoded_email_subject(msg)
+        job["subject"] = clean_subject_prefixes(raw_subject)
+        job["sender_name"] = get_clean_sender(msg)
+        job["email_date_str"] = get_email_date(msg)
+
+        # EXTRACTION
+        if raw is not None:
+            payload, charset = extract_html_part(msg)
+            job["inline"] = extract_inline_images(msg)
+        else:
+            payload, charset = message["html"], message["charset"]
+            job["inline"] = message["inline"]
+            job["oversize"] = message["oversize"]
+        del raw, message, msg
+
+    if payload and len(payload) > MAX_HTML_BYTES:
+        job["oversize"] = len(payload)
+    if job.get("oversize"):
+        job["status"] = "too_large"
+        return
+    if not payload:
+        job["status"] = "skipped"
+        return
 
-            let startPage = Math.max(1, currentPage - 2);
-            let endPage = Math.min(totalPages, currentPage + 2);
-            
-            if (startPage > 1) {{
-                const firstPage = document.createElement('button');
-                firstPage.className = 'page-btn';
-                firstPage.innerText = '1';
-                firstPage.onclick = () => showPage(1);
-                paginationContainer.appendChild(firstPage);
-                if (startPage > 2) paginationContainer.appendChild(document.createTextNode('...'));
-            }}
-
-            for (let i = startPage; i <= endPage; i++) {{
-                const btn = document.createElement('button');
-                btn.className = `page-btn ${{i === currentPage ? 'active' : ''}}`;
-                btn.innerText = i;
-                btn.onclick = () => showPage(i);
-                paginationContainer.appendChild(btn);
-            }}
-
-            if (endPage < totalPages) {{
-                if (endPage < totalPages - 1) paginationContainer.appendChild(document.createTextNode('...'));
-                const lastPage = document.createElement('button');
-                lastPage.className = 'page-btn';
-                lastPage.innerText = totalPages;
-                lastPage.onclick = () => showPage(totalPages);
-                paginationContainer.appendChild(lastPage);
-            }}
-
-            const nextBtn = document.createElement('button');
-            nextBtn.className = 'page-btn';
-            nextBtn.innerHTML = '&raquo;';
-            nextBtn.disabled = currentPage === totalPages;
-            nextBtn.onclick = () => showPage(currentPage + 1);
-            paginationContainer.appendChild(nextBtn);
-        }}
+    # DECODAGE
+    with timed(stats, "decode"):
+        html_content = decode_html_payload(payload, charset)
+    del payload
+
+    # PARSING
+    with timed(stats, "parse"):
+        soup = parse_html(html_content)
+    del html_content
+
+    # --- NETTOYAGE, PIXELS, LIENS, IMAGES ET TEXTE (un seul parcours) ---
+    with timed(stats, "sanitize"):
+        dom = transform_email(soup)
+    count(stats, "pixels", len(dom["pixels"]))
+    job["soup"] = soup
+    job["dom"] = dom
+
+    # EXTRACTION PREHEADER
+    raw_text = dom["text"]
+    preheader_txt = raw_text[:160] + "..." if len(raw_text) > 160 else raw_text
+    job["preheader_txt"] = preheader_txt
+    job["safe_preheader_attr"] = html.escape(preheader_txt, quote=True)
+
+    # CALCUL DU TEMPS DE LECTURE
+    word_count = len(raw_text.split())
+    reading_time_min = max(1, round(word_count / 200))
+    job["reading_time_str"] = f"{reading_time_min} min"
+
+    # TERMES DE RECHERCHE (texte déjà extrait par le parcours, plus les métadonnées affichées dans le sommaire)
+    with timed(stats, "terms"):
+        job["terms"] = extract_search_terms(job["subject"], job["sender_name"], raw_text, format_date_fr(job["email_date_str"]))
+
+def enrich_message(job):
+    stats = job["stats"]
+    dom = job["dom"]
+    newsletter_path = os.path.join(OUTPUT_FOLDER, job["id"])
+    os.makedirs(newsletter_path, exist_ok=True)
+
+    # TRAITEMENT DES LIENS ET RÉSOLUTION DES REDIRECTIONS
+    links = []
+    link_idx = 0
+
+    all_links = dom["links"]
+    print(f"   -> {job['id']} : résolution de {len(all_links)} liens...")
+    with timed(stats, "links"):
+        resolutions = resolve_redirect_chains([a['href'] for a in all_links], stats)
+    count(stats, "links", len(all_links))
+    matcher = get_tracker_matcher()
+
+    for a, (final_dest, chain) in zip(all_links, resolutions):
+        # MODIF: Ajouter un index de données pour la correspondance
+        a['data-index'] = str(link_idx + 1)
+
+        txt = a.get_text(strip=True) or "[Image/Vide]"
+        link_id = f"detected-link-{link_idx}"
+        a['id'] = link_id
+
+        original_url = a['href']
+
+        chain_text = "\n⬇\n".join(chain)
+
+        links.append({
+            'id': link_id,
+            'index': link_idx + 1,
+            'txt': txt[:50] + "..." if len(txt)>50 else txt, 
+            'original_url': original_url,
+            'final_url': final_dest,
+            'chain_text': chain_text,
+            'tracker': matcher.match_chain([original_url] + chain[1:])
+        })
+        link_idx += 1
+    job["links"] = links
+
+    # --- IMAGES LOCALES (stockage partagé, adressé par contenu) ---
+    # Images et url() CSS collectées par le parcours : téléchargement groupé puis réécriture
+    remove_legacy_local_assets(newsletter_path)
+    image_targets = dom["images"]
+    style_targets = dom["styles"]
+
+    with timed(stats, "assets"):
+        stored = download_assets([src for _, src in image_targets] + [target for _, urls in style_targets for _, target in urls], stats)
+    stored_assets = set()
+
+    for img, src in image_targets:
+        if src in stored:
+            # Pixel inconnu de la liste : image minuscule sans dimensions déclarées plus grandes
+            if is_pixel_sized(img) and is_tiny_image(os.path.join(OUTPUT_FOLDER, stored[src])):
+                strip_tracking_image(img, src, f"1x1 ≤ {TRACKER_MAX_PIXEL_BYTES} B", dom)
+                count(stats, "pixels")
+                continue
+            img['src'] = "../" + stored[src]
+            img['loading'] = 'lazy'
+            stored_assets.add(stored[src])
+
+    for tag, urls in style_targets:
+        new_style = tag['style']
+        for original_url, target_url in urls:
+            if target_url in stored:
+                new_style = new_style.replace(original_url, "../" + stored[target_url])
+                stored_assets.add(stored[target_url])
+        tag['style'] = new_style
+
+    # Images inline (cid:) : contenu déjà récupéré avec le message, rangé dans le même stockage
+    with timed(stats, "assets"):
+        for img, content_id in dom["inline_images"]:
+            if content_id in job["inline"]:
+                content_type, content = job["inline"][content_id]
+                rel_path = store_asset(content, guess_asset_extension(content_type))
+                if rel_path:
+                    img['src'] = "../" + rel_path
+                    img['loading'] = 'lazy'
+                    stored_assets.add(rel_path)
+    count(stats, "images", len(stored_assets))
+    job["stored_assets"] = stored_assets
+
+def prepare_frame_document(soup):
+    # Ce que le viewer ajoutait via contentDocument.write() : encodage, viewport, liens dans un nouvel onglet, styles
+    root = soup.find("html", recursive=False)
+    head = root.find("head", recursive=False)
+    if head is None:
+        head = soup.new_tag("head")
+        root.insert(0, head)
+    head.insert(0, soup.new_tag("meta", charset="utf-8"))
+    head.append(soup.new_tag("meta", attrs={"name": "viewport", "content": "width=device-width, initial-scale=1.0"}))
+    head.append(soup.new_tag("base", target="_blank"))
+    style = soup.new_tag("style")
+    style.string = FRAME_STYLE
+    head.append(style)
+
+def render_message(job):
+    # "render" = tout sauf les écritures disque, comptées à part dans "write"
+    stats = job["stats"]
+    start = time.perf_counter()
+    write_before = stats["timings"].get("write", 0.0)
+    soup = job.pop("soup")
+    links = job["links"]
+    subject = job["subject"]
+    sender_name = job["sender_name"]
+    email_date_str = job["email_date_str"]
+    safe_preheader_attr = job["safe_preheader_attr"]
+    reading_time_str = job["reading_time_str"]
+    detected_pixels_list = job.pop("dom")["pixels"]
+    job.pop("inline", None)
+    newsletter_path = os.path.join(OUTPUT_FOLDER, job["id"])
+
+    # Génération HTML des liens
+    links_html = ""
+    for l in links:
+        safe_tooltip = html.escape(l["chain_text"], quote=True)
+        tracker_badge = ""
+        if l["tracker"]:
+            tracker_badge = f'<span class="link-tracker" data-i18n-title="link_tracker_title" title="Click tracking">{html.escape(l["tracker"])}</span>'
+        links_html += f'''
+        <li class="link-card">
+            <div class="link-card-header">
+                <span class="link-number">#{l['index']}</span>
+                {l["txt"]}
+                {tracker_badge}
+            </div>
+            <div class="link-card-body">
+                <div class="link-line" title="Original Link">
+                    <span class="link-icon-box">{ICON_ORIGIN}</span>
+                    <span class="link-url-text orig">{l["original_url"]}</span>
+                </div>
+                <div class="link-arrow-sep">{ICON_ARROW_DOWN}</div>
+                <div class="link-line" title="Destination Link">
+                    <span class="link-icon-box">{ICON_DEST}</span>
+                    <span class="link-url-text dest">{l["final_url"]}</span>
+                </div>
+            </div>
+            <div class="link-card-footer">
+                <button class="btn-action btn-chain" data-tooltip="{safe_tooltip}" title="Show Redirect Path">
+                    {ICON_CHAIN} Path
+                </button>
+                <button class="btn-action" onclick="scrollToLink('{l["id"]}')" title="Locate in Email">
+                    {ICON_EYE} Locate
+                </button>
+                <button class="btn-action" onclick="copyToClipboard('{l["final_url"]}')" title="Copy Final URL">
+                    {ICON_COPY} Copy
+                </button>
+            </div>
+        </li>
+        '''
 
-        function filterList() {{
-            const input = document.getElementById('searchInput');
-            const filter = input.value.toUpperCase();
-            
-            if (filter === "") {{
-                paginationContainer.style.display = "flex";
-                showPage(1);
-            }} else {{
-                paginationContainer.style.display = "none";
-                allItems.forEach(item => {{
-                    const text = item.textContent || item.innerText;
-                    if (text.toUpperCase().indexOf(filter) > -1) {{
-                        item.style.display = "";
-                    }} else {{
-                        item.style.display = "none";
-                    }}
-                }});
-            }}
-        }}
+    # VIEWER
+    # CONTENU : document autonome chargé par l'iframe (mis en cache par le navigateur, rendu progressif)
+    prepare_frame_document(soup)
+    content_html = str(soup)
+    # L'arbre est cyclique : decompose() le libère tout de suite plutôt qu'au prochain passage du GC
+    soup.decompose()
+    del soup
+    with timed(stats, "write"):
+        with open(os.path.join(newsletter_path, "content.html"), "w", encoding='utf-8') as f:
+            f.write(content_html)
+    del content_html
+    nb_links = len(links)
+    date_arch_str = datetime.datetime.now().strftime('%Y-%m-%d %H:%M')
+
+    pixel_html_block = ""
+    if detected_pixels_list:
+        pixels_li = ""
+        for p_url, p_rule in detected_pixels_list:
+            display_url = p_url[:55] + "..." if len(p_url) > 55 else p_url
+            pixels_li += f"""
+            <li class="pixel-li">
+                <div class="pixel-row">
+                    <span class="icon-bug" style="color:green;">{ICON_CHECK}</span>
+                    <span class="pixel-url" title="{html.escape(p_url)}">{html.escape(display_url)}</span>
+                    <span class="pixel-rule" data-i18n-title="pixel_rule_title" title="Matched rule">{html.escape(p_rule)}</span>
+                </div>
+            </li>
+            """
+        pixel_html_block = f"""
+        <div class="meta-item">
+            <span class="meta-label" data-i18n="label_pixel_status">Summary</span>
+            <span class="status-badge ok"><span class="icon-status">{ICON_CHECK}</span> <span data-i18n="pixel_active_msg">active(s) (Will be counted)</span> ({len(detected_pixels_list)})</span>
+        </div>
+        <ul class="pixel-list">
+            {pixels_li}
+        </ul>
+        """
+    else:
+         pixel_html_block = f"""
+        <div class="meta-item">
+            <span class="status-badge warn"><span class="icon-status">{ICON_INFO}</span> <span data-i18n="no_pixels">No trackers detected</span></span>
+        </div>
+        """
 
-        showPage(1);
-        </script>
+    viewer_content = f"""
+    <!DOCTYPE html>
+    <html lang="en">
+    <head>
+        <meta charset="UTF-8">
+        <meta name="viewport" content="width=device-width, initial-scale=1.0">
+        <meta name="creation_date" content="{email_date_str}">
+        <meta name="sender" content="{sender_name}">
+        <meta name="archiving_date" content="{date_arch_str}">
+        <meta name="preheader" content="{safe_preheader_attr}">
+        <meta name="reading_time" content="{reading_time_str}">
+        <title>{subject}</title>
+        <link rel="stylesheet" href="../{STATIC_FILES['viewer.css']}">
+    </head>
+    <body>
+        <div id="global-tooltip" class="global-tooltip"></div>
+        <header class="header">
+            <div class="title">{subject}</div>
+            <div class="controls">
+                <button class="btn" onclick="toggleLanguage()" id="lang-toggle" title="Switch Language">
+                    <span>{ICON_LANG}</span>&nbsp;FR
+                </button>
+                <button class="btn" onclick="toggleHighlight()" id="btn-highlight" data-i18n-btn="btn_highlight">
+                    <span>{ICON_TARGET}</span>&nbsp;Highlight
+                </button>
+                <button class="btn" onclick="toggleLinks()" id="btn-links" data-i18n-btn="btn_infos">
+                    <span>{ICON_INFO}</span>&nbsp;Infos
+                </button>
+                <button class="btn" onclick="toggleMobile()" id="btn-mobile" data-i18n-btn="btn_mobile">
+                    <span>{ICON_MOBILE}</span>&nbsp;Mobile
+                </button>
+                <button class="btn" onclick="toggleDark()" id="btn-dark" data-i18n-btn="btn_dark">
+                    <span>{ICON_MOON}</span>&nbsp;Dark
+                </button>
+            </div>
+        </header>
+        <div class="main-view">
+            <div class="iframe-wrapper"><iframe id="emailFrame" src="content.html"></iframe></div>
+        </div>
+        <div class="sidebar" id="sidebar">
+
+            <!-- 1. METADATA (FIRST) -->
+            <div class="sidebar-section">
+                <h3 data-i18n="meta_section">{ICON_INFO} Metadata</h3>
+                <div class="meta-item"><span class="meta-label" data-i18n="label_sent">📅 Sent Date</span><span class="meta-val">{format_date_fr(email_date_str)}</span></div>
+                <div class="meta-item"><span class="meta-label" data-i18n="label_archived">🗄️ Archived Date</span><span class="meta-val">{format_date_fr(date_arch_str)}</span></div>
+                <div class="meta-item"><span class="meta-label" data-i18n="label_reading">⏱️ Reading Time</span><span class="meta-val">{reading_time_str}</span></div>
+                <div class="meta-item"><span class="meta-label" data-i18n="label_preheader">👀 Preheader (Preview)</span><div class="preheader-box">{safe_preheader_attr}</div></div>
+            </div>
+
+            <!-- 2. PIXELS (SECOND) -->
+            <div class="sidebar-section">
+                <h3 data-i18n="pixel_section">{ICON_WARN} Tracking Pixel(s)</h3>
+                {pixel_html_block}
+            </div>
+
+            <div class="sidebar-section">
+                <h3 data-i18n="links_section">{ICON_LINK} Detected Links ({nb_links})</h3>
+                <ul>{links_html}</ul>
+            </div>
+        </div>
+        <script src="../{STATIC_FILES['i18n.js']}"></script>
+        <script src="../{STATIC_FILES['viewer.js']}"></script>
     </body>
     </html>
     """
-    with open(f"{OUTPUT_FOLDER}/index.html", "w", encoding='utf-8') as f:
-        f.write(index_content)
 
-def process_emails():
+    with timed(stats, "write"):
+        with open(os.path.join(newsletter_path, "index.html"), "w", encoding='utf-8') as f:
+            f.write(viewer_content)
+    del viewer_content
+
+    job["result"] = {
+        "uid": job["uid"],
+        "message_id": job["message_id"],
+        "content_hash": job["content_hash"],
+        "processing_version": PROCESSING_VERSION,
+        "source": job["source"],
+        "assets": sorted(job["stored_assets"]),
+        "static": sorted(STATIC_FILES[name] for name in ("i18n.js", "viewer.css", "viewer.js")),
+        "search": get_search_prefixes(job["terms"]),
+        "meta": {
+            "title": subject,
+            "sender": sender_name,
+            "date_rec": email_date_str,
+            "date_arch": date_arch_str,
+            "preheader": job["preheader_txt"],
+            "reading_time": reading_time_str
+        }
+    }
+    job["status"] = "done"
+    add_timing(stats, "render", time.perf_counter() - start - (stats["timings"].get("write", 0.0) - write_before))
+
+# --- RECONSTRUCTION MULTI-CŒURS ---
+# Le parent ne fait que l'IMAP ; parsing, nettoyage, enrichissement et rendu tournent dans un pool de processus
+def init_rebuild_worker(output_folder):
+    global OUTPUT_FOLDER
+    OUTPUT_FOLDER = output_folder
+    # Chaque processus part de l'état des caches sur disque et renvoie ses nouvelles entrées au parent
+    get_redirect_cache().updates = []
+    get_asset_index().updates = []
+
+def rebuild_message(job):
+    job["stats"] = new_stats()
+    redirect_cache = get_redirect_cache()
+    asset_index = get_asset_index()
+    counters = (redirect_cache.hits, redirect_cache.misses, asset_index.downloaded, asset_index.not_modified)
+    start = time.monotonic()
+    # Les messages des étapes repassent au parent, qui les affiche d'un bloc : pas de lignes entremêlées entre processus
+    output = io.StringIO()
     try:
-        if not os.path.exists(OUTPUT_FOLDER):
-            os.makedirs(OUTPUT_FOLDER)
+        with contextlib.redirect_stdout(output):
+            for stage in (parse_message, enrich_message, render_message):
+                stage(job)
+                if job.get("status"): break
+    except Exception as e:
+        # L'exception elle-même n'est pas forcément sérialisable : seul son message repasse au parent
+        job["error"] = str(e)
+    release_job_payload(job)
+
+    return {
+        "status": job.get("status"),
+        "error": job.get("error"),
+        "subject": job.get("subject"),
+        "result": job.get("result"),
+        "terms": job.get("terms"),
+        "oversize": job.get("oversize"),
+        "output": output.getvalue(),
+        "stats": job["stats"],
+        "elapsed": time.monotonic() - start,
+        "memory": get_memory_usage(),
+        "redirects": redirect_cache.take_updates(),
+        "assets": asset_index.take_updates(),
+        "counters": (redirect_cache.hits - counters[0], redirect_cache.misses - counters[1],
+                     asset_index.downloaded - counters[2], asset_index.not_modified - counters[3])
+    }
 
-        print("Connexion au serveur Gmail...")
-        mail = imaplib.IMAP4_SSL("imap.gmail.com")
-        mail.login(GMAIL_USER, GMAIL_PASSWORD)
-        
-        rv, data = mail.select(f'"{TARGET_LABEL}"')
-        if rv != 'OK':
-            print(f"ERREUR: Impossible de trouver le libellé '{TARGET_LABEL}'.")
+def rebuild_in_pool(executor, job):
+    # Seuls les octets bruts partent vers le processus ; le DOM ne revient jamais vers le parent
+    task = {key: job.get(key) for key in ("id", "uid", "message_id", "size", "content_hash", "source", "raw", "parts")}
+    job["raw"] = job["parts"] = None
+    outcome = executor.submit(rebuild_message, task).result()
+    if outcome["output"]: sys.stdout.write(outcome["output"])
+
+    redirect_cache = get_redirect_cache()
+    asset_index = get_asset_index()
+    redirect_cache.merge(outcome["redirects"])
+    asset_index.merge(outcome["assets"])
+    hits, misses, downloaded, not_modified = outcome["counters"]
+    with redirect_cache.lock:
+        redirect_cache.hits += hits
+        redirect_cache.misses += misses
+    with asset_index.lock:
+        asset_index.downloaded += downloaded
+        asset_index.not_modified += not_modified
+
+    for key in ("status", "error", "subject", "result", "terms", "oversize", "memory"):
+        if outcome[key] is not None: job[key] = outcome[key]
+    merge_stats(job["stats"], outcome["stats"])
+    # Temps passé dans le processus, hors attente d'un processus libre
+    job["elapsed"] = job.get("elapsed", 0.0) + outcome["elapsed"]
+
+def release_job_payload(job):
+    from bs4 import BeautifulSoup
+    for key in JOB_PAYLOAD_KEYS:
+        value = job.pop(key, None)
+        if isinstance(value, BeautifulSoup): value.decompose()
+
+def get_memory_usage():
+    # (RSS actuelle, pic de RSS) du processus en Mo ; None si la plateforme ne les expose pas
+    current = peak = None
+    try:
+        with open("/proc/self/statm") as f:
+            current = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, AttributeError):
+        pass
+    if resource is not None:
+        # ru_maxrss est en Ko sous Linux, en octets sous macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+        if current is not None: peak = max(peak, current)
+    return current, peak
+
+def format_job_usage(job):
+    parts = [f"{job.get('elapsed', 0.0):.1f} s"]
+    current, peak = job.get("memory") or (None, None)
+    if current is not None: parts.append(f"RSS {current:.0f} Mo")
+    if peak is not None: parts.append(f"pic {peak:.0f} Mo")
+    return ", ".join(parts)
+
+# --- MESURES ---
+# Un dictionnaire de stats par message (job["stats"]) et un pour le run : durées par étape et compteurs
+def new_stats():
+    return {"timings": {}, "counters": {}}
+
+@contextlib.contextmanager
+def timed(stats, stage):
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        # L'étape la plus interne est la première à voir passer l'exception
+        stats.setdefault("error_stage", stage)
+        raise
+    finally:
+        add_timing(stats, stage, time.perf_counter() - start)
+
+def add_timing(stats, stage, seconds):
+    with _stats_lock:
+        stats["timings"][stage] = stats["timings"].get(stage, 0.0) + seconds
+
+def count(stats, key, value=1):
+    if stats is None: return
+    with _stats_lock:
+        stats["counters"][key] = stats["counters"].get(key, 0) + value
+
+def count_bytes(chunks, stats, key):
+    for chunk in chunks:
+        count(stats, key, len(chunk))
+        yield chunk
+
+def merge_stats(target, source):
+    with _stats_lock:
+        for section in ("timings", "counters"):
+            for key, value in source[section].items():
+                target[section][key] = target[section].get(key, 0) + value
+        if "error_stage" in source: target.setdefault("error_stage", source["error_stage"])
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+def get_job_report(job):
+    stats = job.get("stats") or new_stats()
+    status = "error" if job.get("error") else job.get("status")
+    current, peak = job.get("memory") or (None, None)
+    record = {
+        "id": job["id"],
+        "uid": job["uid"].decode() if isinstance(job["uid"], bytes) else job["uid"],
+        "status": status,
+        "elapsed": round(job.get("elapsed", 0.0), 4),
+        "timings": {stage: round(seconds, 4) for stage, seconds in stats["timings"].items()},
+        "counters": stats["counters"],
+        "rss_mb": current and round(current, 1),
+        "peak_rss_mb": peak and round(peak, 1)
+    }
+    if job.get("error"):
+        error = job["error"]
+        record["error"] = {"stage": stats.get("error_stage"), "message": str(error),
+                           "type": type(error).__name__ if isinstance(error, BaseException) else None}
+    return record
+
+def summarize_stages(run_stats, records):
+    stages = {}
+    for stage, seconds in run_stats["timings"].items():
+        stages[stage] = {"count": 1, "seconds": round(seconds, 4)}
+    samples = {}
+    for record in records:
+        for stage, seconds in record["timings"].items():
+            samples.setdefault(stage, []).append(seconds)
+    for stage, values in samples.items():
+        stages[stage] = {
+            "count": len(values),
+            "seconds": round(sum(values), 4),
+            "mean_ms": round(sum(values) / len(values) * 1000, 2),
+            "p95_ms": round(percentile(values, 0.95) * 1000, 2),
+            "max_ms": round(max(values) * 1000, 2)
+        }
+    return stages
+
+def write_run_report(report):
+    tmp_path = RUN_REPORT_FILE + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, RUN_REPORT_FILE)
+
+def print_table(headers, rows):
+    widths = [max(len(str(x)) for x in column) for column in zip(headers, *rows)]
+    for row in [headers] + rows:
+        print("  ".join(str(value).rjust(width) for value, width in zip(row, widths)))
+
+def print_run_summary(report):
+    rows = []
+    known = RUN_STAGES + MESSAGE_STAGES
+    for stage in known + sorted(set(report["stages"]) - set(known)):
+        summary = report["stages"].get(stage)
+        if not summary: continue
+        rows.append([stage, summary["count"], f"{summary['seconds']:.2f}",
+                     f"{summary['mean_ms']:.1f}" if "mean_ms" in summary else "",
+                     f"{summary['p95_ms']:.1f}" if "p95_ms" in summary else "",
+                     f"{summary['max_ms']:.1f}" if "max_ms" in summary else ""])
+    print(f"Récapitulatif ({report['duration']:.1f} s) :")
+    print_table(["étape", "appels", "total (s)", "moyenne (ms)", "p95 (ms)", "max (ms)"], rows)
+
+    totals = report["totals"]
+    statuses = ", ".join(f"{n} {STATUS_LABELS.get(status, status)}" for status, n in sorted(report["statuses"].items())) or "aucun"
+    print(f"Messages : {statuses}.")
+    print(f"Réseau : {totals.get('http_requests', 0)} requêtes HTTP, {totals.get('http_bytes', 0) / (1024 * 1024):.1f} Mo reçus ; "
+          f"source ({report['source']}) : {totals.get('source_bytes', 0) / (1024 * 1024):.1f} Mo lus.")
+    if report.get("queue", {}).get("remaining"):
+        print(f"File : {report['queue']['remaining']} emails restant à traiter ({QUEUE_FILE}).")
+    print(f"Rapport écrit dans {RUN_REPORT_FILE}.")
+
+def build_run_report(run_stats, records, started_at, duration, mode, workers):
+    totals = dict(run_stats["counters"])
+    statuses = {}
+    for record in records:
+        statuses[record["status"]] = statuses.get(record["status"], 0) + 1
+        for key, value in record["counters"].items():
+            totals[key] = totals.get(key, 0) + value
+    report = {
+        "started": started_at,
+        "duration": round(duration, 3),
+        "mode": mode,
+        "workers": workers,
+        "stages": summarize_stages(run_stats, records),
+        "totals": totals,
+        "statuses": statuses,
+        "memory_peak_mb": max((r["peak_rss_mb"] for r in records if r["peak_rss_mb"]), default=None),
+        "messages": records
+    }
+    if run_stats.get("error"): report["error"] = run_stats["error"]
+    return report
+
+# --- PROFILAGE (--profile) ---
+def run_profiled(func):
+    # cProfile ne suit que le thread qui l'active : chaque thread du pipeline tient son propre profil,
+    # fusionné à la fin. Les processus de --rebuild ne sont pas profilés.
+    global _profilers
+    _profilers = []
+    tracemalloc.start(PROFILE_TRACE_DEPTH)
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        return func()
+    finally:
+        profiler.disable()
+        snapshot = tracemalloc.take_snapshot()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        stats = pstats.Stats(profiler)
+        for thread_profiler in _profilers:
+            stats.add(thread_profiler)
+        _profilers = None
+        stats.dump_stats(PROFILE_FILE + ".prof")
+        with open(PROFILE_FILE + ".txt", "w", encoding="utf-8") as f:
+            stats.stream = f
+            # Temps cumulé (dominé par les attentes entre étapes), puis temps propre de chaque fonction
+            stats.sort_stats("cumulative").print_stats(PROFILE_TOP)
+            stats.sort_stats("tottime").print_stats(PROFILE_TOP)
+            f.write(f"Pic d'allocations Python (tracemalloc) : {peak / (1024 * 1024):.1f} Mo\n")
+            f.write("Allocations encore vivantes en fin de run, par ligne :\n")
+            for stat in snapshot.statistics("lineno")[:PROFILE_TOP]:
+                f.write(f"{stat}\n")
+        print(f"Profil écrit dans {PROFILE_FILE}.prof et {PROFILE_FILE}.txt.")
+
+def run_stage(func, inbox, outbox, state, consumers):
+    profiler = None
+    if _profilers is not None:
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Python 3.12+ : un seul profileur actif, qui suit déjà tous les threads
+            profiler = None
+    try:
+        process_stage_jobs(func, inbox, outbox, state, consumers)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            _profilers.append(profiler)
+
+def process_stage_jobs(func, inbox, outbox, state, consumers):
+    while True:
+        job = inbox.get()
+        if job is PIPELINE_DONE:
+            # Le dernier worker de l'étape à terminer prévient chacun des workers de l'étape suivante
+            with state["lock"]:
+                state["remaining"] -= 1
+                last = state["remaining"] == 0
+            if last:
+                for _ in range(consumers): outbox.put(PIPELINE_DONE)
             return
-
-        status, messages = mail.search(None, 'ALL')
-        if messages[0]:
-            email_ids = messages[0].split()
-            print(f"{len(email_ids)} emails trouvés au total.")
-
-            # PHASE 1 : Synchro
+        # Un message en erreur, inchangé ou ignoré traverse les étapes suivantes sans être traité
+        if not job.get("status") and not job.get("error"):
+            start = time.monotonic()
+            try:
+                func(job)
+            except Exception as e:
+                job["error"] = e
+            job["elapsed"] = job.get("elapsed", 0.0) + time.monotonic() - start
+        if job.get("status") or job.get("error"):
+            release_job_payload(job)
+        outbox.put(job)
+
+def run_pipeline(jobs, stages, queue_size=PIPELINE_QUEUE_SIZE):
+    # Files bornées entre étapes : une étape lente freine les précédentes au lieu d'accumuler des messages en mémoire
+    queues = [queue.Queue(maxsize=queue_size) for _ in range(len(stages) + 1)]
+    consumers = [workers for _, workers in stages] + [1]
+    threads = []
+    for i, (func, workers) in enumerate(stages):
+        state = {"remaining": workers, "lock": threading.Lock()}
+        for _ in range(workers):
+            threads.append(threading.Thread(target=run_stage, args=(func, queues[i], queues[i + 1], state, consumers[i + 1]), daemon=True))
+
+    def feed():
+        for job in jobs:
+            queues[0].put(job)
+        for _ in range(consumers[0]): queues[0].put(PIPELINE_DONE)
+    threads.append(threading.Thread(target=feed, daemon=True))
+
+    for t in threads: t.start()
+    while True:
+        job = queues[-1].get()
+        if job is PIPELINE_DONE: break
+        yield job
+    for t in threads: t.join()
+
+def save_checkpoint(manifest, search_changes, queue_items, skip_ids):
+    # Point d'étape : un run interrompu (budget, délai du job) ne perd pas les archives déjà écrites
+    update_search_index(search_changes)
+    search_changes.clear()
+    save_manifest(manifest)
+    save_queue(queue_items)
+    get_redirect_cache().save()
+    get_asset_index().save()
+    generate_index(skip_ids)
+
+def process_emails(force=False, workers=None, source=None, budget=None, stop=None):
+    # budget : secondes après lesquelles plus aucun email n'est lancé (ceux en cours se terminent) ;
+    # stop : threading.Event du daemon, même effet dès qu'il est levé.
+    # Renvoie le rapport du run ; report["error"] si le run s'est arrêté sur une erreur.
+    source = source or ImapSource()
+    run_stats = new_stats()
+    records = []
+    started_at = datetime.datetime.now().isoformat(timespec="seconds")
+    start = time.perf_counter()
+    deadline = start + budget if budget else None
+    queue_items = None
+    try:
+        if not os.path.exists(OUTPUT_FOLDER):
+            os.makedirs(OUTPUT_FOLDER)
+        # Sans .nojekyll, GitHub Pages ignore les dossiers préfixés par "_" (dont _assets)
+        nojekyll_path = os.path.join(OUTPUT_FOLDER, ".nojekyll")
+        if not os.path.exists(nojekyll_path):
+            open(nojekyll_path, "w").close()
+
+        publish_static_files()
+
+        with timed(run_stats, "open"):
+            opened = source.open()
+        if not opened: raise SourceUnavailable(f"source {source.name} indisponible")
+
+        manifest = load_manifest()
+        entries = manifest["entries"]
+        # Les UID d'un import de fichiers n'ont rien à voir avec ceux de la boîte IMAP
+        uid_reliable = False
+        if source.authoritative:
+            uid_reliable = source.uidvalidity is not None and manifest.get("uidvalidity") == source.uidvalidity
+            manifest["uidvalidity"] = source.uidvalidity
+
+        with timed(run_stats, "list"):
+            headers = source.list_headers()
+        count(run_stats, "source_bytes", sum(len(ref["header"]) for ref in headers))
+        if headers:
+            print(f"{len(headers)} emails trouvés au total.")
+
+            # PHASE 1 : Synchro (UID croissants : en cas de sujet identique, le plus récent l'emporte)
+            sync_start = time.perf_counter()
             valid_folder_ids = set()
             email_map = {}
-            for num in email_ids:
+            for ref in headers:
                 try:
-                    status, msg_data = mail.fetch(num, '(BODY.PEEK[HEADER.FIELDS (SUBJECT)])')
-                    msg_header = email.message_from_bytes(msg_data[0][1])
+                    msg_header = email.message_from_bytes(ref["header"])
                     raw_subject = get_decoded_email_subject(msg_header)
                     subject = clean_subject_prefixes(raw_subject)
                     f_id = get_deterministic_id(subject)
                     valid_folder_ids.add(f_id)
-                    email_map[f_id] = num
+                    email_map[f_id] = {
+                        "uid": ref["uid"],
+                        "size": ref["size"],
+                        "message_id": (msg_header["Message-ID"] or "").strip() or None,
+                        "source": ref.get("source", source.name),
+                        "key": ref.get("key"),
+                        "date": get_message_timestamp(ref, msg_header)
+                    }
                 except: pass
 
-            local_folders = set([f.name for f in os.scandir(OUTPUT_FOLDER) if f.is_dir() and not f.name.startswith('.')])
-            for f_id in (local_folders - valid_folder_ids):
-                shutil.rmtree(os.path.join(OUTPUT_FOLDER, f_id), ignore_errors=True)
-                print(f"Supprimé (Synchro): {f_id}")
-
-            # PHASE 2 : Traitement
-            folders_to_process = list(valid_folder_ids)[:BATCH_SIZE]
-            
+            search_changes = {}
+            if source.authoritative:
+                # Les archives importées depuis des fichiers ne sont pas dans la boîte : elles sont conservées
+                kept_ids = valid_folder_ids | {f_id for f_id, entry in entries.items() if entry.get("source", source.name) != source.name}
+                local_folders = set(list_archive_folders())
+                for f_id in (local_folders - kept_ids):
+                    shutil.rmtree(os.path.join(OUTPUT_FOLDER, f_id), ignore_errors=True)
+                    print(f"Supprimé (Synchro): {f_id}")
+                for f_id in list(entries):
+                    if f_id not in kept_ids:
+                        search_changes[f_id] = (entries.pop(f_id).get("search", []), None)
+
+            # PHASE 2 : Traitement (seulement les emails nouveaux ou modifiés, sauf reconstruction forcée),
+            # plus ce que la file des runs précédents a laissé : reconstruction interrompue, emails en erreur
+            previous_queue = load_queue()
+            pending_ids = []
+            for f_id in valid_folder_ids:
+                ref = email_map[f_id]
+                index_exists = os.path.exists(os.path.join(OUTPUT_FOLDER, f_id, "index.html"))
+                if (force or previous_queue.get(f_id, {}).get("force") or not index_exists
+                        or not is_up_to_date(entries.get(f_id), ref["uid"], ref["message_id"], uid_reliable)):
+                    pending_ids.append(f_id)
+            # Plus récents d'abord ; les emails déjà en échec passent après les autres
+            pending_ids.sort(key=lambda f_id: (previous_queue.get(f_id, {}).get("attempts", 0), -email_map[f_id]["date"], f_id))
+            folders_to_process = pending_ids[:BATCH_SIZE]
+
+            # La file persistée = tout ce qui reste à faire ; un email en sort dès qu'il est traité.
+            # Hors des emails listés, on ne garde que ce que cette source ne peut pas avoir supprimé.
+            queue_items = {f_id: item for f_id, item in previous_queue.items()
+                           if f_id not in valid_folder_ids and not source.authoritative}
+            for f_id in pending_ids:
+                previous = previous_queue.get(f_id, {})
+                queue_items[f_id] = {"force": bool(force or previous.get("force")), "attempts": previous.get("attempts", 0)}
+
+            add_timing(run_stats, "sync", time.perf_counter() - sync_start)
+            print(f"{len(valid_folder_ids) - len(pending_ids)} emails déjà à jour.")
             print(f"Mise à jour de {len(folders_to_process)} emails (batch)...")
 
-            for f_id in folders_to_process:
-                num = email_map[f_id]
-                try:
-                    status, msg_data = mail.fetch(num, '(RFC822)')
-                    msg = email.message_from_bytes(msg_data[0][1])
-                    
-                    raw_subject = get_decoded_email_subject(msg)
-                    subject = clean_subject_prefixes(raw_subject)
-                    sender_name = get_clean_sender(msg)
-                    email_date_str = get_email_date(msg)
-                    
-                    newsletter_path = os.path.join(OUTPUT_FOLDER, f_id)
-                    os.makedirs(newsletter_path, exist_ok=True)
-                    
-                    # EXTRACTION
-                    payload = None
-                    charset = None
-                    html_content = ""
-
-                    if msg.is_multipart():
-                        for part in msg.walk():
-                            if part.get_content_type() == "text/html":
-                                payload = part.get_payload(decode=True)
-                                charset = part.get_content_charset()
-                                break
+            jobs = [{
+                "id": f_id,
+                "uid": email_map[f_id]["uid"],
+                "message_id": email_map[f_id]["message_id"],
+                "size": email_map[f_id]["size"],
+                "entry": dict(entries[f_id]) if f_id in entries else None,
+                "source": email_map[f_id]["source"],
+                "force": queue_items[f_id]["force"],
+                "key": email_map[f_id]["key"],
+                "status": None,
+                "stats": new_stats()
+            } for f_id in folders_to_process]
+            started_ids = []
+            finished_ids = set()
+
+            def fetch_within_budget(job):
+                # Contrôle à la lecture (un seul worker, dans l'ordre) : passé le budget ou l'arrêt demandé,
+                # plus aucun email n'est lancé
+                if (deadline is not None and time.perf_counter() >= deadline) or (stop is not None and stop.is_set()):
+                    job["status"] = "deferred"
+                    return
+                started_ids.append(job["id"])
+                fetch_message(source, job, job["force"])
+
+            stages = [(fetch_within_budget, 1)]
+            executor = None
+            if workers:
+                print(f"Reconstruction sur {workers} processus...")
+                executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                               initializer=init_rebuild_worker, initargs=(OUTPUT_FOLDER,))
+                stages.append((lambda job: rebuild_in_pool(executor, job), workers))
+            else:
+                stages += [
+                    (parse_message, PARSE_WORKERS),
+                    (enrich_message, ENRICH_WORKERS),
+                    (render_message, RENDER_WORKERS),
+                ]
+
+            # Seul ce thread modifie le manifeste, au fil des messages terminés
+            pipeline_start = time.perf_counter()
+            last_checkpoint = pipeline_start
+            try:
+                for job in run_pipeline(jobs, stages):
+                    f_id = job["id"]
+                    if job["status"] == "deferred": continue
+                    finished_ids.add(f_id)
+                    job.setdefault("memory", get_memory_usage())
+                    records.append(get_job_report(job))
+                    # Traité, même ignoré : l'email sort de la file ; en erreur, il y reste et passera après les autres
+                    if job.get("error"):
+                        queue_items[f_id]["attempts"] += 1
                     else:
-                        if msg.get_content_type() == "text/html":
-                            payload = msg.get_payload(decode=True)
-                            charset = msg.get_content_charset()
-
-                    if not payload:
-                        print(f"Ignoré (Pas de HTML): {subject}")
-                        continue
-                    
-                    # DECODAGE
-                    decoding_options = [charset, 'utf-8', 'windows-1252', 'iso-8859-1']
-                    decoded = False
-                    for encoding in decoding_options:
-                        if not encoding: continue
-                        try:
-                            html_content = payload.decode(encoding)
-                            decoded = True
-                            break
-                        except (UnicodeDecodeError, LookupError):
-                            continue
-                    
-                    if not decoded:
-                        html_content = payload.decode('utf-8', errors='ignore')
-
-                    # PARSING
-                    soup = BeautifulSoup(html_content, "html.parser")
-                    
-                    # --- DETECTION PIXEL ---
-                    detected_pixels_list = []
-                    for img in soup.find_all("img"):
-                        src = img.get("src", "")
-                        if any(pattern in src for pattern in TRACKING_PATTERNS):
-                            detected_pixels_list.append(src)
-                            img['src'] = "" 
-                            img['alt'] = "[TRACKING PIXEL REMOVED]"
-                            img['style'] = "display:none !important;"
-
-                    # Nettoyage léger
-                    for s in soup(["script", "iframe", "object", "meta"]): 
-                        s.extract()
-
-                    # Gestion des blocs de transfert Gmail
-                    for div in soup.find_all("div"):
-                        if any(k in div.get_text() for k in ["Forwarded message", "Message transféré"]) and "-----" in div.get_text():
-                            new_body = soup.new_tag("body")
-                            for sibling in div.next_siblings: new_body.append(sibling)
-                            if soup.body:
-                                soup.body.replace_with(new_body)
-                            break
-                    
-                    # EXTRACTION PREHEADER
-                    raw_text = soup.get_text(separator=" ", strip=True)
-                    preheader_txt = raw_text[:160] + "..." if len(raw_text) > 160 else raw_text
-                    safe_preheader_attr = html.escape(preheader_txt, quote=True)
-
-                    # CALCUL DU TEMPS DE LECTURE
-                    word_count = len(raw_text.split())
-                    reading_time_min = max(1, round(word_count / 200))
-                    reading_time_str = f"{reading_time_min} min"
-
-                    # TRAITEMENT DES LIENS ET RÉSOLUTION DES REDIRECTIONS
-                    links = []
-                    link_idx = 0
-                    
-                    all_links = soup.find_all('a', href=True)
-                    print(f"   -> Résolution de {len(all_links)} liens...")
-                    
-                    for a in all_links:
-                        # MODIF: Ajouter un index de données pour la correspondance
-                        a['data-index'] = str(link_idx + 1)
-                        
-                        txt = a.get_text(strip=True) or "[Image/Vide]"
-                        link_id = f"detected-link-{link_idx}"
-                        a['id'] = link_id
-                        
-                        original_url = a['href']
-                        final_dest, chain = resolve_redirect_chain(original_url)
-                        
-                        chain_text = "\n⬇\n".join(chain)
-                        
-                        links.append({
-                            'id': link_id,
-                            'index': link_idx + 1,
-                            'txt': txt[:50] + "..." if len(txt)>50 else txt, 
-                            'original_url': original_url,
-                            'final_url': final_dest,
-                            'chain_text': chain_text
-                        })
-                        link_idx += 1
-                    
-                    # Génération HTML des liens
-                    links_html = ""
-                    for l in links:
-                        safe_tooltip = html.escape(l["chain_text"], quote=True)
-                        links_html += f'''
-                        <li class="link-card">
-                            <div class="link-card-header">
-                                <span class="link-number">#{l['index']}</span>
-                                {l["txt"]}
-                            </div>
-                            <div class="link-card-body">
-                                <div class="link-line" title="Original Link">
-                                    <span class="link-icon-box">{ICON_ORIGIN}</span>
-                                    <span class="link-url-text orig">{l["original_url"]}</span>
-                                </div>
-                                <div class="link-arrow-sep">{ICON_ARROW_DOWN}</div>
-                                <div class="link-line" title="Destination Link">
-                                    <span class="link-icon-box">{ICON_DEST}</span>
-                                    <span class="link-url-text dest">{l["final_url"]}</span>
-                                </div>
-                            </div>
-                            <div class="link-card-footer">
-                                <button class="btn-action btn-chain" data-tooltip="{safe_tooltip}" title="Show Redirect Path">
-                                    {ICON_CHAIN} Path
-                                </button>
-                                <button class="btn-action" onclick="scrollToLink('{l["id"]}')" title="Locate in Email">
-                                    {ICON_EYE} Locate
-                                </button>
-                                <button class="btn-action" onclick="copyToClipboard('{l["final_url"]}')" title="Copy Final URL">
-                                    {ICON_COPY} Copy
-                                </button>
-                            </div>
-                        </li>
-                        '''
-
-                    # --- IMAGES LOCALES ---
-                    img_counter = 0
-                    for img in soup.find_all("img"):
-                        lazy_attrs = ['data-src', 'data-original', 'data-lazy', 'data-url']
-                        for attr in lazy_attrs:
-                            if img.get(attr):
-                                img['src'] = img[attr] 
-                                del img[attr] 
-                                break
-                        
-                        if img.get('srcset'):
-                            if not img.get('src'):
-                                try:
-                                    first_url = img['srcset'].split(',')[0].split(' ')[0]
-                                    img['src'] = first_url
-                                except: pass
-                            del img['srcset'] 
-
-                        src = img.get("src")
-                        if not src or src.startswith("data:") or src.startswith("cid:"): continue
-                        
-                        try:
-                            if src.startswith("//"): src = "https:" + src
-                            r = requests.get(src, headers=HEADERS, timeout=10)
-                            if r.status_code == 200:
-                                content_type = r.headers.get('content-type', '')
-                                ext = mimetypes.guess_extension(content_type)
-                                if not ext: ext = ".jpg"
-                                if ext == ".jpe": ext = ".jpg"
-
-                                local_name = f"img_{img_counter}{ext}"
-                                local_path = os.path.join(newsletter_path, local_name)
-                                with open(local_path, "wb") as f: f.write(r.content)
-                                img['src'] = local_name
-                                img['loading'] = 'lazy'
-                                img_counter += 1
-                        except Exception: pass
-
-                    # CSS inline images
-                    css_url_pattern = re.compile(r'url\s*\((?:["\']?)(.*?)(?:["\']?)\)', re.IGNORECASE)
-                    for tag in soup.find_all(style=True):
-                        style = tag['style']
-                        if 'url' in style:
-                            matches = css_url_pattern.findall(style)
-                            new_style = style
-                            modified = False
-                            for url in matches:
-                                original_url = url.strip()
-                                if original_url.startswith("data:") or any(p in original_url for p in TRACKING_PATTERNS): continue
-                                target_url = original_url
-                                if target_url.startswith("//"): target_url = "https:" + target_url
-                                try:
-                                    r = requests.get(target_url, headers=HEADERS, timeout=10)
-                                    if r.status_code == 200:
-                                        content_type = r.headers.get('content-type', '')
-                                        ext = mimetypes.guess_extension(content_type) or ".jpg"
-                                        local_name = f"bg_{img_counter}{ext}"
-                                        local_path = os.path.join(newsletter_path, local_name)
-                                        with open(local_path, "wb") as f: f.write(r.content)
-                                        new_style = new_style.replace(original_url, local_name)
-                                        img_counter += 1
-                                        modified = True
-                                except: pass
-                            if modified: tag['style'] = new_style
-
-                    # VIEWER
-                    safe_html = json.dumps(str(soup))
-                    nb_links = len(links)
-                    date_arch_str = datetime.datetime.now().strftime('%Y-%m-%d %H:%M')
-                    
-                    pixel_html_block = ""
-                    if detected_pixels_list:
-                        pixels_li = ""
-                        for p_url in detected_pixels_list:
-                            display_url = p_url[:55] + "..." if len(p_url) > 55 else p_url
-                            pixels_li += f"""
-                            <li class="pixel-li">
-                                <div class="pixel-row">
-                                    <span class="icon-bug" style="color:green;">{ICON_CHECK}</span>
-                                    <span class="pixel-url" title="{html.escape(p_url)}">{html.escape(display_url)}</span>
-                                </div>
-                            </li>
-                            """
-                        pixel_html_block = f"""
-                        <div class="meta-item">
-                            <span class="meta-label" data-i18n="label_pixel_status">Summary</span>
-                            <span class="status-badge ok"><span class="icon-status">{ICON_CHECK}</span> <span data-i18n="pixel_active_msg">active(s) (Will be counted)</span> ({len(detected_pixels_list)})</span>
-                        </div>
-                        <ul class="pixel-list">
-                            {pixels_li}
-                        </ul>
-                        """
+                        queue_items.pop(f_id, None)
+                    if job.get("error"):
+                        stage = job["stats"].get("error_stage")
+                        print(f"Erreur traitement {f_id}{f' ({stage})' if stage else ''}: {job['error']} ({format_job_usage(job)})")
+                    elif job["status"] == "too_large":
+                        print(f"Ignoré (HTML trop volumineux, {job['oversize'] / (1024 * 1024):.1f} Mo): {f_id}")
+                    elif job["status"] == "unchanged":
+                        entries[f_id]["uid"] = job["uid"]
+                        entries[f_id]["message_id"] = job["message_id"]
+                        print(f"Inchangé: {f_id}")
+                    elif job["status"] == "skipped":
+                        print(f"Ignoré (Pas de HTML): {job['subject']}")
                     else:
-                         pixel_html_block = f"""
-                        <div class="meta-item">
-                            <span class="status-badge warn"><span class="icon-status">{ICON_INFO}</span> <span data-i18n="no_pixels">No trackers detected</span></span>
-                        </div>
-                        """
-
-                    viewer_content = f"""
-                    <!DOCTYPE html>
-                    <html lang="en">
-                    <head>
-                        <meta charset="UTF-8">
-                        <meta name="viewport" content="width=device-width, initial-scale=1.0">
-                        <meta name="creation_date" content="{email_date_str}">
-                        <meta name="sender" content="{sender_name}">
-                        <meta name="archiving_date" content="{date_arch_str}">
-                        <meta name="preheader" content="{safe_preheader_attr}">
-                        <meta name="reading_time" content="{reading_time_str}">
-                        <title>{subject}</title>
-                        <style>
-                            body {{ margin: 0; padding: 0; background: #eef2f5; font-family: Roboto, Helvetica, Arial, sans-serif; overflow: hidden; }}
-                            .header {{ position: fixed; top: 0; left: 0; right: 0; height: 60px; background: white; border-bottom: 1px solid #ddd; display: flex; align-items: center; justify-content: space-between; padding: 0 20px; z-index: 100; box-shadow: 0 2px 5px rgba(0,0,0,0.02); }}
-                            .title {{ font-size: 16px; font-weight: 600; color: #333; white-space: nowrap; overflow: hidden; text-overflow: ellipsis; margin-right: 20px; }}
-                            .controls {{ display: flex; gap: 10px; flex-shrink: 0; }}
-                            .btn {{ padding: 6px 12px; border: 1px solid #ccc; background: #f9f9f9; border-radius: 6px; cursor: pointer; font-size: 13px; display: flex; align-items: center; gap: 6px; transition: all 0.2s; color: #333; }}
-                            .btn:hover {{ background: #eee; }}
-                            .btn.active {{ background: #0070f3; color: white; border-color: #0070f3; }}
-                            .btn svg {{ display: block; }}
-                            .main-view {{ margin-top: 60px; height: calc(100vh - 60px); display: flex; justify-content: center; align-items: flex-start; background: #eef2f5; overflow: hidden; padding-top: 20px; }}
-                            .iframe-wrapper {{ width: 1000px; max-width: 95%; height: 90%; transition: width 0.3s ease; background: white; box-shadow: 0 2px 10px rgba(0,0,0,0.05); border-radius: 4px; }}
-                            iframe {{ width: 100%; height: 100%; border: none; display: block; border-radius: inherit; }}
-                            body.mobile-mode .iframe-wrapper {{ width: 375px; height: 812px; max-height: 85vh; border: none; box-shadow: 0 10px 40px rgba(0,0,0,0.15); }}
-                            
-                            /* --- SIDEBAR --- */
-                            .sidebar {{ position: fixed; top: 60px; right: -420px; width: 420px; height: calc(100vh - 60px); background: white; border-left: 1px solid #ddd; transition: right 0.3s; overflow-y: auto; z-index: 90; padding: 20px; box-sizing: border-box; display: flex; flex-direction: column; gap: 20px; }}
-                            .sidebar.open {{ right: 0; }}
-                            
-                            .sidebar h3 {{ margin-top: 0; font-size: 16px; color: #333; border-bottom: 1px solid #eee; padding-bottom: 10px; margin-bottom: 10px; display: flex; align-items: center; gap: 8px; }}
-                            .meta-item {{ margin-bottom: 12px; font-size: 13px; color: #555; }}
-                            .meta-label {{ font-weight: 600; display: block; margin-bottom: 3px; color: #333; }}
-                            .meta-val {{ word-break: break-word; line-height: 1.4; }}
-                            .preheader-box {{ background: #f8f9fa; padding: 10px; border-radius: 6px; border: 1px solid #eee; font-style: italic; color: #666; font-size: 12px; }}
-                            
-                            .status-badge {{ display: inline-flex; align-items: center; gap: 5px; font-weight: 500; }}
-                            .status-badge.ok {{ color: green; }}
-                            .status-badge.warn {{ color: orange; }}
-                            
-                            /* Pixel List Style */
-                            .pixel-list {{ list-style: none; padding: 0; margin: 0; background: #f0fff4; border: 1px solid #c3e6cb; border-radius: 4px; }}
-                            .pixel-li {{ padding: 8px; border-bottom: 1px solid #c3e6cb; }}
-                            .pixel-li:last-child {{ border-bottom: none; }}
-                            .pixel-row {{ display: flex; align-items: center; gap: 6px; color: #155724; font-size: 11px; }}
-                            .pixel-url {{ word-break: break-all; font-family: monospace; }}
-                            
-                            /* --- LINK CARD DESIGN --- */
-                            .sidebar ul {{ list-style: none; padding: 0; margin: 0; }}
-                            .link-card {{
-                                border: 1px solid #eee; border-radius: 8px; background: #fff; margin-bottom: 12px;
-                                box-shadow: 0 1px 3px rgba(0,0,0,0.05); overflow: hidden;
-                            }}
-                            .link-card-header {{
-                                padding: 8px 12px; background: #fcfcfc; border-bottom: 1px solid #f0f0f0;
-                                font-weight: 600; color: #333; font-size: 12px; text-overflow: ellipsis; overflow: hidden; white-space: nowrap;
-                                display: flex; align-items: center; gap: 8px;
-                            }}
-                            .link-number {{
-                                background: #eee; color: #555; padding: 1px 5px; border-radius: 4px; font-size: 10px; font-family: monospace;
-                            }}
-                            .link-card-body {{ padding: 10px 12px; }}
-                            .link-line {{ display: flex; align-items: center; gap: 8px; margin-bottom: 4px; }}
-                            .link-line:last-child {{ margin-bottom: 0; }}
-                            .link-icon-box {{ width: 16px; text-align: center; display: flex; justify-content: center; }}
-                            .link-url-text {{ font-family: monospace; font-size: 11px; word-break: break-all; line-height: 1.3; }}
-                            .link-url-text.orig {{ color: #888; }}
-                            .link-url-text.dest {{ color: #0070f3; font-weight: 600; }}
-                            .link-arrow-sep {{ padding-left: 20px; color: #ccc; font-size: 10px; margin: 2px 0; }}
-                            
-                            .link-card-footer {{
-                                padding: 6px 12px; background: #fafafa; border-top: 1px solid #f0f0f0; display: flex; gap: 10px; justify-content: flex-end;
-                            }}
-                            .btn-action {{
-                                border: none; background: transparent; padding: 4px 8px; cursor: pointer; color: #666;
-                                display: flex; align-items: center; gap: 4px; font-size: 11px; border-radius: 4px;
-                            }}
-                            .btn-action:hover {{ background: #eaeaea; color: #0070f3; }}
-                            
-                            /* Global Tooltip Fixed */
-                            .global-tooltip {{
-                                position: fixed; background: #333; color: white; padding: 10px; border-radius: 6px;
-                                z-index: 10000; max-width: 300px; font-size: 11px; pointer-events: none; display: none;
-                                box-shadow: 0 4px 10px rgba(0,0,0,0.2); white-space: pre-wrap; word-break: break-all; line-height: 1.4;
-                            }}
-                            .global-tooltip.visible {{ display: block; }}
-
-                            body.dark-mode .main-view {{ background: #121212; }}
-                            body.dark-mode .header {{ background: #1e1e1e; border-bottom-color: #333; }}
-                            body.dark-mode .title {{ color: #e0e0e0; }}
-                            body.dark-mode .btn {{ background: #2c2c2c; border-color: #444; color: #ccc; }}
-                            body.dark-mode .btn.active {{ background: #0070f3; color: white; }}
-                            body.dark-mode .iframe-wrapper {{ box-shadow: 0 0 25px rgba(255, 255, 255, 0.15); border: 1px solid #333; }}
-                            body.dark-mode .sidebar {{ background: #1e1e1e; border-left-color: #333; }}
-                            body.dark-mode .sidebar h3 {{ color: #fff; border-bottom-color: #333; }}
-                            body.dark-mode .meta-label {{ color: #ccc; }}
-                            body.dark-mode .meta-item {{ color: #aaa; }}
-                            body.dark-mode .preheader-box {{ background: #252525; border-color: #333; color: #aaa; }}
-                            
-                            body.dark-mode .pixel-list {{ background: #1e2e1e; border-color: #2b4c2b; }}
-                            body.dark-mode .pixel-li {{ border-bottom-color: #2b4c2b; }}
-                            body.dark-mode .pixel-row {{ color: #90cea1; }}
-                            
-                            body.dark-mode .link-card {{ background: #252525; border-color: #333; }}
-                            body.dark-mode .link-card-header {{ background: #2c2c2c; border-bottom-color: #333; color: #ddd; }}
-                            body.dark-mode .link-number {{ background: #333; color: #ccc; }}
-                            body.dark-mode .link-card-footer {{ background: #2c2c2c; border-top-color: #333; }}
-                            body.dark-mode .link-url-text.dest {{ color: #4da3ff; }}
-                            body.dark-mode .btn-action {{ color: #aaa; }}
-                            body.dark-mode .btn-action:hover {{ background: #333; color: #fff; }}
-                        </style>
-                    </head>
-                    <body>
-                        <div id="global-tooltip" class="global-tooltip"></div>
-                        <header class="header">
-                            <div class="title">{subject}</div>
-                            <div class="controls">
-                                <button class="btn" onclick="toggleLanguage()" id="lang-toggle" title="Switch Language">
-                                    <span>{ICON_LANG}</span>&nbsp;FR
-                                </button>
-                                <button class="btn" onclick="toggleHighlight()" id="btn-highlight" data-i18n-btn="btn_highlight">
-                                    <span>{ICON_TARGET}</span>&nbsp;Highlight
-                                </button>
-                                <button class="btn" onclick="toggleLinks()" id="btn-links" data-i18n-btn="btn_infos">
-                                    <span>{ICON_INFO}</span>&nbsp;Infos
-                                </button>
-                                <button class="btn" onclick="toggleMobile()" id="btn-mobile" data-i18n-btn="btn_mobile">
-                                    <span>{ICON_MOBILE}</span>&nbsp;Mobile
-                                </button>
-                                <button class="btn" onclick="toggleDark()" id="btn-dark" data-i18n-btn="btn_dark">
-                                    <span>{ICON_MOON}</span>&nbsp;Dark
-                                </button>
-                            </div>
-                        </header>
-                        <div class="main-view">
-                            <div class="iframe-wrapper"><iframe id="emailFrame"></iframe></div>
-                        </div>
-                        <div class="sidebar" id="sidebar">
-                            
-                            <!-- 1. METADATA (FIRST) -->
-                            <div class="sidebar-section">
-                                <h3 data-i18n="meta_section">{ICON_INFO} Metadata</h3>
-                                <div class="meta-item"><span class="meta-label" data-i18n="label_sent">📅 Sent Date</span><span class="meta-val">{format_date_fr(email_date_str)}</span></div>
-                                <div class="meta-item"><span class="meta-label" data-i18n="label_archived">🗄️ Archived Date</span><span class="meta-val">{format_date_fr(date_arch_str)}</span></div>
-                                <div class="meta-item"><span class="meta-label" data-i18n="label_reading">⏱️ Reading Time</span><span class="meta-val">{reading_time_str}</span></div>
-                                <div class="meta-item"><span class="meta-label" data-i18n="label_preheader">👀 Preheader (Preview)</span><div class="preheader-box">{safe_preheader_attr}</div></div>
-                            </div>
-                            
-                            <!-- 2. PIXELS (SECOND) -->
-                            <div class="sidebar-section">
-                                <h3 data-i18n="pixel_section">{ICON_WARN} Tracking Pixel(s)</h3>
-                                {pixel_html_block}
-                            </div>
-                            
-                            <div class="sidebar-section">
-                                <h3 data-i18n="links_section">{ICON_LINK} Detected Links ({nb_links})</h3>
-                                <ul>{links_html}</ul>
-                            </div>
-                        </div>
-                        <script>
-                            {JS_TRANSLATION_LOGIC}
-                            const emailContent = {safe_html};
-                            const frame = document.getElementById('emailFrame');
-                            frame.contentDocument.open();
-                            frame.contentDocument.write(emailContent);
-                            const meta = frame.contentDocument.createElement('meta');
-                            meta.name = 'viewport';
-                            meta.content = 'width=device-width, initial-scale=1.0';
-                            frame.contentDocument.head.appendChild(meta);
-                            const base = frame.contentDocument.createElement('base');
-                            base.target = '_blank';
-                            frame.contentDocument.head.appendChild(base);
-                            frame.contentDocument.close();
-                            const style = frame.contentDocument.createElement('style');
-                            style.textContent = `
-                                html {{ -ms-overflow-style: none; scrollbar-width: none; }}
-                                html::-webkit-scrollbar {{ display: none; }}
-                                body::-webkit-scrollbar {{ display: none; width: 0; }}
-                                body {{ margin: 0; padding: 0; font-family: Roboto, Helvetica, Arial, sans-serif; color: #222; line-height: 1.5; overflow-wrap: break-word; }}
-                                table {{ border-spacing: 0; border-collapse: collapse; }}
-                                img {{ height: auto !important; vertical-align: middle; border: 0; }}
-                                img[style*="display: block"], img[style*="display:block"] {{ margin-left: auto !important; margin-right: auto !important; }}
-                                a, .link-text {{ color: #1a0dab; }}
-                                html.dark-mode-internal {{ filter: invert(1) hue-rotate(180deg); }}
-                                html.dark-mode-internal img, html.dark-mode-internal video, html.dark-mode-internal [style*="background-image"] {{ filter: invert(1) hue-rotate(180deg); }}
-                                
-                                /* --- MODIF: BETTER HIGHLIGHT (SHADOW INSTEAD OF BORDER) --- */
-                                body.highlight-links a {{ 
-                                    position: relative; 
-                                    box-shadow: 0 0 0 3px red, 0 0 10px yellow !important; 
-                                    background-color: rgba(255, 255, 0, 0.2); 
-                                    z-index: 9999;
-                                    display: inline-block;
-                                }}
-                                /* Filter for images inside links to follow shape */
-                                body.highlight-links a img {{ 
-                                    filter: drop-shadow(0 0 3px red); 
-                                }}
-                                
-                                /* --- OVERLAY BADGE STYLE --- */
-                                .link-badge-overlay {{
-                                    position: absolute;
-                                    z-index: 2147483647;
-                                    background: black;
-                                    color: white;
-                                    border: 1px solid white;
-                                    border-radius: 50%;
-                                    width: 20px;
-                                    height: 20px;
-                                    font-size: 10px;
-                                    font-weight: bold;
-                                    display: flex;
-                                    justify-content: center;
-                                    align-items: center;
-                                    box-shadow: 0 2px 4px rgba(0,0,0,0.3);
-                                    pointer-events: none;
-                                }}
-
-                                @keyframes target-pulse {{ 
-                                    0% {{ transform: scale(1); box-shadow: 0 0 0 0 rgba(255, 0, 0, 0.7); }}
-                                    50% {{ transform: scale(1.05); box-shadow: 0 0 20px 10px rgba(255, 0, 0, 0); }}
-                                    100% {{ transform: scale(1); box-shadow: 0 0 0 0 rgba(255, 0, 0, 0); }}
-                                }}
-                                a.flash-target {{
-                                    position: relative;
-                                    z-index: 99999;
-                                    outline: 10px solid #ff0000 !important;
-                                    background-color: rgba(255, 255, 0, 0.5) !important;
-                                    animation: target-pulse 0.5s ease-in-out 4; /* 4 pulses */
-                                    box-shadow: 0 0 50px rgba(255,0,0,1); /* Big glow */
-                                }}
-
-                                @media screen and (max-width: 600px) {{ table, tbody, tr, td {{ width: 100% !important; min-width: 0 !important; box-sizing: border-box !important; height: auto !important; }} div[style*="width"] {{ width: 100% !important; max-width: 100% !important; }} img {{ width: auto !important; max-width: 100% !important; }} }}
-                            `;
-                            frame.contentDocument.head.appendChild(style);
-                            
-                            function toggleMobile() {{ document.body.classList.toggle('mobile-mode'); document.getElementById('btn-mobile').classList.toggle('active'); }}
-                            function toggleDark() {{ document.body.classList.toggle('dark-mode'); document.getElementById('btn-dark').classList.toggle('active'); if(frame.contentDocument.documentElement) {{ frame.contentDocument.documentElement.classList.toggle('dark-mode-internal'); }} }}
-                            function toggleLinks() {{ document.getElementById('sidebar').classList.toggle('open'); document.getElementById('btn-links').classList.toggle('active'); }}
-                            
-                            function toggleHighlight() {{ 
-                                const btn = document.getElementById('btn-highlight');
-                                const doc = frame.contentDocument;
-                                const body = doc.body;
-                                
-                                body.classList.toggle('highlight-links');
-                                btn.classList.toggle('active');
-                                
-                                const isActive = body.classList.contains('highlight-links');
-                                
-                                if (isActive) {{
-                                    // GENERATE OVERLAY BADGES
-                                    const links = doc.querySelectorAll('a[data-index]');
-                                    links.forEach(link => {{
-                                        const rect = link.getBoundingClientRect();
-                                        // Ignore hidden links
-                                        if(rect.width === 0 || rect.height === 0) return;
-                                        
-                                        const badge = doc.createElement('div');
-                                        badge.className = 'link-badge-overlay';
-                                        badge.textContent = link.getAttribute('data-index');
-                                        // Absolute positioning relative to body (scrolled)
-                                        badge.style.top = (rect.top + doc.documentElement.scrollTop - 10) + 'px';
-                                        badge.style.left = (rect.left + doc.documentElement.scrollLeft - 10) + 'px';
-                                        body.appendChild(badge);
-                                    }});
-                                }} else {{
-                                    // REMOVE BADGES
-                                    const badges = doc.querySelectorAll('.link-badge-overlay');
-                                    badges.forEach(b => b.remove());
-                                }}
-                            }}
-                            
-                            function copyToClipboard(text) {{ navigator.clipboard.writeText(text).then(() => {{ }}).catch(err => {{ console.error('Failed to copy: ', err); }}); }}
-                            function scrollToLink(id) {{ const el = frame.contentDocument.getElementById(id); if(el) {{ el.scrollIntoView({{behavior: 'smooth', block: 'center'}}); el.classList.add('flash-target'); setTimeout(() => el.classList.remove('flash-target'), 2000); }} else {{ console.warn('Link not found in iframe:', id); }} }}
-                            
-                            // TOOLTIP LOGIC SMART POSITION
-                            const tooltip = document.getElementById('global-tooltip');
-                            document.querySelectorAll('[data-tooltip]').forEach(btn => {{
-                                btn.addEventListener('mouseenter', e => {{
-                                    const text = btn.getAttribute('data-tooltip');
-                                    if(text) {{
-                                        tooltip.textContent = text;
-                                        tooltip.classList.add('visible');
-                                        
-                                        const rect = btn.getBoundingClientRect();
-                                        const viewportHeight = window.innerHeight;
-                                        
-                                        tooltip.style.right = (window.innerWidth - rect.left + 10) + 'px';
-                                        tooltip.style.left = 'auto';
-
-                                        if (rect.top > viewportHeight / 2) {{
-                                            tooltip.style.top = 'auto';
-                                            tooltip.style.bottom = (viewportHeight - rect.bottom) + 'px';
-                                        }} else {{
-                                            tooltip.style.top = rect.top + 'px';
-                                            tooltip.style.bottom = 'auto';
-                                        }}
-                                    }}
-                                }});
-                                btn.addEventListener('mouseleave', () => {{
-                                    tooltip.classList.remove('visible');
-                                }});
-                            }});
-                        </script>
-                    </body>
-                    </html>
-                    """
-                    
-                    with open(os.path.join(newsletter_path, "index.html"), "w", encoding='utf-8') as f:
-                        f.write(viewer_content)
-
-                except Exception as e:
-                    print(f"Erreur traitement {f_id}: {e}")
-
-            generate_index()
+                        old_prefixes = entries[f_id].get("search", []) if f_id in entries else []
+                        search_changes[f_id] = (old_prefixes, job["terms"])
+                        entries[f_id] = job["result"]
+                        print(f"Archivé: {f_id} ({format_job_usage(job)})")
+                    if time.perf_counter() - last_checkpoint >= CHECKPOINT_INTERVAL:
+                        with timed(run_stats, "checkpoint"):
+                            save_checkpoint(manifest, search_changes, queue_items, set(started_ids) - finished_ids)
+                        last_checkpoint = time.perf_counter()
+            finally:
+                if executor: executor.shutdown()
+                add_timing(run_stats, "pipeline", time.perf_counter() - pipeline_start)
+            deferred = len(folders_to_process) - len(started_ids)
+            if deferred:
+                reason = "Arrêt demandé" if stop is not None and stop.is_set() else f"Budget de {budget:.0f} s atteint"
+                print(f"{reason} : {deferred} emails reportés au prochain run.")
+
+            with timed(run_stats, "search_index"):
+                search_changes.update(backfill_search_terms(entries))
+                update_search_index(search_changes)
+            save_manifest(manifest)
+            save_queue(queue_items)
+            with timed(run_stats, "cleanup"):
+                collect_unused_assets(entries)
+                collect_unused_static(entries)
+                collect_unused_raw_messages(entries, manifest.get("uidvalidity"))
+            redirect_cache = get_redirect_cache()
+            redirect_cache.save()
+            print(f"Cache des redirections : {redirect_cache.hits} hits, {redirect_cache.misses} misses.")
+            asset_index = get_asset_index()
+            asset_index.save()
+            print(f"Images : {asset_index.downloaded} téléchargées, {asset_index.not_modified} inchangées (304).")
+            with timed(run_stats, "generate_index"):
+                generate_index()
             print("Terminé.")
         else:
             print("Aucun email trouvé.")
-        mail.close()
-        mail.logout()
     except Exception as e:
         print(f"Erreur critique: {e}")
+        run_stats["error"] = {"stage": run_stats.get("error_stage"), "message": str(e), "type": type(e).__name__}
+    finally:
+        # Même après une erreur : ni connexion IMAP ni mbox laissés ouverts
+        source.close()
+        if source.authoritative:
+            mode = "rebuild" if workers else "force" if force else "sync"
+        elif source.name == ImapSource.name:
+            mode = "daemon"
+        else:
+            mode = "reprocess" if source.name == RawCacheSource.name else "import"
+        report = build_run_report(run_stats, records, started_at, time.perf_counter() - start, mode, workers)
+        report["source"] = source.name
+        if queue_items is not None:
+            report["queue"] = {"budget": budget, "remaining": len(queue_items)}
+        try:
+            write_run_report(report)
+            print_run_summary(report)
+        except OSError as e:
+            print(f"Rapport d'exécution non écrit : {e}")
+    return report
+
+# --- MODE DAEMON ---
+def reset_cache_counters():
+    # Les caches restent chargés d'un cycle à l'autre ; seuls les compteurs affichés repartent de zéro
+    redirect_cache = get_redirect_cache()
+    redirect_cache.hits = redirect_cache.misses = 0
+    asset_index = get_asset_index()
+    asset_index.downloaded = asset_index.not_modified = 0
+
+def get_idle_event(line, event):
+    # EXPUNGE l'emporte : il impose une synchro complète
+    match = IDLE_EVENT_PATTERN.match(line)
+    if not match: return event
+    found = match.group(1).upper().decode()
+    return "EXPUNGE" if "EXPUNGE" in (event, found) else found
+
+def has_buffered_data(mail):
+    # Lignes déjà lues du socket par mail.file (arrivées avec la réponse "+ idling") ou déchiffrées
+    # par la couche SSL : select() ne les verrait pas. peek() en non bloquant ne consomme rien.
+    timeout = mail.sock.gettimeout()
+    mail.sock.setblocking(False)
+    try:
+        return bool(mail.file.peek(1))
+    except (BlockingIOError, ssl.SSLWantReadError):
+        return False
+    finally:
+        mail.sock.settimeout(timeout)
+
+def idle_wait(mail, stop, timeout):
+    # imaplib n'implémente pas IDLE (RFC 2177) avant Python 3.14 : commande envoyée à la main
+    tag = mail._new_tag()
+    mail.send(tag + b" IDLE\r\n")
+    line = mail.readline()
+    if not line.startswith(b"+"):
+        raise imaplib.IMAP4.error(f"IDLE refusé : {line.strip().decode(errors='replace')}")
+    event = None
+    deadline = time.monotonic() + timeout
+    while event is None and not stop.is_set() and time.monotonic() < deadline:
+        if not has_buffered_data(mail):
+            readable, _, _ = select.select([mail.sock], [], [], 1.0)
+            if not readable: continue
+        line = mail.readline()
+        if not line: raise imaplib.IMAP4.abort("connexion fermée pendant IDLE")
+        event = get_idle_event(line, event)
+    mail.send(b"DONE\r\n")
+    while True:
+        line = mail.readline()
+        if not line: raise imaplib.IMAP4.abort("connexion fermée pendant IDLE")
+        if line.startswith(tag): break
+        event = get_idle_event(line, event)
+    mail.tagged_commands.pop(tag, None)
+    return event
+
+def take_pending_event(mail):
+    # Réponses non sollicitées mises de côté par imaplib pendant les commandes (cycle en cours, NOOP) ; les retire
+    event = None
+    if mail.response("EXISTS")[1][0] is not None: event = "EXISTS"
+    if mail.response("EXPUNGE")[1][0] is not None: event = "EXPUNGE"
+    return event
+
+def poll_wait(mail, stop, interval):
+    # Repli sans IDLE : NOOP régulier, les réponses non sollicitées signalent les changements
+    if stop.wait(interval): return None
+    mail.noop()
+    return take_pending_event(mail)
+
+def wait_for_changes(mail, stop):
+    # Un email arrivé pendant le cycle est déjà signalé : pas d'attente
+    event = take_pending_event(mail)
+    if event: return event
+    if "IDLE" in mail.capabilities:
+        return idle_wait(mail, stop, DAEMON_IDLE_TIMEOUT)
+    return poll_wait(mail, stop, DAEMON_POLL_INTERVAL)
+
+def run_daemon(source=None):
+    source = source or ImapSource()
+    source.keep_open = True
+    stop = threading.Event()
+
+    def request_stop(signum, frame):
+        if stop.is_set(): raise KeyboardInterrupt   # second signal : arrêt immédiat
+        print("Arrêt demandé : fin du cycle en cours...")
+        stop.set()
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+
+    backoff = DAEMON_BACKOFF_MIN
+    full_sync_at = 0
+    while not stop.is_set():
+        try:
+            if source.mail is None:
+                if not source.open(): raise SourceUnavailable("connexion à Gmail impossible")
+                full_sync_at = 0   # changements manqués pendant la coupure, UIDVALIDITY peut-être changé
+            # Cycle complet (suppressions comprises) au démarrage, après un EXPUNGE et à intervalle régulier
+            if time.monotonic() >= full_sync_at:
+                source.since_uid = None
+                full_sync_at = time.monotonic() + DAEMON_FULL_SYNC_INTERVAL
+            else:
+                source.since_uid = source.last_uid
+            reset_cache_counters()
+            # Ce qui est signalé avant la liste des UID est couvert par ce cycle (dont l'EXISTS du SELECT)
+            take_pending_event(source.mail)
+            report = process_emails(source=source, stop=stop)
+            # Le run a rattrapé l'erreur : même traitement qu'une coupure, le délai ne repart de zéro qu'après un cycle sans erreur
+            if report.get("error"): raise SourceUnavailable(report["error"]["message"])
+            backoff = DAEMON_BACKOFF_MIN
+            if stop.is_set(): break
+            print("En attente de nouveaux emails...")
+            event = None
+            while event is None and not stop.is_set() and time.monotonic() < full_sync_at:
+                event = wait_for_changes(source.mail, stop)
+            if event == "EXPUNGE":
+                full_sync_at = 0
+        except (imaplib.IMAP4.error, OSError, SourceUnavailable) as e:
+            print(f"Cycle interrompu ({e}) : nouvelle tentative dans {backoff} s.")
+            source.disconnect()
+            stop.wait(backoff)
+            backoff = min(backoff * 2, DAEMON_BACKOFF_MAX)
+    source.disconnect()
+    print("Daemon arrêté.")
 
 if __name__ == "__main__":
-    process_emails()
+    parser = argparse.ArgumentParser(description="Archive les newsletters du libellé Gmail dans docs/.")
+    subparsers = parser.add_subparsers(dest="command", metavar="COMMANDE", help="sync si omise")
+    parser.set_defaults(command="sync", force=False, profile=False, budget=None)
+    # Options partagées par les commandes qui traitent des messages (profil et budget)
+    run_parser = argparse.ArgumentParser(add_help=False)
+    run_parser.add_argument("--profile", action="store_true", help=f"profile le run (cProfile et tracemalloc) dans {PROFILE_FILE}.prof et .txt")
+    run_parser.add_argument("--budget", type=float, metavar="SECONDES",
+                            help="ne lance plus de nouvel email passé ce délai ; le reste est gardé pour le run suivant")
+    force_parser = argparse.ArgumentParser(add_help=False)
+    force_parser.add_argument("--force", action="store_true", help="régénère toutes les archives, même celles déjà à jour")
+
+    subparsers.add_parser("sync", parents=[force_parser, run_parser], help="synchronise le libellé Gmail (archives nouvelles ou modifiées)")
+    rebuild_parser = subparsers.add_parser("rebuild", parents=[run_parser], help="régénère toutes les archives depuis Gmail, sur plusieurs processus")
+    rebuild_parser.add_argument("--workers", type=int, help=f"nombre de processus (défaut : {REBUILD_WORKERS})")
+    reprocess_parser = subparsers.add_parser("reprocess", parents=[run_parser], help=f"régénère des archives depuis {RAW_CACHE_FOLDER}, sans IMAP")
+    reprocess_parser.add_argument("ids", nargs="*", metavar="ID", help="archives à régénérer (toutes par défaut)")
+    reprocess_parser.add_argument("--workers", type=int, help=f"nombre de processus (défaut : {REBUILD_WORKERS})")
+    import_parser = subparsers.add_parser("import", parents=[force_parser, run_parser],
+                                          help="importe un mbox, un Maildir ou un dossier de .eml (rien n'est supprimé)")
+    import_parser.add_argument("path", metavar="CHEMIN")
+    import_parser.add_argument("--format", choices=["mbox", "maildir", "eml"], help="format de CHEMIN (défaut : détecté)")
+    import_parser.add_argument("--workers", type=int, help="nombre de processus (défaut : pipeline en threads)")
+    subparsers.add_parser("daemon", help="reste connecté et archive les nouveaux emails dès leur arrivée (IMAP IDLE), jusqu'à SIGTERM ou Ctrl+C")
+    subparsers.add_parser("index", help="régénère le sommaire depuis le manifeste, sans réseau ni identifiants")
+    bench_parser = subparsers.add_parser("bench", help="benchmarks hors ligne (dom, parsers, offline : voir benchmark.py)")
+    bench_parser.add_argument("bench_args", nargs=argparse.REMAINDER, metavar="ARGUMENTS")
+    args = parser.parse_args()
+
+    if args.command == "bench":
+        import benchmark
+        benchmark.main(args.bench_args)
+        sys.exit()
+    if args.command == "index":
+        run = regenerate_index
+    elif args.command == "daemon":
+        run = run_daemon
+    elif args.command == "reprocess":
+        run = lambda: process_emails(force=True, workers=max(1, args.workers or REBUILD_WORKERS), source=RawCacheSource(args.ids),
+                                     budget=args.budget)
+    elif args.command == "import":
+        workers = max(1, args.workers) if args.workers else None
+        run = lambda: process_emails(force=args.force, workers=workers, source=FileSource(args.path, args.format), budget=args.budget)
+    elif args.command == "rebuild":
+        run = lambda: process_emails(force=True, workers=max(1, args.workers or REBUILD_WORKERS), budget=args.budget)
+    else:
+        run = lambda: process_emails(force=args.force, budget=args.budget)
+    with run_lock() as locked:
+        if not locked: sys.exit(1)
+        if args.profile:
+            report = run_profiled(run)
+        else:
+            report = run()
+    # Run interrompu (identifiants absents, Gmail injoignable...) : code de sortie non nul pour que le workflow échoue
+    if report and report.get("error"): sys.exit(1)